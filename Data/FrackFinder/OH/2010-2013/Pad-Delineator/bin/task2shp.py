@@ -9,11 +9,15 @@ to an OGR datasource.
 
 from collections import OrderedDict
 import json
+from os.path import abspath, dirname, join
 import sys
 
 import click
 import fiona
 
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..')))
+from crowdtools.cache import ExportCache, load_cached_json
+
 
 _t = {
     'app_id': 27,
@@ -104,9 +108,9 @@ _tr = {
 
 @click.command()
 @click.argument(
-    'task_json', metavar='task.json', type=click.File(mode='r'), required=True)
+    'task_json', metavar='task.json', type=click.Path(exists=True, dir_okay=False), required=True)
 @click.argument(
-    'task_run_json', metavar='task_run.json', type=click.File(mode='r'), required=True)
+    'task_run_json', metavar='task_run.json', type=click.Path(exists=True, dir_okay=False), required=True)
 @click.argument(
     'outfile', metavar='outfile', required=True
 )
@@ -114,16 +118,21 @@ _tr = {
     '-f', '--format', '--driver', metavar='NAME', default='GeoJSON',
     help="Output driver."
 )
-def main(task_json, task_run_json, outfile, driver):
+@click.option(
+    '--export-cache/--no-export-cache', default=True,
+    help="Re-use task.json and task_run.json parsed by earlier runs."
+)
+def main(task_json, task_run_json, outfile, driver, export_cache):
 
     """
     Convert task.json and task_run.json to a spatial format.
     """
 
     # Index the tasks on  and task_runs on task_id
-    loaded_tasks = {t['id']: t for t in json.load(task_json)}
+    export_cache = ExportCache() if export_cache else None
+    loaded_tasks = {t['id']: t for t in load_cached_json(task_json, export_cache)}
     loaded_task_runs = {}
-    for tr in json.load(task_run_json):
+    for tr in load_cached_json(task_run_json, export_cache):
         if tr['task_id'] in loaded_task_runs:
             loaded_task_runs[tr['task_id']].append(tr)
         else:
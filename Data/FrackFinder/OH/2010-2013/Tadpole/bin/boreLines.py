@@ -49,6 +49,10 @@ except ImportError:
 ogr.UseExceptions()
 osr.UseExceptions()
 
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..')))
+from crowdtools.vector import LayerWriter
+from crowdtools.vector import lines_to_wkb
+
 
 #/* ======================================================================= */#
 #/*     Build Information
@@ -220,7 +224,7 @@ def main(args):
 
     # Defaults
     overwrite_mode = False
-    ogr_output_driver = 'ESRI Shapefile'
+    ogr_output_driver = None
     ogr_input_epsg = 4326
 
     # Containers
@@ -265,38 +269,27 @@ def main(args):
         reader = csv.DictReader(f)
 
         # Create OGR objects
-        srs = osr.SpatialReference()
-        srs.ImportFromEPSG(ogr_input_epsg)
-        driver = ogr.GetDriverByName(ogr_output_driver)
-        if overwrite_mode and isfile(outfile):
-            driver.DeleteDataSource(outfile)
-        datasource = driver.CreateDataSource(outfile)
-        layer = datasource.CreateLayer('borelines', srs, ogr.wkbLineString)
-        field_object = ogr.FieldDefn('status', ogr.OFTString)
-        field_object.SetWidth(254)
-        layer.CreateField(field_object)
+        writer = LayerWriter(outfile, [('status', 254, ogr.OFTString)], ogr.wkbLineString, epsg=ogr_input_epsg,
+                             driver=ogr_output_driver, layer_name='borelines', overwrite=overwrite_mode)
 
         # Process CSV file
+        statuses = []
+        coordinates = []
         for line in reader:
             surface_lat = float(line['Surface Lat'])
             surface_lng = float(line['Surface Long'])
             endpoint_lat = float(line['Endpoint Lat'])
             endpoint_lng = float(line['Endpoint Long'])
-            geometry = ogr.Geometry(ogr.wkbLineString)
-            geometry.AddPoint(surface_lng, surface_lat)
-            geometry.AddPoint(endpoint_lng, endpoint_lat)
-            feature = ogr.Feature(layer.GetLayerDefn())
-            feature.SetGeometry(geometry)
-            feature.SetField('status', line['Status'])
-            layer.CreateFeature(feature)
-
-    # Cleanup
-    feature = None
+            statuses.append(line['Status'])
+            coordinates.append(((surface_lng, surface_lat), (endpoint_lng, endpoint_lat)))
+
+        # Build all the lines at once and create features
+        for status, geometry in zip(statuses, lines_to_wkb(coordinates)):
+            writer.write_wkb({'status': status}, geometry)
+
+    # Cleanup - closing the writer also builds the spatial index
+    writer.close()
     line = None
-    layer = None
-    datasource = None
-    driver = None
-    srs = None
 
     # Success
     return 0
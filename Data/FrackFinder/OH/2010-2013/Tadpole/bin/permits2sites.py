@@ -85,6 +85,9 @@ except ImportError:
 ogr.UseExceptions()
 osr.UseExceptions()
 
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..')))
+from crowdtools.vector import LayerWriter
+
 
 #/* ======================================================================= */#
 #/*     Build Information
@@ -397,12 +400,7 @@ def main(args):
 
     # Create an in memory OGR datasource for use during processing
     try:
-        mem_srs = osr.SpatialReference()
-        mem_srs.ImportFromEPSG(input_data_epsg)
-        mem_driver = ogr.GetDriverByName('Memory')
-        mem_ds = mem_driver.CreateDataSource('temp_ogr_ds')
         mem_layer_name = 'temp_ogr_layer'
-        mem_layer = mem_ds.CreateLayer(mem_layer_name, mem_srs, ogr.wkbPoint)
         field_definitions = (('api', 254, ogr.OFTString),
                              ('epsg', 10, ogr.OFTInteger),
                              ('perm_date', 254, ogr.OFTString),
@@ -412,11 +410,9 @@ def main(args):
                              ('well_name', 254, ogr.OFTString),
                              ('end_lat', 254, ogr.OFTString),
                              ('end_long', 254, ogr.OFTString))
-        for f_name, f_width, f_type in field_definitions:
-            f_obj = ogr.FieldDefn(f_name, f_type)
-            f_obj.SetWidth(f_width)
-            mem_layer.CreateField(f_obj)
-    except RuntimeError, e:
+        mem_writer = LayerWriter('temp_ogr_ds', field_definitions, ogr.wkbPoint, epsg=input_data_epsg,
+                                 driver='Memory', layer_name=mem_layer_name)
+    except (RuntimeError, ValueError), e:
         print(e)
         return 1
 
@@ -438,21 +434,21 @@ def main(args):
             # Create and add feature
             geometry = ogr.Geometry(ogr.wkbPoint)
             geometry.AddPoint(lng, lat)
-            feature = ogr.Feature(mem_layer.GetLayerDefn())
-            feature.SetGeometry(geometry)
-            feature.SetField('api', api_num)
-            feature.SetField('epsg', epsg_code)
-            feature.SetField('perm_date', row['Permit Issued'])
-            feature.SetField('county', row['County'])
-            feature.SetField('status', row['Status'])
-            feature.SetField('operator', row['Operator'])
-            feature.SetField('well_name', row['Well Name & Number'])
-            feature.SetField('county', row['County'].title())
-            mem_layer.CreateFeature(feature)
+            mem_writer.write({'api': api_num,
+                              'epsg': epsg_code,
+                              'perm_date': row['Permit Issued'],
+                              'status': row['Status'],
+                              'operator': row['Operator'],
+                              'well_name': row['Well Name & Number'],
+                              'county': row['County'].title()}, geometry)
 
         # Cleanup
         geometry = None
-        feature = None
+
+    # Commit the features so the layer can be read back
+    mem_writer.flush()
+    mem_ds = mem_writer.data_source
+    mem_layer = mem_writer.layer
 
     #/* ======================================================================= */#
     #/*     Cluster Data
@@ -592,6 +588,7 @@ def main(args):
         mem_layer = None
         mem_ds = None
         iter_layer = None
+        mem_writer.close()
 
     #/* ======================================================================= */#
     #/*     Cleanup
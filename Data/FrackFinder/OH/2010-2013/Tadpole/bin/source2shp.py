@@ -53,6 +53,9 @@ except ImportError:
 ogr.UseExceptions()
 osr.UseExceptions()
 
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..')))
+from crowdtools.vector import LayerWriter
+
 
 #/* ======================================================================= */#
 #/*     Build Information
@@ -115,7 +118,7 @@ Usage:
 Options:
     --overwrite     Overwrite the output file
     --of=driver     Set output OGR driver
-                    [default: 'ESRI Shapefile']
+                    [default: based on the output file extension or 'GPKG']
     --epsg=int      Set EPSG code for input data
                     [default: 4326]
 """.format(__docname__))
@@ -259,7 +262,7 @@ def main(args):
 
     overwrite_mode = False
     ogr_input_epsg = 4326
-    ogr_output_driver = 'ESRI Shapefile'
+    ogr_output_driver = None
 
     #/* ======================================================================= */#
     #/*     Containers
@@ -368,7 +371,7 @@ def main(args):
     except ValueError:
         bail = True
         print("ERROR: Invalid input file EPSG code - must be an int: %s" % str(ogr_input_epsg))
-    if ogr_output_driver not in [ogr.GetDriver(i).GetName() for i in range(ogr.GetDriverCount())]:
+    if ogr_output_driver is not None and ogr_output_driver not in [ogr.GetDriver(i).GetName() for i in range(ogr.GetDriverCount())]:
         bail = True
         print("ERROR: Invalid output OGR driver: %s" % ogr_output_driver)
 
@@ -385,20 +388,9 @@ def main(args):
         reader = csv.DictReader(f)
 
         # Build OGR objects
-        driver = ogr.GetDriverByName(ogr_output_driver)
-        if overwrite_mode and isfile(outfile):
-            driver.DeleteDataSource(outfile)
-        elif not overwrite_mode and isfile(outfile):
+        if not overwrite_mode and isfile(outfile):
             print("ERROR: Problem with overwrite flag")
-            driver = None
             return 1
-        srs = osr.SpatialReference()
-        srs.ImportFromEPSG(ogr_input_epsg)
-        datasource = driver.CreateDataSource(outfile)
-        layer_name = basename(outfile).split('.')[1]
-        layer = datasource.CreateLayer(layer_name, srs, ogr.wkbPoint)
-
-        # Create fields
         field_definitions = (('perm_date', 40, ogr.OFTDate, None),
                              ('county', 254, ogr.OFTString, None),
                              ('township', 254, ogr.OFTString, None),
@@ -410,12 +402,10 @@ def main(args):
                              ('surf_long', 10, ogr.OFTReal, 8),
                              ('end_lat', 10, ogr.OFTReal, 8),
                              ('end_long', 10, ogr.OFTReal, 8))
-        for f_name, f_width, f_type, f_precision in field_definitions:
-            f_obj = ogr.FieldDefn(f_name, f_type)
-            f_obj.SetWidth(f_width)
-            if f_precision is not None:
-                f_obj.SetPrecision(f_precision)
-            layer.CreateField(f_obj)
+        layer_name = basename(outfile).split('.')[1]
+        writer = LayerWriter(outfile, field_definitions, ogr.wkbPoint, epsg=ogr_input_epsg,
+                             driver=ogr_output_driver, layer_name=layer_name, overwrite=overwrite_mode,
+                             index_fields=('api',))
 
         # Map input file fields to output file fields
         # TODO: Why are some perm_dates not populating?  Might have to run through datetime to normalize
@@ -442,18 +432,12 @@ def main(args):
             i += 1
             sys.stdout.write("\r\x1b[K" + "Processed %s lines" % str(i))
 
-            # Instantiate feature and create/set geometry
-            feature = ogr.Feature(layer.GetLayerDefn())
-            geometry = ogr.Geometry(ogr.wkbPoint)  # TODO: Shouldn't 'ogr.wkbPoint' come from feature.GetFeatureDefn()? Method doesn't actually
+            # Create geometry
+            geometry = ogr.Geometry(ogr.wkbPoint)
             geometry.AddPoint(float(line['Surface Long']), float(line['Surface Lat']))
-            feature.SetGeometry(geometry)
-
-            # Populate fields
-            for ifield, ofield, caster in ifield2map:
-                feature.SetField(ofield, caster(line[ifield]))
 
-            # Create feature
-            layer.CreateFeature(feature)
+            # Populate fields and create feature
+            writer.write({ofield: caster(line[ifield]) for ifield, ofield, caster in ifield2map}, geometry)
 
         # Required formatting due to progress printout
         print("")
@@ -462,13 +446,9 @@ def main(args):
     #/*     Cleanup
     #/* ======================================================================= */#
 
-    # Close OGR objects
+    # Close OGR objects and build indexes
     geometry = None
-    feature = None
-    layer = None
-    datasource = None
-    driver = None
-    srs = None
+    writer.close()
 
     # Success
     print("Done.")
@@ -58,10 +58,16 @@ Sample command:
 import os
 import sys
 import json
-import copy
-from os import linesep
+import multiprocessing
 from os.path import *
 
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..', '..')))
+from crowdtools.cache import ExportCache
+from crowdtools.profiling import Profiler, phase
+from crowdtools.sampling import SAMPLE_MODES, TaskSampler
+from crowdtools.compiler import CompilerConfig, Stage, compile_stages, get_validation_report, write_csv, \
+    write_json, write_npz
+
 
 __docname__ = basename(__file__)
 
@@ -108,9 +114,26 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #/*     Global Variables and Constants
 #/* ======================================================================= */#
 
-ERROR_COUNT = 0
 VERBOSE = False
 
+# Maps task_run.json['info']['selection'] to output fields - listed in the order ties are reported
+SELECTIONS = (('fracking', 'n_frk_res'), ('unknown', 'n_unk_res'), ('other', 'n_oth_res'))
+
+# Location attributes - output field and task.json['info'] key
+TASK_FIELDS = (('lat', 'latitude'), ('lng', 'longitude'), ('year', 'year'), ('wms_url', 'url'),
+               ('county', 'county'))
+
+# Scrubbed output CSV columns - location information and final answer
+SCRUBBED_HEADER = ('location', 'wms_url', 'lat', 'lng', 'year', 'county', 'comp_loc', 'n_frk_res', 'n_oth_res',
+                   'n_unk_res', 'n_tot_res', 'crowd_sel', 'p_crd_a', 'p_s_crd_a')
+
+# Compiled output CSV columns - location information, final answer, and every application's responses
+COMPILED_HEADER = ('location', 'wms_url', 'lat', 'lng', 'year', 'county',
+                   'n_frk_res', 'n_oth_res', 'n_unk_res', 'n_tot_res', 'comp_loc', 'crowd_sel', 'p_crd_a',
+                   'p_s_crd_a') + tuple(prefix + field for prefix in ('p_', 'fi_', 'fn_', 'sw_', 'mt_')
+                                        for field in ('n_frk_res', 'n_oth_res', 'n_unk_res', 'n_tot_res',
+                                                      'crowd_sel', 'p_crd_a', 'p_s_crd_a'))
+
 
 #/* ======================================================================= */#
 #/*     Define print_usage() function
@@ -143,10 +166,27 @@ Required:
 
 Optional:
     --sample=int -> Sample number of tasks to process
-    --validate   -> Perform a time consuming task run validation
+    --sample-mode=str -> head processes the first tasks in every application,
+                    random and stratified draw tasks from the public application
+                    in one pass and only keep those locations - defaults to head
+    --seed=int   -> Random seed for --sample-mode - defaults to 0
+    --strata=str -> Comma separated task info fields for stratified sampling
+                    - defaults to county,year
+    --jobs=int   -> Number of processes used to analyze applications - defaults to %s
+    --validate   -> Check every application for dropped locations, tasks without
+                    task runs, and locations that were never completed
+    --cn=str     -> Target compiled output.npz - requires numpy
+    --vr=str     -> Target validation report.json - implies --validate
+    --cache=str  -> Directory for per-application results - only applications
+                    whose input files changed since the last run are recomputed
+    --no-export-cache -> Parse every task.json and task_run.json instead of re-using
+                    the parsed copies kept in $CROWDTOOLS_CACHE_DIR or ~/.cache/crowdtools
+    --profile=str -> Write wall time, CPU time, peak memory, and throughput for
+                    every phase to a JSON report - memory tracing slows the run down
+    --profile-dump=str -> Write cProfile stats for the slowest phase - read with pstats
     --overwrite  -> Overwrite all output files
     --verbose    -> Print out additional errors
-""" % __docname__)
+""" % (__docname__, min(4, multiprocessing.cpu_count())))
     
     return 1
 
@@ -214,6 +254,14 @@ to get a good match, all lat/long values were rounded (via Python's round() func
 place when generating location keys.  This worked, but about 50 ponds have a location that doesn't match
 anything.  Re-processing data with the `dartfrog-taskCompiler.py` utility will produce errors with task ID's.
 
+##### Output Order #####
+
+Rows in every output and locations in `Compiled_Output.json` are listed in the order they first appear in
+the public task.json.  Within each location the JSON lists the location attributes, comp_loc, and final
+answer, then one object per application: public, first internal, final internal, sweeper, and missing.
+Earlier versions of this utility wrote an arbitrary order, so compare their outputs by content rather than
+by bytes.
+
 ##### Fields #####
 
 Note that the fields are the same for each application except for a few characters pre-pended to the field
@@ -359,399 +407,19 @@ def print_version():
 
 
 #/* ======================================================================= */#
-#/*     Define get_crowd_selection() function
-#/* ======================================================================= */#
-
-def get_crowd_selection(selection_count, selection_map):
-    """
-    Figure out what the crowd actually selected
-
-    :param selection_count: number of responses per selection
-    :type selection_count: dict
-    :param selection_map: maps selections to output fields
-    :type selection_map: dict
-
-    :return: the response with the most selections or tied responses separated by |
-    :rtype: str|None
-    """
-
-    # Cache containers
-    crowd_selection = None
-
-    # Figure out what the maximum number of selections was
-    max_selection = max(selection_count.values())
-
-    # Build the crowd_selection
-    if max_selection is 0:
-        crowd_selection = None
-    else:
-        for selection, count in selection_count.iteritems():
-            if count is max_selection:
-                if crowd_selection is None:
-                    crowd_selection = selection_map[selection]
-                else:
-                    crowd_selection += '|' + selection_map[selection]
-
-    # Return to user
-    return crowd_selection
-
-
-#/* ======================================================================= */#
-#/*     Define get_crowd_selection_counts() function
-#/* ======================================================================= */#
-
-def get_crowd_selection_counts(input_id, task_runs_json_object, location):
-
-    """
-    Figure out how many times the crowd selected each option
-
-    :param input_id: task.json['id']
-    :type input_id: int
-    :param task_runs_json_object: task runs from json.load(open('task_run.json'))
-    :type task_runs_json_object: list
-    :param location: unique location key (lat + long + year)
-    :type location: str
-
-    :return: number of times the crowd selected each classification for a given task
-    :rtype: dict
-    """
-
-    global VERBOSE
-    global ERROR_COUNT
-
-    counts = {'n_frk_res': None,
-              'n_unk_res': None,
-              'n_oth_res': None}
-    for task_run in task_runs_json_object:
-        if input_id == task_run['task_id']:
-            try:
-                selection = task_run['info']['selection']
-            except KeyError:
-                if VERBOSE:
-                    print("  -  task_id KeyError for get_crowd_selection_counts(): %s" % location)
-                ERROR_COUNT += 1
-            if selection == 'fracking':
-                if counts['n_frk_res'] is None:
-                    counts['n_frk_res'] = 1
-                else:
-                    counts['n_frk_res'] += 1
-            elif selection == 'unknown':
-                if counts['n_unk_res'] is None:
-                    counts['n_unk_res'] = 1
-                else:
-                    counts['n_unk_res'] += 1
-            elif selection == 'other':
-                if counts['n_oth_res'] is None:
-                    counts['n_oth_res'] = 1
-                else:
-                    counts['n_oth_res'] += 1
-            else:
-                raise ValueError("get_crowd_selection_counts()")
-    if counts.values() == [None, None, None]:
-        if VERBOSE:
-            print("  -  No task runs in get_crowd_selection_counts(): %s" % location)
-        ERROR_COUNT += 1
-
-    return copy.deepcopy(counts)
-
-
-#/* ======================================================================= */#
-#/*     Define get_percent_crowd_agreement() function
-#/* ======================================================================= */#
-
-def get_percent_crowd_agreement(crowd_selection, selection_counts, total_responses, map_selection_field,
-                                error_val=None):
-    """
-    Figure out how well the crowd agreed and if two answers tied, figure out the agreement for both
-
-    :param crowd_selection:
-    :type crowd_selection: str
-    :param selection_counts:
-    :type selection_counts:
-    :param total_responses:
-    :type total_responses:
-    :param map_selection_field:
-    :type map_selection_field:
-    :param error_val:
-    :type error_val:
-
-    :return: crowd agreement level rounded by forcing to int()
-    :rtype: int|None
-    """
-
-    # Compute crowd agreement
-    # The try/except blocks are for situations where tasks have never been viewed, which yields zero total_responses
-    per_crowd_agreement = None
-    split_per_crowd_agreement = None
-    o_dict = {}
-
-    # Make sure the crowd actually made a selection
-    if crowd_selection is None:
-        per_crowd_agreement = None
-        split_per_crowd_agreement = None
-    elif total_responses is 0:
-        per_crowd_agreement = error_val
-        split_per_crowd_agreement = error_val
-    else:
-        if '|' not in crowd_selection:
-            try:
-                per_crowd_agreement = int(selection_counts[map_selection_field[crowd_selection]] * 100 / total_responses)
-            except ZeroDivisionError:
-                per_crowd_agreement = error_val
-        else:
-
-            # Compute percent agreement for each split response
-            for selection in crowd_selection.split('|'):
-                field_name = map_selection_field[selection]
-                selection_count = selection_counts[field_name]
-                try:
-                    per_crowd_agreement = int(selection_count * 100 / total_responses)
-                except ZeroDivisionError:
-                    per_crowd_agreement = error_val
-                if split_per_crowd_agreement is None:
-                    split_per_crowd_agreement = str(per_crowd_agreement)
-                else:
-                    split_per_crowd_agreement += '|' + str(per_crowd_agreement)
-
-            # Make sure the percent crowd agreement field is None when there is a split response
-            per_crowd_agreement = error_val
-
-    # Construct output and return
-    o_dict['p_crd_a'] = per_crowd_agreement
-    o_dict['p_s_crd_a'] = split_per_crowd_agreement
-
-    return copy.deepcopy(o_dict)
-
-
-#/* ======================================================================= */#
-#/*     Define get_locations() function
-#/* ======================================================================= */#
-
-def get_locations(tasks):
-
-    """
-    Get a list of unique locations from a set of tasks
-
-    :param tasks: tasks from json.load(open('task.json'))
-    :type tasks: list
-
-    :return: unique list of locations, which will be used as a primary key to link everything together
-    :rtype: list
-    """
-
-    output_set = []
-    for task in tasks:
-        lat = str(round(task['info']['latitude'], 8))
-        lng = str(round(task['info']['longitude'], 8))
-        year = str(task['info']['year'])
-        location = lat + lng + '---' + year
-        output_set.append(location)
-
-    return list(set(output_set))
-
-
-#/* ======================================================================= */#
-#/*     Define get_task_runs() function
-#/* ======================================================================= */#
-
-def get_task_runs(task_id, task_runs_json):
-
-    """
-    Search through all task runs to get the set matching the input task id
-
-    :param task_id: task.json['id'] for the task we want the associated task runs for
-    :type task_id: int
-    :param task_runs_json: task runs from json.load(open('task_run.json'))
-    :type task_runs_json: list
-
-    :return: all task runs where task_run.json['task_id'] == :param task_id:
-    :rtype: list
-    """
-
-    output_list = []
-    for tr in task_runs_json:
-        if task_id == tr['task_id']:
-            output_list.append(tr)
-
-    return output_list
-
-
-#/* ======================================================================= */#
-#/*     Define load_json() function
-#/* ======================================================================= */#
-
-def load_json(input_file):
-
-    """
-    Load a JSON file into a JSON object
-
-    :param input_file:
-    :type input_file:
-
-    :return: loaded JSON object
-    :rtype: list
-    """
-
-    with open(input_file, 'r') as f:
-        output_json = json.load(f)
-
-    return output_json
-
-
-#/* ======================================================================= */#
-#/*     Define analyze_tasks() function
-#/* ======================================================================= */#
-
-def analyze_tasks(locations, tasks, task_runs, comp_loc, comp_key, sample=None):
-
-    """
-    Create a dictionary with a location as a key and task stats as values,
-    which includes the number of times each task was responded to, how many
-    times a given classification was chosen, etc.
-
-    The locations parameter is updated with information from the tasks
-    parameter and task_runs parameter and then returned at the very end of
-    the function.
-
-    The actual use case is calling the function multiple times, once with data
-    from each application, in order to reconstruct each task's history.
-
-    :param locations:
-    :type locations: dict
-    :param tasks:
-    :type tasks: list
-    :param task_runs:
-    :type task_runs: list
-    :param comp_loc: application being processed
-    :type comp_loc: str
-    :param comp_key: used to reference task attributes for specific applications
-    :type comp_key: str
-    :param sample: sub-sample size
-    :type sample: int
-
-    :return:
-    :rtype:
-    """
-
-    global VERBOSE
-    global ERROR_COUNT
-
-    # == Analyze Public Tasks == #
-
-    # Get a sample if necessary
-    if sample is not None:
-        tasks = tasks[:sample]
-
-    # Map field names to selections
-    map_field_to_selection = {'n_frk_res': 'fracking',
-                              'n_oth_res': 'other',
-                              'n_unk_res': 'unknown'}
-
-    # Map selections to field names
-    map_selection_to_field = {'fracking': 'n_frk_res',
-                              'other': 'n_oth_res',
-                              'unknown': 'n_unk_res'}
-
-    # Loop through tasks and collect public attributes
-    print("Analyzing %s tasks..." % comp_loc)
-    i = 0
-    tot_tasks = len(tasks)
-    for task in tasks:
-
-        # Update user
-        i += 1
-        sys.stdout.write("\r\x1b[K" + "  %s/%s" % (str(i), str(tot_tasks)))
-        sys.stdout.flush()
-
-        # Cache important identifiers
-        task_location = get_locations([task])[0]
-        task_id = task['id']
-
-        # Make sure the task location is actually in the master list - if not, delete it
-        if task_location not in locations:
-            if VERBOSE:
-                print("  -  Dropped location: %s" % task_location)
-            ERROR_COUNT += 1
-        else:
-
-            # Store the easy stuff first
-            locations[task_location]['lat'] = task['info']['latitude']
-            locations[task_location]['lng'] = task['info']['longitude']
-            locations[task_location]['year'] = task['info']['year']
-            locations[task_location]['wms_url'] = task['info']['url']
-            locations[task_location]['county'] = task['info']['county']
-            locations[task_location]['comp_loc'] = comp_loc
-
-            # Get selection counts
-            task_stats_template = {'n_unk_res': None,
-                                   'n_frk_res': None,
-                                   'n_oth_res': None,
-                                   'n_tot_res': None,
-                                   'crowd_sel': None,
-                                   'p_crd_a': None,
-                                   'p_s_crd_a': None}
-            task_stats = copy.deepcopy(task_stats_template)
-            selection_counts = get_crowd_selection_counts(task_id, task_runs, task_location)
-            total_responses = sum([sc for sc in selection_counts.values() if sc is not None])
-            if total_responses is 0:
-                total_responses = None
-            crowd_selection = get_crowd_selection(selection_counts, map_field_to_selection)
-            crowd_agreement = get_percent_crowd_agreement(crowd_selection, selection_counts,
-                                                          len(get_task_runs(task_id, task_runs)),
-                                                          map_selection_to_field)
-            task_stats = dict(task_stats.items() + selection_counts.items())
-            task_stats = dict(task_stats.items() + crowd_agreement.items())
-            task_stats['n_tot_res'] = total_responses
-            task_stats['crowd_sel'] = crowd_selection
-
-            # Add everything to the general task, public subsection
-            for key, val in task_stats.iteritems():
-                locations[task_location][key] = val
-                locations[task_location][comp_key][key] = val
-
-    # Done with public
-    print("  -  Done")
-    return copy.deepcopy(locations)
-
-
-#/* ======================================================================= */#
-#/*     Define is_location_complete() function
+#/*     Define log() function
 #/* ======================================================================= */#
 
-def is_location_complete(location, tasks, task_runs):
+def log(message):
 
     """
-    Figure out if a given location was fully completed in a given task/task_run set
-
-    Determined by sifting through the tasks to find the location's redundancy
-    and then sifting through the task_runs to see if there are enough task runs
-    to say the task has been completed.
+    Print progress messages from crowdtools.compiler
 
-    :param location: the location primary key (lat + long + year)
-    :type location: str
-    :param tasks: tasks from json.load(open('task.json'))
-    :type tasks: list
-    :param task_runs: task runs from json.load(open('task_run.json'))
-    :type task_runs: list
-
-    :return: True if complete and False if not
-    :rtype: bool
+    :param message: message to print
+    :type message: str
     """
 
-    # Translate location to a task.json ID
-    task_id = None
-    for task in tasks:
-        if location == get_locations([task]):
-            task_id = task['id']
-            break
-    else:
-        print("ERROR: is_location_complete(): No task id for: %s" % location)
-        return False
-
-    # Get task_runs
-    for task_run in task_runs:
-        if str(task_id) == str(task_run['task_id']):
-            return True
+    print(message)
 
 
 #/* ======================================================================= */#
@@ -778,7 +446,16 @@ def main(args):
 
     overwrite_outfiles = False
     sample_size = None
+    sample_mode = 'head'
+    sample_seed = 0
+    sample_strata = ('county', 'year')
     validate_tasks = False
+    validation_report_file = None
+    cache_dir = None
+    use_export_cache = True
+    profile_report_file = None
+    profile_dump_file = None
+    jobs = min(4, multiprocessing.cpu_count())
 
     #/* ======================================================================= */#
     #/*     Containers
@@ -786,6 +463,7 @@ def main(args):
 
     compiled_output_csv_file = None
     compiled_output_json_file = None
+    compiled_output_npz_file = None
     scrubbed_output_csv_file = None
     public_tasks_file = None
     public_task_runs_file = None
@@ -859,13 +537,42 @@ def main(args):
         elif '--cj=' in arg:
             compiled_output_json_file = arg.split('=', 1)[1]
 
+        # Compiled output NPZ
+        elif '--cn=' in arg:
+            compiled_output_npz_file = arg.split('=', 1)[1]
+
         # Process a sample set
         elif '--sample=' in arg:
             sample_size = int(arg.split('=', 1)[1])
-
-        # Include time consuming validation step
+        elif '--sample-mode=' in arg:
+            sample_mode = arg.split('=', 1)[1]
+        elif '--seed=' in arg:
+            sample_seed = int(arg.split('=', 1)[1])
+        elif '--strata=' in arg:
+            sample_strata = tuple(arg.split('=', 1)[1].split(','))
+
+        # Per application results from previous runs
+        elif '--cache=' in arg:
+            cache_dir = arg.split('=', 1)[1]
+        elif arg == '--no-export-cache':
+            use_export_cache = False
+
+        # Number of processes used to analyze applications
+        elif '--jobs=' in arg:
+            jobs = int(arg.split('=', 1)[1])
+
+        # Include validation step
         elif arg == '--validate':
             validate_tasks = True
+        elif '--vr=' in arg:
+            validation_report_file = arg.split('=', 1)[1]
+            validate_tasks = True
+
+        # Profiling
+        elif '--profile=' in arg:
+            profile_report_file = arg.split('=', 1)[1]
+        elif '--profile-dump=' in arg:
+            profile_dump_file = arg.split('=', 1)[1]
 
         # Overwrite output files
         elif arg == '--overwrite':
@@ -905,6 +612,15 @@ def main(args):
         if isfile(compiled_output_json_file) and not overwrite_outfiles:
             print("ERROR: Compiled output JSON exists: %s" % compiled_output_json_file)
             bail = True
+    if compiled_output_npz_file is not None:
+        if isfile(compiled_output_npz_file) and not overwrite_outfiles:
+            print("ERROR: Compiled output NPZ exists: %s" % compiled_output_npz_file)
+            bail = True
+        try:
+            import numpy
+        except ImportError:
+            print("ERROR: Writing compiled output NPZ requires numpy")
+            bail = True
     if scrubbed_output_csv_file is None:
         print("ERROR: No scrubbed output CSV supplied")
         bail = True
@@ -943,392 +659,120 @@ def main(args):
         print("ERROR: Can't access missing task runs: %s" % missing_task_runs_file)
         bail = True
 
+    if validation_report_file is not None and isfile(validation_report_file) and not overwrite_outfiles:
+        print("ERROR: Validation report JSON exists: %s" % validation_report_file)
+        bail = True
+    for outfile in (profile_report_file, profile_dump_file):
+        if outfile is not None and isfile(outfile) and not overwrite_outfiles:
+            print("ERROR: Profile output exists: %s" % outfile)
+            bail = True
+    if cache_dir is not None and not isdir(cache_dir):
+        print("ERROR: Cache directory doesn't exist: %s" % cache_dir)
+        bail = True
+    if jobs < 1:
+        print("ERROR: Invalid --jobs: %s" % jobs)
+        bail = True
+    if sample_mode not in SAMPLE_MODES:
+        print("ERROR: Invalid --sample-mode: %s" % sample_mode)
+        bail = True
+    elif sample_mode != 'head' and sample_size is None:
+        print("ERROR: --sample-mode=%s requires --sample" % sample_mode)
+        bail = True
+
     if bail:
         return 1
 
     #/* ======================================================================= */#
-    #/*     Load Data
-    #/* ======================================================================= */#
-
-    # Public task.json
-    print("Loading public tasks: %s" % public_tasks_file)
-    public_tasks = load_json(public_tasks_file)
-    print("  %s" % str(len(public_tasks)))
-
-    # Public task_run.json
-    print("Loading public task runs: %s" % public_task_runs_file)
-    public_task_runs = load_json(public_task_runs_file)
-    print("  %s" % str(len(public_task_runs)))
-
-    # First internal task.json
-    print("Loading first internal tasks: %s" % first_internal_tasks_file)
-    first_internal_tasks = load_json(first_internal_tasks_file)
-    print("  %s" % str(len(first_internal_tasks)))
-
-    # First internal task_run.json
-    print("Loading first internal task runs: %s" % first_internal_task_runs_file)
-    first_internal_task_runs = load_json(first_internal_task_runs_file)
-    print("  %s" % str(len(first_internal_task_runs)))
-
-    # Final internal task.json
-    print("Loading final internal tasks: %s" % final_internal_tasks_file)
-    final_internal_tasks = load_json(final_internal_tasks_file)
-    print("  %s" % str(len(final_internal_tasks)))
-
-    # Final internal task_run.json
-    print("Loading final internal task runs: %s" % final_internal_task_runs_file)
-    final_internal_task_runs = load_json(final_internal_task_runs_file)
-    print("  %s" % str(len(final_internal_task_runs)))
-
-    # Sweeper task.json
-    print("Loading sweeper internal tasks: %s" % sweeper_tasks_file)
-    sweeper_tasks = load_json(sweeper_tasks_file)
-    print("  %s" % str(len(sweeper_tasks)))
-
-    # Sweeper task_run.json
-    print("Loading sweeper internal task runs: %s" % sweeper_task_runs_file)
-    sweeper_task_runs = load_json(sweeper_task_runs_file)
-    print("  %s" % str(len(sweeper_task_runs)))
-
-    # Missing task.json
-    print("Loading missing internal tasks: %s" % missing_tasks_file)
-    missing_tasks = load_json(missing_tasks_file)
-    print("  %s" % str(len(missing_tasks)))
-
-    # Missing task_runs.json
-    print("Loading missing internal task_runs...")
-    missing_task_runs = load_json(missing_task_runs_file)
-    print("  %s" % str(len(missing_task_runs)))
-
-    #/* ======================================================================= */#
-    #/*     Get Locations to Analyze
+    #/*     Analyze and Merge Applications
     #/* ======================================================================= */#
 
-    # Get list
-    print("Getting list of unique locations...")
-    location_list = get_locations(public_tasks)
-    print("Found %s locations" % str(len(location_list)))
-
-    # Make sure locations are all accounted for
-    drop_locations = []
-    v_error = False
-    p_missing = 0
-    fi_missing = 0
-    fn_missing = 0
-    sw_missing = 0
-    mt_missing = 0
-    print("Validating public locations...")
-    for task in public_tasks:
-        location = get_locations([task])[0]
-        if location not in location_list:
-            drop_locations.append(location)
-            p_missing += 1
-            v_error = True
-    print("Validating first internal locations...")
-    for task in first_internal_tasks:
-        location = get_locations([task])[0]
-        if location not in location_list:
-            drop_locations.append(location)
-            fi_missing += 1
-            v_error = True
-    print("Validating final internal locations...")
-    for task in final_internal_tasks:
-        location = get_locations([task])[0]
-        if location not in location_list:
-            drop_locations.append(location)
-            fn_missing += 1
-            v_error = True
-    print("Validating sweeper internal locations...")
-    for task in sweeper_tasks:
-        location = get_locations([task])[0]
-        if location not in location_list:
-            drop_locations.append(location)
-            sw_missing += 1
-            v_error = True
-    print("Validating missing internal locations...")
-    for task in missing_tasks:
-        location = get_locations([task])[0]
-        if location not in location_list:
-            drop_locations.append(location)
-            mt_missing += 1
-            v_error = True
-    if v_error:
-        print("  Missing Public: %s" % str(p_missing))
-        print("  Missing First Internal: %s" % str(fi_missing))
-        print("  Missing Final Internal: %s" % str(fn_missing))
-        print("  Missing Sweeper: %s" % str(sw_missing))
-        print("  Missing missing: %s" % str(mt_missing))
+    # Applications in the order they are analyzed - later applications override earlier ones
+    config = CompilerConfig(
+        [Stage('public', 'public', public_tasks_file, public_task_runs_file, prefix='p_', label='Public'),
+         Stage('fi_intern', 'first_internal', first_internal_tasks_file, first_internal_task_runs_file,
+               prefix='fi_', label='First Internal'),
+         Stage('fn_intern', 'final_internal', final_internal_tasks_file, final_internal_task_runs_file,
+               prefix='fn_', label='Final Internal'),
+         Stage('sw_intern', 'sweeper_internal', sweeper_tasks_file, sweeper_task_runs_file, prefix='sw_',
+               label='Sweeper Internal'),
+         Stage('mt_intern', 'missing_internal', missing_tasks_file, missing_task_runs_file, prefix='mt_',
+               label='Missing Internal')],
+        SELECTIONS, task_fields=TASK_FIELDS, scrubbed_header=SCRUBBED_HEADER, compiled_header=COMPILED_HEADER)
+
+    sampler = None
+    if sample_mode != 'head':
+        sampler = TaskSampler(sample_size, mode=sample_mode, seed=sample_seed, strata=sample_strata)
+        sample_size = None
+
+    profiler = None
+    if profile_report_file is not None or profile_dump_file is not None:
+        profiler = Profiler(cprofile=profile_dump_file is not None)
+
+    compiled = compile_stages(config, sample=sample_size, jobs=jobs, cache_dir=cache_dir, log=log, sampler=sampler,
+                              profiler=profiler, export_cache=ExportCache() if use_export_cache else None)
+    locations = compiled['locations']
+    if VERBOSE:
+        for comp_key, location in compiled['dropped']:
+            print("  -  Dropped %s location: %s" % (comp_key, location))
 
     #/* ======================================================================= */#
-    #/*     Get Task Runs to Analyze
+    #/*     Validation Report
     #/* ======================================================================= */#
 
     if validate_tasks:
-        locations_no_task_runs = []
-        p_missing = 0
-        fi_missing = 0
-        fn_missing = 0
-        sw_missing = 0
-        mt_missing = 0
-        v_error = False
-        print("Validating public task runs...")
-        for task in public_tasks:
-            if len(get_task_runs(task['id'], public_task_runs)) is 0:
-                p_missing += 1
-                v_error = True
-                task_location = get_locations([task])
-                if task_location not in locations_no_task_runs:
-                    locations_no_task_runs.append(task_location)
-        print("Validating first internal task runs...")
-        for task in first_internal_tasks:
-            if len(get_task_runs(task['id'], first_internal_task_runs)) is 0:
-                fi_missing += 1
-                v_error = True
-                if task_location not in locations_no_task_runs:
-                    locations_no_task_runs.append(task_location)
-        print("Validating final internal task runs...")
-        for task in final_internal_tasks:
-            if len(get_task_runs(task['id'], final_internal_task_runs)) is 0:
-                fn_missing += 1
-                v_error = True
-                if task_location not in locations_no_task_runs:
-                    locations_no_task_runs.append(task_location)
-        print("Validating sweeper internal runs...")
-        for task in sweeper_tasks:
-            if len(get_task_runs(task['id'], sweeper_task_runs)) is 0:
-                sw_missing += 1
-                v_error = True
-                if task_location not in locations_no_task_runs:
-                    locations_no_task_runs.append(task_location)
-        print("Validating missing internal runs...")
-        for task in missing_tasks:
-            if len(get_task_runs(task['id'], missing_tasks)) is 0:
-                mt_missing += 1
-                v_error = True
-                if task_location not in locations_no_task_runs:
-                    locations_no_task_runs.append(task_location)
-        if v_error:
-            print("  Public with no task runs: %s" % str(p_missing))
-            print("  First internal with no task runs: %s" % str(fi_missing))
-            print("  Final internal with no task runs: %s" % str(fn_missing))
-            print("  Sweeper internal with no task runs: %s" % str(sw_missing))
-            print("  Missing internal with no task runs: %s" % str(mt_missing))
-            print("  Total unique with locations no task runs: %s " % str(len(locations_no_task_runs)))
-
-        #/* ======================================================================= */#
-        #/*     Extra location/task run check
-        #/* ======================================================================= */#
-
-        # This was used to work out some inherent weirdness in the data so another
-        # part of the utility could be developed
-
-        # Figure out if a location with no task runs was actually completed somewhere
-        still_bad = []
-        print("Looking for locations without task runs in public...")
-        for location in locations_no_task_runs:
-            if location not in still_bad:
-                if not is_location_complete(location, public_tasks, public_task_runs):
-                    still_bad.append(location)
-        print("Looking for locations without task runs in first internal...")
-        for location in locations_no_task_runs:
-            if location not in still_bad:
-                if not is_location_complete(location, first_internal_tasks, first_internal_task_runs):
-                    still_bad.append(location)
-        print("Looking for locations without task runs in final internal...")
-        for location in locations_no_task_runs:
-            if location not in still_bad:
-                if not is_location_complete(location, final_internal_tasks, final_internal_task_runs):
-                    still_bad.append(location)
-        print("Looking for locations without task runs in sweeper internal...")
-        for location in locations_no_task_runs:
-            if location not in still_bad:
-                if not is_location_complete(location, sweeper_tasks, sweeper_task_runs):
-                    still_bad.append(location)
-        print("Looking for locations without task runs in missing internal...")
-        for location in locations_no_task_runs:
-            if location not in still_bad:
-                if not is_location_complete(location, missing_tasks, missing_task_runs):
-                    still_bad.append(location)
-        print("  Still bad: %s" % len(still_bad))
-
-    #/* ======================================================================= */#
-    #/*     Build Master Location Container
-    #/* ======================================================================= */#
-
-    # The container constructed below will be used to reconstruct a given task's full history
-
-    # Convert the location list into a dictionary based on the templates below
-    stats_template = {'n_unk_res': None,
-                      'n_frk_res': None,
-                      'n_oth_res': None,
-                      'n_tot_res': None,
-                      'crowd_sel': None,
-                      'p_crd_a': None,
-                      'p_s_crd_a': None}
-    location_template = {'lat': None,
-                         'lng': None,
-                         'year': None,
-                         'wms_url': None,
-                         'county': None,
-                         'n_unk_res': None,
-                         'n_frk_res': None,
-                         'n_oth_res': None,
-                         'n_tot_res': None,
-                         'crowd_sel': None,
-                         'comp_loc': None,
-                         'p_crd_a': None,
-                         'p_s_crd_a': None,
-                         'public': copy.deepcopy(stats_template),
-                         'fi_intern': copy.deepcopy(stats_template),
-                         'fn_intern': copy.deepcopy(stats_template),
-                         'sw_intern': copy.deepcopy(stats_template),
-                         'mt_intern': copy.deepcopy(stats_template)}
-    locations = {}
-    for location in location_list:
-        locations[location] = copy.deepcopy(location_template)
+        print("Validating applications...")
+        with phase(profiler, "validation report") as info:
+            validation_report = get_validation_report(config, compiled)
+            info['records'] = len(locations)
+        for stage in config.stages:
+            print("  %s with no task runs: %s" % (
+                stage.label, len(validation_report['stages'][stage.name]['tasks_without_task_runs'])))
+        print("  Total unique locations with no task runs: %s"
+              % len(validation_report['locations_without_task_runs']))
+        print("  Never completed: %s" % len(validation_report['locations_never_completed']))
+
+        if validation_report_file is not None:
+            print("Writing validation report: %s" % validation_report_file)
+            with open(validation_report_file, 'w') as f:
+                json.dump(validation_report, f, indent=2, sort_keys=True)
 
     #/* ======================================================================= */#
-    #/*     Analyze Tasks
-    #/* ======================================================================= */#
-
-    # Public tasks
-    locations = analyze_tasks(locations, public_tasks, public_task_runs,
-                              'public', 'public', sample=sample_size)
-
-    # First internal tasks
-    locations = analyze_tasks(locations, first_internal_tasks, first_internal_task_runs,
-                              'first_internal', 'fi_intern', sample=sample_size)
-
-    # Final internal tasks
-    locations = analyze_tasks(locations, final_internal_tasks, final_internal_task_runs,
-                              'final_internal', 'fn_intern', sample=sample_size)
-
-    # Sweeper internal tasks
-    locations = analyze_tasks(locations, sweeper_tasks, sweeper_task_runs,
-                              'sweeper_internal', 'sw_intern', sample=sample_size)
-
-    # Missing internal tasks
-    locations = analyze_tasks(locations, missing_tasks, missing_task_runs,
-                              'missing_internal', 'mt_intern', sample=sample_size)
-
-    #/* ======================================================================= */#
-    #/*     Write Compiled Output JSON
+    #/*     Write Outputs
     #/* ======================================================================= */#
 
     print("Writing compiled JSON output...")
-    with open(compiled_output_json_file, 'w') as f:
-        json.dump(locations, f)
-
-    #/* ======================================================================= */#
-    #/*     Write Scrubbed Output CSV
-    #/* ======================================================================= */#
+    with phase(profiler, "write compiled JSON") as info:
+        write_json(locations, compiled_output_json_file)
+        info['records'] = len(locations)
 
-    # Convert compiled output to lines
-    header = ['location', 'wms_url', 'lat', 'lng', 'year', 'county', 'comp_loc', 'n_frk_res', 'n_oth_res',
-              'n_unk_res', 'n_tot_res', 'crowd_sel', 'p_crd_a', 'p_s_crd_a']
-    scrubbed_lines = []
-    for location, attributes in locations.iteritems():
-        line = ['' for i in header]
-        for item in header:
-            if item == 'location':
-                line[header.index(item)] = '"' + location + '"'
-            else:
-                content = attributes[item]
-                if content is None:
-                    content = ''
-                line[header.index(item)] = '"' + str(content) + '"'
-        scrubbed_lines.append(line)
-
-    # Write lines
     print("Writing scrubbed output CSV...")
-    with open(scrubbed_output_csv_file, 'w') as f:
-        f.write(', '.join(['"' + i + '"' for i in header]) + linesep)
-        for line in scrubbed_lines:
-            f.write(','.join(line) + linesep)
+    with phase(profiler, "write scrubbed CSV") as info:
+        write_csv(locations, SCRUBBED_HEADER, scrubbed_output_csv_file)
+        info['records'] = len(locations)
+
+    print("Writing compiled output CSV...")
+    with phase(profiler, "write compiled CSV") as info:
+        write_csv(locations, COMPILED_HEADER, compiled_output_csv_file)
+        info['records'] = len(locations)
+
+    if compiled_output_npz_file is not None:
+        print("Writing compiled output NPZ...")
+        with phase(profiler, "write compiled NPZ") as info:
+            write_npz(locations, COMPILED_HEADER, compiled_output_npz_file)
+            info['records'] = len(locations)
 
     #/* ======================================================================= */#
-    #/*     Write Compiled Output CSV
+    #/*     Profile Report
     #/* ======================================================================= */#
 
-    # Define the header and output container
-    compiled_lines = []
-    header = [# Location information
-              'location', 'wms_url', 'lat', 'lng', 'year', 'county',
-              # Final answer information
-              'n_frk_res', 'n_oth_res', 'n_unk_res', 'n_tot_res', 'comp_loc', 'crowd_sel', 'p_crd_a', 'p_s_crd_a',
-              # Public responses
-              'p_n_frk_res', 'p_n_oth_res', 'p_n_unk_res', 'p_n_tot_res', 'p_crowd_sel', 'p_p_crd_a', 'p_p_s_crd_a',
-              # First internal responses
-              'fi_n_frk_res', 'fi_n_oth_res', 'fi_n_unk_res', 'fi_n_tot_res', 'fi_crowd_sel', 'fi_p_crd_a', 'fi_p_s_crd_a',
-              # Final internal responses
-              'fn_n_frk_res', 'fn_n_oth_res', 'fn_n_unk_res', 'fn_n_tot_res', 'fn_crowd_sel', 'fn_p_crd_a', 'fn_p_s_crd_a',
-              # Sweeper internal responses
-              'sw_n_frk_res', 'sw_n_oth_res', 'sw_n_unk_res', 'sw_n_tot_res', 'sw_crowd_sel', 'sw_p_crd_a', 'sw_p_s_crd_a',
-              # Missing internal responses
-              'mt_n_frk_res', 'mt_n_oth_res', 'mt_n_unk_res', 'mt_n_tot_res', 'mt_crowd_sel', 'mt_p_crd_a', 'mt_p_s_crd_a']
-
-    # Loop through the compiled JSON object and populate stuff
-    for location, attributes in locations.iteritems():
-
-        # Define a container for this specific line - default values are empty, which allows any value that is not
-        # found in the compiled JSON object to be populated as NULL
-        line = ['' for i in header]
-
-        # Loop through the header and populate attributes in the line
-        for item in header:
-
-            # Get the easy stuff into the line first - all the final answers and location information
-            if item in attributes:
-                content = attributes[item]
-                if content is None:
-                    content = ''
-                line[header.index(item)] = '"' + str(content) + '"'
-
-            # Location is a special case since its part of what we're iterating over in the outer loop
-            elif item == 'location':
-                line[header.index(item)] = '"' + location + '"'
-
-            # Everything else is application specific responses
-            else:
-
-                # Figure out which application to pull values from and specify identifying information
-                if item[:2] == 'p_':
-                    app_key = 'public'
-                    field_prefix = 'p_'
-                elif item[:3] == 'fi_':
-                    app_key = 'fi_intern'
-                    field_prefix = 'fi_'
-                elif item[:3] == 'fn_':
-                    app_key = 'fn_intern'
-                    field_prefix = 'fn_'
-                elif item[:3] == 'sw_':
-                    app_key = 'sw_intern'
-                    field_prefix = 'sw_'
-                elif item[:3] == 'mt_':
-                    app_key = 'mt_intern'
-                    field_prefix = 'mt_'
-                else:
-                    raise ValueError("Can't pull values for item: %s" % item)
-
-                # Pull values and populate line
-                for app_attr, app_val in attributes[app_key].iteritems():
-                    app_item = field_prefix + app_attr
-                    app_content = app_val
-                    if app_content is None:
-                        app_content = ''
-
-                    # Stick the field prefix back on
-                    line[header.index(app_item)] = '"' + str(app_content) + '"'
-
-        # Line is fully constructed
-        compiled_lines.append(line)
-
-    # Write lines
-    print("Writing compiled output CSV...")
-    with open(compiled_output_csv_file, 'w') as f:
-        f.write(', '.join(['"' + i + '"' for i in header]) + linesep)
-        for line in compiled_lines:
-            f.write(','.join(line) + linesep)
+    if profiler is not None:
+        profiler.close()
+        if profile_report_file is not None:
+            print("Writing profile report: %s" % profile_report_file)
+            profiler.write_report(profile_report_file)
+        if profile_dump_file is not None:
+            print("Writing cProfile stats for slowest phase (%s): %s"
+                  % (profiler.dump_stats(profile_dump_file), profile_dump_file))
 
     #/* ======================================================================= */#
     #/*     Cleanup
@@ -1336,7 +780,7 @@ def main(args):
 
     # Update user
     if VERBOSE:
-        print("Total errors: %s" % str(ERROR_COUNT))
+        print("Total errors: %s" % str(compiled['n_errors']))
     print("Done.")
 
     # Success
@@ -45,10 +45,15 @@ from os import sep
 from os.path import *
 try:
     from osgeo import ogr
-    from osgeo import osr
 except ImportError:
     import ogr
-    import osr
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..', '..')))
+from crowdtools.cache import ExportCache
+from crowdtools.cache import load_cached_json
+from crowdtools.location import LocationKey
+from crowdtools.vector import LayerWriter
+from crowdtools.vector import points_to_wkb
 
 
 #/* ======================================================================= */#
@@ -90,6 +95,30 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 
+#/* ======================================================================= */#
+#/*     Global Variables and Constants
+#/* ======================================================================= */#
+
+# Output fields for each file
+BBOX_FIELDS = (('id', 10, ogr.OFTInteger),
+               ('site_id', 254, ogr.OFTString),
+               ('location', 254, ogr.OFTString),
+               ('wms_url', 254, ogr.OFTString),
+               ('county', 254, ogr.OFTString),
+               ('year', 10, ogr.OFTInteger),
+               ('qaqc', 254, ogr.OFTString))
+CLICK_FIELDS = (('id', 10, ogr.OFTInteger),
+                ('task_id', 10, ogr.OFTInteger),
+                ('year', 10, ogr.OFTInteger),
+                ('qaqc', 254, ogr.OFTString))
+WELLPAD_FIELDS = BBOX_FIELDS
+
+# Key fields that get an attribute index in each file
+BBOX_INDEX_FIELDS = ('id', 'site_id', 'location')
+CLICK_INDEX_FIELDS = ('id', 'task_id')
+WELLPAD_INDEX_FIELDS = BBOX_INDEX_FIELDS
+
+
 #/* ======================================================================= */#
 #/*     Define print_usage() function
 #/* ======================================================================= */#
@@ -120,8 +149,12 @@ Options:
   --no-click   -> Don't generate clicks file
   --no-wellpad -> Don't generate wellpads file
 
-  --of=driver -> Output driver name/file type - default='ESRI Shapefile'
+  --of=driver -> Output driver name/file type - default is based on each
+                 file's extension or 'GPKG'
   --epsg=int  -> EPSG code for coordinates in task.json - default='4326'
+
+  --no-export-cache -> Parse task.json and task_run.json instead of re-using
+                       the copies cached in $CROWDTOOLS_CACHE_DIR or ~/.cache/crowdtools
 """ % __docname__)
 
     return 1
@@ -217,15 +250,15 @@ def print_version():
 #/*     Define create_bboxes() function
 #/* ======================================================================= */#
 
-def create_bboxes(tasks, layer):
+def create_bboxes(tasks, writer):
 
     """
-    Add bounding boxes to input layer
+    Add bounding boxes to the output file
 
     :param tasks: tasks from json.load(open('task.json'))
     :type tasks: list
-    :param layer: OGR layer object
-    :type layer: <ogr.Layer class>
+    :param writer: output layer with BBOX_FIELDS
+    :type writer: crowdtools.vector.LayerWriter
 
     :return: True on success and False on failure
     :rtype: bool
@@ -234,23 +267,6 @@ def create_bboxes(tasks, layer):
     # Update user
     print("Creating bounding boxes")
 
-    # Define fields
-    print("  Defining bbox fields...")
-    fields_definitions = (('id', 10, ogr.OFTInteger),
-                          ('site_id', 254, ogr.OFTString),
-                          ('location', 254, ogr.OFTString),
-                          ('wms_url', 254, ogr.OFTString),
-                          ('county', 254, ogr.OFTString),
-                          ('year', 10, ogr.OFTInteger),
-                          ('qaqc', 254, ogr.OFTString))
-
-    # Create fields
-    for field_name, field_width, field_type in fields_definitions:
-        print("    " + field_name)
-        field_object = ogr.FieldDefn(field_name, field_type)
-        field_object.SetWidth(field_width)
-        layer.CreateField(field_object)
-
     # Loop through tasks and create features
     num_tasks = len(tasks)
     i = 0
@@ -263,7 +279,7 @@ def create_bboxes(tasks, layer):
         sys.stdout.flush()
 
         # Get field content
-        location = str(task['info']['latitude']) + str(task['info']['longitude']) + '---' + str(task['info']['year'])
+        location = str(LocationKey.from_task(task, precision=None))
         field_values = {'id': int(task['id']),
                         'site_id': str(task['info']['SiteID']),
                         'location': str(location),
@@ -287,13 +303,8 @@ def create_bboxes(tasks, layer):
         # Create a new feature and assign geometry and field values
         rectangle = ogr.Geometry(ogr.wkbPolygon)
         rectangle.AddGeometry(ring)
-        feature = ogr.Feature(layer.GetLayerDefn())
-        feature.SetGeometry(rectangle)
-        for field, value in field_values.iteritems():
-            feature.SetField(field, value)
-        layer.CreateFeature(feature)
+        writer.write(field_values, rectangle)
         rectangle = None
-        feature = None
 
     # Update user
     print(" - Done")
@@ -304,17 +315,17 @@ def create_bboxes(tasks, layer):
 #/*     Define create_clicks() function
 #/* ======================================================================= */#
 
-def create_clicks(tasks, task_runs, layer):
+def create_clicks(tasks, task_runs, writer):
 
     """
-    Add click points to layer
+    Add click points to the output file
 
     :param tasks: tasks from json.load(open('task.json'))
     :type tasks: list
     :param task_runs: tasks from json.load(open('task_run.json'))
     :type task_runs: list
-    :param layer: OGR layer object
-    :type layer: <ogr.Layer class>
+    :param writer: output layer with CLICK_FIELDS
+    :type writer: crowdtools.vector.LayerWriter
 
     :return: True on success and False on failure
     :rtype: bool
@@ -323,24 +334,18 @@ def create_clicks(tasks, task_runs, layer):
     # Update user
     print("Creating clicks")
 
-    # Define fields
-    print("  Defining click fields...")
-    fields_definitions = (('id', 10, ogr.OFTInteger),
-                          ('task_id', 10, ogr.OFTInteger),
-                          ('year', 10, ogr.OFTInteger),
-                          ('qaqc', 254, ogr.OFTString))
-
-    # Create fields
-    for field_name, field_width, field_type in fields_definitions:
-        print("    " + field_name)
-        field_object = ogr.FieldDefn(field_name, field_type)
-        field_object.SetWidth(field_width)
-        layer.CreateField(field_object)
+    # Index tasks by id - the first task with a given id wins
+    tasks_by_id = {}
+    for t in tasks:
+        tasks_by_id.setdefault(t['id'], t)
 
-    # Loop through tasks and create features
+    # Loop through tasks and collect attributes and coordinates
     print("  Processing %s tasks..." % str(len(task_runs)))
     i = 0
     num_task_runs = len(task_runs)
+    click_values = []
+    click_lng = []
+    click_lat = []
     for task_run in task_runs:
 
         # Update user
@@ -353,23 +358,19 @@ def create_clicks(tasks, task_runs, layer):
                         'task_id': int(task_run['task_id'])}
 
         # Get year
-        for t in tasks:
-            if t['id'] == task_run['task_id']:
-                field_values['year'] = int(t['info']['year'])
-                break
+        if task_run['task_id'] in tasks_by_id:
+            field_values['year'] = int(tasks_by_id[task_run['task_id']]['info']['year'])
 
         # Get list of clicks
         clicks = task_run['info']['positions']
         for click in clicks:
-            feature = ogr.Feature(layer.GetLayerDefn())
+            click_values.append(field_values)
+            click_lng.append(float(click['lon']))
+            click_lat.append(float(click['lat']))
 
-            # Set field attributes and geometry
-            point = ogr.CreateGeometryFromWkt("POINT(%f %f)" % (float(click['lon']), float(click['lat'])))
-            feature.SetGeometry(point)
-            for field, value in field_values.iteritems():
-                feature.SetField(field, value)
-            layer.CreateFeature(feature)
-            feature = None
+    # Build all the geometries at once and create features
+    for field_values, point in zip(click_values, points_to_wkb(click_lng, click_lat)):
+        writer.write_wkb(field_values, point)
 
     # Update user
     print("  Done")
@@ -380,15 +381,15 @@ def create_clicks(tasks, task_runs, layer):
 #/*     Define get_crowd_selection() function
 #/* ======================================================================= */#
 
-def create_wellpads(tasks, layer):
+def create_wellpads(tasks, writer):
 
     """
-    Add click points to layer
+    Add well pad points to the output file
 
     :param tasks: tasks from json.load(open('task.json'))
     :type tasks: list
-    :param layer: OGR layer object
-    :type layer: <ogr.Layer class>
+    :param writer: output layer with WELLPAD_FIELDS
+    :type writer: crowdtools.vector.LayerWriter
 
     :return: True on success and False on failure
     :rtype: bool
@@ -397,27 +398,13 @@ def create_wellpads(tasks, layer):
     # Update user
     print("Creating wellpads")
 
-    # Define fields
-    print("  Defining layer fields...")
-    fields_definitions = (('id', 10, ogr.OFTInteger),
-                          ('site_id', 254, ogr.OFTString),
-                          ('location', 254, ogr.OFTString),
-                          ('wms_url', 254, ogr.OFTString),
-                          ('county', 254, ogr.OFTString),
-                          ('year', 10, ogr.OFTInteger),
-                          ('qaqc', 254, ogr.OFTString))
-
-    # Create fields
-    for field_name, field_width, field_type in fields_definitions:
-        print("    " + field_name)
-        field_object = ogr.FieldDefn(field_name, field_type)
-        field_object.SetWidth(field_width)
-        layer.CreateField(field_object)
-
-    # Loop through tasks and create features
+    # Loop through tasks and collect attributes and coordinates
     print("  Processing %s tasks..." % str(len(tasks)))
     i = 0
     num_tasks = len(tasks)
+    wellpad_values = []
+    wellpad_lng = []
+    wellpad_lat = []
     for task in tasks:
 
         # Update user
@@ -426,7 +413,7 @@ def create_wellpads(tasks, layer):
         sys.stdout.flush()
 
         # Get field content
-        location = str(task['info']['latitude']) + str(task['info']['longitude']) + '---' + str(task['info']['year'])
+        location = str(LocationKey.from_task(task, precision=None))
         field_values = {'id': int(task['id']),
                         'site_id': str(task['info']['SiteID']),
                         'location': location,
@@ -434,15 +421,13 @@ def create_wellpads(tasks, layer):
                         'county': str(task['info']['county']),
                         'year': int(task['info']['year'])}
 
-        # Define and create feature
-        feature = ogr.Feature(layer.GetLayerDefn())
-        wkt = "POINT(%f %f)" % (float(task['info']['longitude']), float(task['info']['latitude']))
-        point = ogr.CreateGeometryFromWkt(wkt)
-        feature.SetGeometry(point)
-        for field, value in field_values.iteritems():
-            feature.SetField(field, value)
-        layer.CreateFeature(feature)
-        feature = None
+        wellpad_values.append(field_values)
+        wellpad_lng.append(float(task['info']['longitude']))
+        wellpad_lat.append(float(task['info']['latitude']))
+
+    # Build all the geometries at once and create features
+    for field_values, point in zip(wellpad_values, points_to_wkb(wellpad_lng, wellpad_lat)):
+        writer.write_wkb(field_values, point)
 
     # Update user
     print("  Done")
@@ -477,10 +462,11 @@ def main(args):
     wellpad_file_name = 'wellpads.shp'
     clicks_file_name = 'clicks.shp'
     epsg_code = 4326
-    vector_driver = 'ESRI Shapefile'
+    vector_driver = None
     generate_bbox = True
     generate_clicks = True
     generate_wellpads = True
+    use_export_cache = True
 
     # Parse arguments
     arg_error = False
@@ -523,6 +509,8 @@ def main(args):
         # Additional options
         elif arg == '--overwrite':
             overwrite = True
+        elif arg == '--no-export-cache':
+            use_export_cache = False
 
         # Ignore empty arguments
         elif arg == '':
@@ -587,71 +575,60 @@ def main(args):
 
     # Convert files to json
     print("Extracting JSON...")
-    with open(task_file_path, 'r') as f:
-        task_json = json.load(f)
-    with open(task_run_file_path, 'r') as f:
-        task_run_json = json.load(f)
+    export_cache = ExportCache() if use_export_cache else None
+    task_json = load_cached_json(task_file_path, export_cache)
+    task_run_json = load_cached_json(task_run_file_path, export_cache)
     print("  Num tasks: %s" % str(len(task_json)))
     print("  Num task runs: %s" % str(len(task_run_json)))
 
-    # Get SRS and driver objects
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(epsg_code)
-    driver = ogr.GetDriverByName(vector_driver)
-
     # Delete existing files if in overwrite mode
     if overwrite:
         print("Overwriting existing files...")
         for filepath in [clicks_file_path, bbox_file_path, wellpad_file_path]:
             if isfile(filepath):
-                driver.DeleteDataSource(filepath)
-                print("  Deleted %s" % filepath)
+                print("  Deleting %s" % filepath)
 
     # Create clicks file OGR object
     clicks_layer_name = clicks_file_name.split('.', 1)[0]
     print("Creating empty clicks outfile...")
     print("  Path: %s" % clicks_file_path)
     print("  Layer: %s" % clicks_layer_name)
-    clicks_datasource = driver.CreateDataSource(clicks_file_path)
-    clicks_layer = clicks_datasource.CreateLayer(clicks_layer_name, srs, ogr.wkbPoint)
+    clicks_writer = LayerWriter(clicks_file_path, CLICK_FIELDS, ogr.wkbPoint, epsg=epsg_code, driver=vector_driver,
+                                layer_name=clicks_layer_name, overwrite=overwrite, index_fields=CLICK_INDEX_FIELDS)
 
     # Create bounding box OGR object
     bbox_layer_name = bbox_file_name.split('.', 1)[0]
     print("Creating empty bbox outfile...")
     print("  Path: %s" % bbox_file_path)
     print("  Layer: %s" % bbox_layer_name)
-    bbox_datasource = driver.CreateDataSource(bbox_file_path)
-    bbox_layer = bbox_datasource.CreateLayer(bbox_layer_name, srs, ogr.wkbPolygon)
+    bbox_writer = LayerWriter(bbox_file_path, BBOX_FIELDS, ogr.wkbPolygon, epsg=epsg_code, driver=vector_driver,
+                              layer_name=bbox_layer_name, overwrite=overwrite, index_fields=BBOX_INDEX_FIELDS)
 
     # Create wellpad OGR object
     wellpad_layer_name = wellpad_file_name.split('.', 1)[0]
     print("Creating empty wellpad outfile...")
     print("  Path: %s" % wellpad_file_path)
     print("  Layer: %s" % wellpad_layer_name)
-    wellpad_datasource = driver.CreateDataSource(wellpad_file_path)
-    wellpad_layer = wellpad_datasource.CreateLayer(wellpad_layer_name, srs, ogr.wkbPoint)
+    wellpad_writer = LayerWriter(wellpad_file_path, WELLPAD_FIELDS, ogr.wkbPoint, epsg=epsg_code,
+                                 driver=vector_driver, layer_name=wellpad_layer_name, overwrite=overwrite,
+                                 index_fields=WELLPAD_INDEX_FIELDS)
 
     # == Create Files == #
     if generate_bbox:
-        if not create_bboxes(task_json, bbox_layer):
+        if not create_bboxes(task_json, bbox_writer):
             print("ERROR: Problem creating bounding boxes")
     if generate_clicks:
-        if not create_clicks(task_json, task_run_json, clicks_layer):
+        if not create_clicks(task_json, task_run_json, clicks_writer):
             print("ERROR: Problem creating clicks")
     if generate_wellpads:
-        if not create_wellpads(task_json, wellpad_layer):
+        if not create_wellpads(task_json, wellpad_writer):
             print("ERROR: Problem creating wellpads")
 
-    # Cleanup OGR data sources
+    # Commit any remaining features, build indexes, and close the OGR data sources
     print("Cleaning up...")
-    srs = None
-    driver = None
-    clicks_layer = None
-    bbox_layer = None
-    wellpad_layer = None
-    clicks_datasource = None
-    bbox_datasource = None
-    wellpad_datasource = None
+    clicks_writer.close()
+    bbox_writer.close()
+    wellpad_writer.close()
 
     # Success
     print("Done.")
@@ -42,12 +42,17 @@ metrics.
 # TODO: Refactor to use both task_run.json and task.json as input instead of pre-processing data?  Worth doing for consistency but will be kind of time consuming.
 
 
+from __future__ import print_function
+
 import sys
 import json
 import math
 from pprint import pprint
 from os.path import isfile
+from os.path import abspath
 from os.path import basename
+from os.path import dirname
+from os.path import join
 try:
     from osgeo import ogr
     from osgeo import osr
@@ -57,6 +62,15 @@ except ImportError:
 ogr.UseExceptions()
 osr.UseExceptions()
 
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..', '..')))
+from crowdtools.cache import ExportCache
+from crowdtools.cache import load_cached_json
+from crowdtools.intersect import flag_intersections
+from crowdtools.shards import export_shards
+from crowdtools.vector import LayerWriter
+from crowdtools.vector import create_indexes
+from crowdtools.vector import open_output
+
 
 #/* ======================================================================= */#
 #/*     Build Information
@@ -98,6 +112,14 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 
+#/* ======================================================================= */#
+#/*     Global Variables and Constants
+#/* ======================================================================= */#
+
+# Key fields that get an attribute index in the output - location only exists with --process-extra-fields
+INDEX_FIELDS = ('task_id', 'location')
+
+
 #/* ======================================================================= */#
 #/*     Define print_usage() function
 #/* ======================================================================= */#
@@ -121,11 +143,19 @@ Options:
     --overwrite             Overwrite output.shp
     --class=str             Add a classification field with a uniform value
                             Use '%%<field>' to pull from the input JSON object
-    --of=driver             Specify output OGR driver - defaults to 'ESRI Shapefile'
+    --of=driver             Specify output OGR driver - defaults to the one for the
+                            outfile's extension or 'GPKG'
     --no-check-intersect    Don't check for intersecting geometries
     --no-split-multi        Don't split multi-polygon ponds into single parts
     --no-compute-area       Don't compute each feature's area
     --intersect-keep=str    Keeps intersecting features based on their classified value
+    --jobs=int              Process task runs in this many processes - default=1
+    --shard-by=str          How task runs are split between processes: 'hash' or a
+                            comma separated list of task.json info fields like
+                            'county,year' that requires --process-extra-fields
+                            default='hash'
+    --no-export-cache       Parse task_run.json instead of re-using the copy cached in
+                            $CROWDTOOLS_CACHE_DIR or ~/.cache/crowdtools
 """.format(__docname__))
 
     return 1
@@ -396,6 +426,140 @@ def compute_area(geometry, target_epsg):
     return geometry.GetArea()
 
 
+#/* ======================================================================= */#
+#/*     Define get_task_run_features() function
+#/* ======================================================================= */#
+
+def get_task_run_features(tr, process_extra_fields=False, feature_classification=None, split_multi_ponds=True,
+                          compute_pond_area=True, field_prefix='_t_'):
+
+    """
+    Build the output features for a single task run
+
+    :param tr: task run from task_run.json
+    :type tr: dict
+    :param process_extra_fields: task run has attributes from task.json
+    :type process_extra_fields: bool
+    :param feature_classification: value for the 'class' field or '%<field>' to pull it from the task run
+    :type feature_classification: str|None
+    :param split_multi_ponds: create one feature per polygon in a multi-pond task run
+    :type split_multi_ponds: bool
+    :param compute_pond_area: populate the 'area_m' field
+    :type compute_pond_area: bool
+    :param field_prefix: prefix for the task.json attributes added to the task run
+    :type field_prefix: str
+
+    :return: (attributes, geometry) for every feature
+    :rtype: generator
+    """
+
+    try:
+        selection = str(tr['info']['selection'])
+    except KeyError:
+        selection = 'ERROR'
+
+    # Only create a geometry if the task run was digitized/kept its fracking classification
+    if selection == 'done':
+
+        geometry = None
+
+        # Account for polygon vs. multipolygon change
+        if 'shapes' in tr['info']:
+            geometry = get_multipolygon(tr['info']['shapes'])
+        elif 'shape' in tr['info']:
+            geometry = get_polygon(tr['info']['shape']['coordinates'][0])
+
+        # Task run does not have shape or shapes key for some reason
+        # Dirty check for invalid geometries
+        if geometry is None:
+            print("")
+            print("WARNING: Task run with id %s missing 'shape' or 'shapes' key" % str(tr['id']))
+            pprint(tr)
+            print("")
+
+        else:
+
+            # If we're splitting multi-ponds into single ponds,
+            geometry_iterator = [geometry]
+            if split_multi_ponds and 'shapes' in tr['info'] and len(tr['info']['shapes']) > 1:
+                geometry_iterator = [get_polygon(i['coordinates'][0]) for i in tr['info']['shapes']]
+
+            # Set attributes and geometry - pretty messy ...
+            for geometry in geometry_iterator:
+
+                # Compute the area
+                geometry_area = None  # Default to Null in case the computation fails
+                if compute_pond_area:
+                    try:
+                        centroid = geometry.Centroid()
+                    except RuntimeError:
+                        print("")
+                        print("WARNING: Task run with id %s contains an invalid geometry" % str(tr['id']))
+                        pprint(tr)
+                        print("")
+                        break
+                    centroid_lat = centroid.GetY()
+                    centroid_lng = centroid.GetX()
+                    epsg = get_epsg_code(centroid_lat, centroid_lng)
+                    geometry_area = compute_area(geometry, epsg)
+
+                if geometry is not None:
+                    task_id = int(tr['task_id'])
+                    attributes = {'selection': selection,
+                                  'task_id': task_id}
+
+                    # Get the extra fields
+                    if process_extra_fields:
+                        try:
+                            comp_loc = str(tr[field_prefix + 'info']['comp_loc'])
+                            attributes['comp_loc'] = comp_loc
+                        except KeyError:
+                            print("WARNING: No '%scomp_loc' field: %s" % (field_prefix, str(task_id)))
+                        try:
+                            crowd_sel = str(tr[field_prefix + 'info']['crowd_sel'])
+                            attributes['crowd_sel'] = crowd_sel
+                        except KeyError:
+                            print("WARNING: No '%scrowd_sel' field for: %s" % (field_prefix, str(task_id)))
+                        try:
+                            county = str(tr[field_prefix + 'info']['county'])
+                            attributes['county'] = county
+                        except KeyError:
+                            print("WARNING: No '%scounty' field for: %s" % (field_prefix, str(task_id)))
+                        try:
+                            state = str(tr[field_prefix + 'info']['state'])
+                            attributes['state'] = state
+                        except KeyError:
+                            print("WARNING: No '%sstate' field for: %s" % (field_prefix, str(task_id)))
+                        try:
+                            year = str(tr[field_prefix + 'info']['year'])
+                            attributes['year'] = year
+                        except KeyError:
+                            print("WARNING: No '%syear' field for: %s" % (field_prefix, str(task_id)))
+                        try:
+                            location = str(tr[field_prefix + 'info']['location'])
+                            attributes['location'] = location
+                        except KeyError:
+                            print("WARNING: No '%slocation' field for: %s" % (field_prefix, str(task_id)))
+
+                    # Compute area
+                    if compute_pond_area:
+                        attributes['area_m'] = geometry_area
+
+                    # Normal feature classification is just a simple write but the % indicates that the
+                    # classification is to be pulled from a field within the json
+                    if feature_classification is not None and feature_classification[0] != '%':
+                        attributes['class'] = str(feature_classification)
+                    elif feature_classification is not None and feature_classification[0] == '%':
+                        try:
+                            value = str(tr[feature_classification[1:]])
+                        except KeyError:
+                            value = None
+                        attributes['class'] = value
+
+                    # Create the feature in the layer
+                    yield attributes, geometry
+
+
 #/* ======================================================================= */#
 #/*     Define man() function
 #/* ======================================================================= */#
@@ -420,7 +584,7 @@ def main(args):
 
     # Input/output configuration
     overwrite_outfile = False
-    output_driver = 'ESRI Shapefile'
+    output_driver = None
     feature_classification = None
 
     # Additional processing
@@ -430,6 +594,13 @@ def main(args):
     compute_pond_area = True
     field_prefix = '_t_'
 
+    # Parallel processing
+    jobs = 1
+    shard_by = 'hash'
+
+    # Re-use parsed exports from earlier runs
+    use_export_cache = True
+
     #/* ======================================================================= */#
     #/*     Containers
     #/* ======================================================================= */#
@@ -472,6 +643,14 @@ def main(args):
         elif arg == '--no-compute-area':
             compute_pond_area = False
 
+        # Parallel processing
+        elif '--jobs=' in arg:
+            jobs = int(arg.split('=', 1)[1])
+        elif '--shard-by=' in arg:
+            shard_by = arg.split('=', 1)[1]
+        elif arg == '--no-export-cache':
+            use_export_cache = False
+
         # Additional processing
         elif arg == '--check-intersect':
             check_geom_intersect = True
@@ -524,6 +703,12 @@ def main(args):
     if check_geom_intersect_keep is not None and feature_classification is None:
         print("ERROR: Need a classification in order to filter intersects")
         bail = True
+    if jobs < 1:
+        print("ERROR: Invalid --jobs: %s" % str(jobs))
+        bail = True
+    if jobs > 1 and shard_by != 'hash' and not process_extra_fields:
+        print("ERROR: --shard-by=%s requires --process-extra-fields" % shard_by)
+        bail = True
 
     if bail:
         return 1
@@ -533,27 +718,9 @@ def main(args):
     #/* ======================================================================= */#
 
     # Open JSON file
-    with open(infile) as f:
-        task_runs = json.load(f)
-
-    # Delete output file if it exists
-    if isfile(outfile):
-        print("Overwriting: %s" % outfile)
-        driver = ogr.GetDriverByName(output_driver)
-        driver.DeleteDataSource(outfile)
-
-    # Create the datasource
-    print("Creating OGR datasource")
-    driver = ogr.GetDriverByName(output_driver)
-    datasource = driver.CreateDataSource(outfile)
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(4326)
+    task_runs = load_cached_json(infile, ExportCache() if use_export_cache else None)
 
-    # Create layers and define fields
     # Field definitions: (name, width, type, precision)
-    print("Creating layers and fields")
-    layer_name = basename(outfile).split('.', 1)[1]
-    layer = datasource.CreateLayer(layer_name, srs, ogr.wkbMultiPolygon)
     field_definitions = [('selection', 254, ogr.OFTString, None),
                          ('task_id', 10, ogr.OFTInteger, None),
                          ('intersect', 1, ogr.OFTInteger, None)]
@@ -569,13 +736,12 @@ def main(args):
     if compute_pond_area:
         field_definitions.append(('area_m', 254, ogr.OFTReal, 2))
 
-    # Add fields to layer
-    for field_name, field_width, field_type, field_precision in field_definitions:
-        field_object = ogr.FieldDefn(field_name, field_type)
-        field_object.SetWidth(field_width)
-        if field_precision is not None:
-            field_object.SetPrecision(field_precision)
-        layer.CreateField(field_object)
+    # Delete output file if it exists
+    if isfile(outfile):
+        print("Overwriting: %s" % outfile)
+
+    # The datasource, layer, and fields are created when features are written
+    layer_name = basename(outfile).split('.', 1)[1]
 
     #/* ======================================================================= */#
     #/*     Analyze Task Runs
@@ -583,118 +749,46 @@ def main(args):
 
     # Loop through task runs and assemble output shapefile
     print("Processing %s task runs..." % str(len(task_runs)))
-    for tr in task_runs:
-
-        try:
-            selection = str(tr['info']['selection'])
-        except KeyError:
-            selection = 'ERROR'
-
-        # Only create a geometry if the task run was digitized/kept its fracking classification
-        if selection == 'done':
-
-            geometry = None
+    feature_options = {'process_extra_fields': process_extra_fields,
+                       'feature_classification': feature_classification,
+                       'split_multi_ponds': split_multi_ponds,
+                       'compute_pond_area': compute_pond_area,
+                       'field_prefix': field_prefix}
+    writer = None
+    datasource = None
+    if jobs > 1:
 
-            # Account for polygon vs. multipolygon change
-            if 'shapes' in tr['info']:
-                geometry = get_multipolygon(tr['info']['shapes'])
-            elif 'shape' in tr['info']:
-                geometry = get_polygon(tr['info']['shape']['coordinates'][0])
+        # Task runs for the same task or with the same shard fields are always processed together
+        if shard_by == 'hash':
+            shard_keys = [tr.get('task_id') for tr in task_runs]
+        else:
+            shard_keys = [tuple((tr.get(field_prefix + 'info') or {}).get(field) for field in shard_by.split(','))
+                          for tr in task_runs]
 
-            # Task run does not have shape or shapes key for some reason
-            # Dirty check for invalid geometries
-            if geometry is None:
-                print("")
-                print("WARNING: Task run with id %s missing 'shape' or 'shapes' key" % str(tr['id']))
-                pprint(tr)
-                print("")
+        def produce(indexes):
+            for i in indexes:
+                for attributes, geometry in get_task_run_features(task_runs[i], **feature_options):
+                    yield i, attributes, geometry
 
-            else:
+        # Indexes are built during cleanup, after the intersect check has modified the output
+        export_shards(shard_keys, produce, outfile, field_definitions, ogr.wkbMultiPolygon, jobs,
+                      mode='hash' if shard_by == 'hash' else 'group', driver=output_driver, layer_name=layer_name,
+                      overwrite=True, spatial_index=False, log=print)
 
-                # If we're splitting multi-ponds into single ponds,
-                geometry_iterator = [geometry]
-                if split_multi_ponds and 'shapes' in tr['info'] and len(tr['info']['shapes']) > 1:
-                    geometry_iterator = [get_polygon(i['coordinates'][0]) for i in tr['info']['shapes']]
+        # Reopen the merged output for the intersect check below
+        datasource = open_output(outfile, output_driver)
+        layer = datasource.GetLayer(0)
 
-                # Set attributes and geometry - pretty messy ...
-                for geometry in geometry_iterator:
+    else:
+        writer = LayerWriter(outfile, field_definitions, ogr.wkbMultiPolygon, driver=output_driver,
+                             layer_name=layer_name, overwrite=True, index_fields=INDEX_FIELDS)
+        for tr in task_runs:
+            for attributes, geometry in get_task_run_features(tr, **feature_options):
+                writer.write(attributes, geometry)
 
-                    # Compute the area
-                    geometry_area = None  # Default to Null in case the computation fails
-                    if compute_pond_area:
-                        try:
-                            centroid = geometry.Centroid()
-                        except RuntimeError:
-                            print("")
-                            print("WARNING: Task run with id %s contains an invalid geometry" % str(tr['id']))
-                            pprint(tr)
-                            print("")
-                            break
-                        centroid_lat = centroid.GetY()
-                        centroid_lng = centroid.GetX()
-                        epsg = get_epsg_code(centroid_lat, centroid_lng)
-                        geometry_area = compute_area(geometry, epsg)
-
-                    if geometry is not None:
-                        task_id = int(tr['task_id'])
-                        feature = ogr.Feature(layer.GetLayerDefn())
-                        feature.SetGeometry(geometry)
-                        feature.SetField('selection', selection)
-                        feature.SetField('task_id', task_id)
-
-                        # Get the extra fields
-                        if process_extra_fields:
-                            try:
-                                comp_loc = str(tr[field_prefix + 'info']['comp_loc'])
-                                feature.SetField('comp_loc', comp_loc)
-                            except KeyError:
-                                print("WARNING: No '%scomp_loc' field: %s" % (field_prefix, str(task_id)))
-                            try:
-                                crowd_sel = str(tr[field_prefix + 'info']['crowd_sel'])
-                                feature.SetField('crowd_sel', crowd_sel)
-                            except KeyError:
-                                print("WARNING: No '%scrowd_sel' field for: %s" % (field_prefix, str(task_id)))
-                            try:
-                                county = str(tr[field_prefix + 'info']['county'])
-                                feature.SetField('county', county)
-                            except KeyError:
-                                print("WARNING: No '%scounty' field for: %s" % (field_prefix, str(task_id)))
-                            try:
-                                state = str(tr[field_prefix + 'info']['state'])
-                                feature.SetField('state', state)
-                            except KeyError:
-                                print("WARNING: No '%sstate' field for: %s" % (field_prefix, str(task_id)))
-                            try:
-                                year = str(tr[field_prefix + 'info']['year'])
-                                feature.SetField('year', year)
-                            except KeyError:
-                                print("WARNING: No '%syear' field for: %s" % (field_prefix, str(task_id)))
-                            try:
-                                location = str(tr[field_prefix + 'info']['location'])
-                                feature.SetField('location', location)
-                            except KeyError:
-                                print("WARNING: No '%slocation' field for: %s" % (field_prefix, str(task_id)))
-
-                        # Compute area
-                        if compute_pond_area:
-                            feature.SetField('area_m', geometry_area)
-
-                        # Normal feature classification is just a simple write but the % indicates that the
-                        # classification is to be pulled from a field within the json
-                        if feature_classification is not None and feature_classification[0] != '%':
-                            feature.SetField('class', str(feature_classification))
-                        elif feature_classification is not None and feature_classification[0] == '%':
-                            try:
-                                value = str(tr[feature_classification[1:]])
-                            except KeyError:
-                                value = None
-                            feature.SetField('class', value)
-
-                        # Create the feature in the layer
-                        layer.CreateFeature(feature)
-
-                    # Cleanup
-                    feature = None
+        # Commit pending features so the intersect check below sees all of them
+        writer.flush()
+        layer = writer.layer
 
     #/* ======================================================================= */#
     #/*     Check for Intersecting Polygons
@@ -708,59 +802,9 @@ def main(args):
 
         print("Searching for intersecting geometries...")
 
-        intersect_count = 0
-
-        # Convert layer's features to a dictionary where keys are FID's and values are feature objects
-        feature_fids = {i.GetFID(): i for i in layer}
-
-        # Loop through layer
-        layer.ResetReading()
-        intersect_count = 0
-        for p_feature in layer:
-
-            # Make sure we're supposed to process this feature
-            p_fid = p_feature.GetFID()
-
-            # If we don't remove from the FID list, then an intersect will always be found
-            del feature_fids[p_fid]
-
-            # Loop through all the features we're comparing against and check for intersects
-            for i_fid, i_feature in feature_fids.items():
-
-                # Prefixes: p=primary i=intersect - primary comes from outer loop
-                p_geom = p_feature.GetGeometryRef()
-                i_geom = i_feature.GetGeometryRef()
-                if p_geom.IsSimple() and i_geom.IsSimple():
-                    if p_geom.Intersect(i_geom):
-
-                        intersect_count += 1
-
-                        # Modify the primary feature in place
-                        p_feature.SetField('intersect', 1)
-                        layer.SetFeature(p_feature)
-
-                        # Modify the intersecting feature so it has the appropriate attributes
-                        i_feature.SetField('intersect', 1)
-                        layer.SetFeature(i_feature)
-
-                        # Filter out / delete one of the intersecting features if explicitly told to do so
-                        if check_geom_intersect_keep is not None:
-                            if p_feature.GetField('class') is i_feature.GetField('class'):
-                                print("WARNING: Could not filter intersect: homogeneous class")
-                            elif p_feature.GetField('class') != check_geom_intersect_keep:
-                                try:
-                                    layer.DeleteFeature(p_feature.GetFID())
-                                except RuntimeError:
-                                    # Multiple intersections can cause a feature to be deleted twice, which is fine,
-                                    # except that a second deletion throws an exception
-                                    pass
-                            elif i_feature.GetField('class') != check_geom_intersect_keep:
-                                try:
-                                    layer.DeleteFeature(i_feature.GetFID())
-                                except RuntimeError:
-                                    # Multiple intersections can cause a feature to be deleted twice, which is fine
-                                    # except that a second deletion throws an exception
-                                    pass
+        # Only features with overlapping bounding boxes are compared and all updates are written at once
+        intersect_count = flag_intersections(layer, field='intersect', keep=check_geom_intersect_keep,
+                                             class_field='class', log=print)
 
         # Update user
         print("Found %s intersecting geometries" % str(intersect_count))
@@ -770,10 +814,13 @@ def main(args):
     #/*     Cleanup
     #/* ======================================================================= */#
 
-    # Close OGR objects
-    driver = None
+    # Build indexes and close OGR objects
+    if datasource is not None:
+        create_indexes(datasource, layer, INDEX_FIELDS)
+    layer = None
     datasource = None
-    srs = None
+    if writer is not None:
+        writer.close()
 
     # Success
     print("Done.")
@@ -47,10 +47,14 @@ from os.path import *
 from pprint import pprint
 try:
     from osgeo import ogr
-    from osgeo import osr
 except ImportError:
     import ogr
-    import osr
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..', '..', '..', '..', '..', '..', '..')))
+from crowdtools.cache import ExportCache, load_cached_json
+from crowdtools.location import LocationKey
+from crowdtools.points import ConsensusPoints
+from crowdtools.sampling import SAMPLE_MODES, TaskSampler, load_sample
 
 
 #/* ======================================================================= */#
@@ -92,6 +96,39 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 
+#/* ======================================================================= */#
+#/*     Global Variables and Constants
+#/* ======================================================================= */#
+
+# Selections and the fields holding their counts - listed in the order ties are reported
+SELECTIONS = (('pad', 'n_pad_res'),
+              ('unknown', 'n_unk_res'),
+              ('nopad', 'n_nop_res'),
+              ('ERROR', 'ERROR'))
+
+# Output fields - --class adds a 'class' field
+FIELD_DEFINITIONS = (('id', 10, ogr.OFTInteger),
+                     ('site_id', 254, ogr.OFTString),
+                     ('wms_url', 254, ogr.OFTString),
+                     ('wms_id', 254, ogr.OFTString),
+                     ('wms_v', 254, ogr.OFTString),
+                     ('county', 254, ogr.OFTString),
+                     ('state', 254, ogr.OFTString),
+                     ('year', 10, ogr.OFTInteger),
+                     ('location', 254, ogr.OFTString),
+                     ('n_unk_res', 10, ogr.OFTInteger),
+                     ('n_nop_res', 10, ogr.OFTInteger),
+                     ('n_pad_res', 10, ogr.OFTInteger),
+                     ('n_tot_res', 10, ogr.OFTInteger),
+                     ('crowd_sel', 254, ogr.OFTString),
+                     ('qaqc', 254, ogr.OFTString),
+                     ('p_crd_a', 10, ogr.OFTReal),
+                     ('p_s_crd_a', 254, ogr.OFTString))
+
+# Key fields that get an attribute index in the output
+INDEX_FIELDS = ('id', 'site_id', 'location')
+
+
 #/* ======================================================================= */#
 #/*     Define print_usage() function
 #/* ======================================================================= */#
@@ -111,9 +148,21 @@ Usage: %s [options] task.json task_run.json outfile.shp
 Options:
   --class=str -> Add a field containing a value, or use %%str to get a field from the JSON
   --help-info -> Print out a list of help related flags
-  --of=driver -> Output driver name/file type - default='ESRI Shapefile'
+  --of=driver -> Output driver name/file type - default is based on the
+                 outfile extension or 'GPKG'
   --epsg=int  -> EPSG code for coordinates in task.json - default='4326'
   --overwrite -> Overwrite the output file
+  --sample=int -> Only process a sample of tasks - task files are streamed and
+                  only the sampled tasks' task runs are kept
+  --sample-mode=str -> head, random, or stratified - default='head'
+  --seed=int   -> Random seed for --sample-mode - default='0'
+  --strata=str -> Comma separated task info fields for stratified sampling
+                  - default='county,year'
+  --jobs=int   -> Analyze and write tasks in this many processes - default='1'
+  --shard-by=str -> Comma separated task info fields used to split tasks
+                  between processes or 'hash' - default='county,year'
+  --no-export-cache -> Parse task.json and task_run.json instead of re-using the
+                  copies cached in $CROWDTOOLS_CACHE_DIR or ~/.cache/crowdtools
 """ % __docname__)
     return 1
 
@@ -216,144 +265,52 @@ def print_version():
 
 
 #/* ======================================================================= */#
-#/*     Define get_crowd_selection() function
-#/* ======================================================================= */#
-
-def get_crowd_selection(selection_count, selection_map):
-
-    """
-    Figure out what the crowd actually selected
-
-    :param selection_count: the number of responses for each selection
-    :type selection_count: dict
-    :param selection_map: maps output file fields to selections
-    :type selection_map: dict
-
-    :return: the crowd's selection for a given group of selections or None
-    :rtype: str|None
-    """
-
-    # Cache containers
-    crowd_selection = 'NONE'
-
-    # Figure out what the maximum number of selections was
-    max_selection = max(selection_count.values())
-
-    # Build the crowd_selection
-    if max_selection is 0:
-        crowd_selection = None
-    else:
-        for selection, count in selection_count.iteritems():
-            if count is max_selection:
-                if crowd_selection == 'NONE':
-                    crowd_selection = selection_map[selection]
-                else:
-                    crowd_selection += '|' + selection_map[selection]
-
-    # Return to user
-    return crowd_selection
-
-
-#/* ======================================================================= */#
-#/*     Define get_crowd_selection_counts() function
+#/*     Define get_task_attributes() function
 #/* ======================================================================= */#
 
-def get_crowd_selection_counts(input_id, task_runs_json_object):
-
-    """
-    Figure out how many times the crowd selected each option
-
-    :param input_id: the id for a given task
-    :type input_id: int
-    :param task_runs_json_object: all of the input task_runs from json.load(open('task_run.json'))
-    :type task_runs_json_object: list
+def get_task_attributes(task, classification=None):
 
-    :return: number of responses for each selection
-    :rtype: dict
     """
+    Pull the attributes written for each task - crowd consensus fields are added by ConsensusPoints
 
-    counts = {'n_nop_res': 0,
-              'n_unk_res': 0,
-              'n_pad_res': 0,
-              'ERROR': 0}
-    for task_run in task_runs_json_object:
-        if input_id == task_run['task_id']:
-            try:
-                selection = task_run['info']['selection']
-            except KeyError:
-                selection = 'ERROR'
-            if selection == 'nopad':
-                counts['n_nop_res'] += 1
-            elif selection == 'unknown':
-                counts['n_unk_res'] += 1
-            elif selection == 'pad':
-                counts['n_pad_res'] += 1
-            else:
-                counts['ERROR'] += 1
-    return counts
-
-
-#/* ======================================================================= */#
-#/*     Define get_percent_crowd_agreement() function
-#/* ======================================================================= */#
+    :param task: a single task from task.json
+    :type task: dict
+    :param classification: value for the 'class' field or %field to pull it from the task
+    :type classification: str|None
 
-def get_percent_crowd_agreement(crowd_selection, selection_counts, total_responses, map_selection_field,
-                                error_val=None):
-
-    """
-    Figure out how well the crowd agreed and if two answers tied, figure out the agreement for both
-
-    :param crowd_selection: the winning selection for a given task
-    :type crowd_selection: str|None
-    :param selection_counts: number of responses for each count
-    :type selection_counts: dict
-    :param total_responses: total number of responses
-    :type total_responses: int
-    :param map_selection_field: maps selections to output file field names
-    :type map_selection_field: dict
-    :param error_val: set crowd agreement to this value if any errors are encountered
-    :type error_val: str|None
-
-    :return: percent crowd agreement and percent crowd agreement
+    :return: attributes for the task's feature
     :rtype: dict
     """
 
-    # Compute crowd agreement
-    # The try/except blocks are for situations where tasks have never been viewed, which yields zero total_responses
-    per_crowd_agreement = None
-    split_per_crowd_agreement = None
-
-    # Make sure the crowd actually made a selection
-    if crowd_selection is None:
-        per_crowd_agreement = None
-        split_per_crowd_agreement = None
-    elif total_responses is 0:
-        per_crowd_agreement = error_val
-        split_per_crowd_agreement = error_val
-    else:
-        if '|' not in crowd_selection:
-            try:
-                per_crowd_agreement = int(selection_counts[map_selection_field[crowd_selection]] * 100 / total_responses)
-            except ZeroDivisionError:
-                per_crowd_agreement = error_val
+    # First value in the tuple goes into task_attributes, and second references the info block within the task
+    # The third value in the tuple is the type object to be used
+    task_attributes = {'location': str(LocationKey.from_task(task, precision=None))}
+    initial_task_grab = [('id', 'id', int),
+                         ('latitude', 'latitude', str),
+                         ('longitude', 'longitude', str),
+                         ('wms_url', 'url', str),
+                         ('county', 'county', str),
+                         ('state', 'state', str),
+                         ('site_id', 'siteID', str),
+                         ('year', 'year', int)]
+    for attribute_name, info_reference, type_caster in initial_task_grab:
+        try:
+            task_attributes[attribute_name] = type_caster(task['info'][info_reference])
+        except (TypeError, KeyError):
+            task_attributes[attribute_name] = None
+
+    # Get the WMS version
+    task_attributes['wms_v'] = str(task['info']['options']['version'])
+    task_attributes['wms_id'] = str(task['info']['options']['layers'])
+
+    # Set values for additional fields
+    if classification is not None:
+        if classification[0] == '%':
+            task_attributes['class'] = str(task[classification[1:]])
         else:
+            task_attributes['class'] = str(classification)
 
-            # Compute percent agreement for each split response
-            for selection in crowd_selection.split('|'):
-                field_name = map_selection_field[selection]
-                selection_count = selection_counts[field_name]
-                try:
-                    per_crowd_agreement = int(selection_count * 100 / total_responses)
-                except ZeroDivisionError:
-                    per_crowd_agreement = error_val
-                if split_per_crowd_agreement is None:
-                    split_per_crowd_agreement = str(per_crowd_agreement)
-                else:
-                    split_per_crowd_agreement += '|' + str(per_crowd_agreement)
-
-            # Make sure the percent crowd agreement field is None when there is a split response
-            per_crowd_agreement = error_val
-    return {'p_crd_a': per_crowd_agreement, 'p_s_crd_a': split_per_crowd_agreement}
+    return task_attributes
 
 
 #/* ======================================================================= */#
@@ -377,12 +334,25 @@ def main(args):
     #/* ======================================================================= */#
 
     # OGR defaults
-    outfile_driver = 'ESRI Shapefile'
+    outfile_driver = None
     outfile_epsg_code = 4326
 
     # Output file
     overwrite_outfile = False
 
+    # Sampling options
+    sample_size = None
+    sample_mode = 'head'
+    sample_seed = 0
+    sample_strata = ('county', 'year')
+
+    # Parallel processing options
+    jobs = 1
+    shard_by = ('county', 'year')
+
+    # Re-use parsed exports from earlier runs
+    use_export_cache = True
+
     #/* ======================================================================= */#
     #/*     Containers
     #/* ======================================================================= */#
@@ -393,18 +363,6 @@ def main(args):
     task_runs_file = None
     outfile = None
 
-    # Map field names to selections
-    map_field_to_selection = {'n_nop_res': 'nopad',
-                              'n_unk_res': 'unknown',
-                              'n_pad_res': 'pad',
-                              'ERROR': 'ERROR'}
-
-    # Map selections to field names
-    map_selection_to_field = {'nopad': 'n_nop_res',
-                              'unknown': 'n_unk_res',
-                              'pad': 'n_pad_res',
-                              'ERROR': 'ERROR'}
-
     #/* ======================================================================= */#
     #/*     Defaults
     #/* ======================================================================= */#
@@ -434,6 +392,24 @@ def main(args):
         elif '--class=' in arg:
             classification = arg.split('=', 1)[1]
 
+        # Sampling options
+        elif '--sample=' in arg:
+            sample_size = int(arg.split('=', 1)[1])
+        elif '--sample-mode=' in arg:
+            sample_mode = arg.split('=', 1)[1]
+        elif '--seed=' in arg:
+            sample_seed = int(arg.split('=', 1)[1])
+        elif '--strata=' in arg:
+            sample_strata = tuple(arg.split('=', 1)[1].split(','))
+
+        # Parallel processing options
+        elif '--jobs=' in arg:
+            jobs = int(arg.split('=', 1)[1])
+        elif '--shard-by=' in arg:
+            shard_by = tuple(arg.split('=', 1)[1].split(','))
+        elif arg == '--no-export-cache':
+            use_export_cache = False
+
         # Additional options
         elif arg == '--overwrite':
             overwrite_outfile = True
@@ -503,6 +479,19 @@ def main(args):
         bail = True
         print("ERROR: Invalid EPSG code - must be an int: %s" % str(outfile_epsg_code))
 
+    # Check sampling options
+    if sample_mode not in SAMPLE_MODES:
+        bail = True
+        print("ERROR: Invalid --sample-mode: %s" % sample_mode)
+    if sample_size is not None and sample_size < 0:
+        bail = True
+        print("ERROR: Invalid --sample: %s" % str(sample_size))
+
+    # Check parallel processing options
+    if jobs < 1:
+        bail = True
+        print("ERROR: Invalid --jobs: %s" % str(jobs))
+
     if bail:
         return 1
 
@@ -510,185 +499,42 @@ def main(args):
     #/*     Load JSON Data
     #/* ======================================================================= */#
 
-    # Load task.json file into a JSON object
-    print("Loading task file...")
-    with open(tasks_file, 'r') as f:
-        tasks_json = json.load(f)
-    print("Found %s items" % str(len(tasks_json)))
+    export_cache = ExportCache() if use_export_cache else None
 
-    # Load task_run.json file into a JSON object
-    print("Loading task run file...")
-    with open(task_runs_file, 'r') as f:
-        task_runs_json = json.load(f)
-    print("Found %s items" % str(len(task_runs_json)))
+    # Stream a sample of tasks and only keep their task runs
+    if sample_size is not None:
+        print("Sampling %s tasks (%s)..." % (str(sample_size), sample_mode))
+        sampler = TaskSampler(sample_size, mode=sample_mode, seed=sample_seed, strata=sample_strata)
+        tasks_json, task_runs = load_sample(tasks_file, task_runs_file, sampler)
+        print("Found %s tasks and %s task runs" % (str(len(tasks_json)), str(len(task_runs))))
+
+    # Task runs are streamed into a table, or loaded from the export cache, by ConsensusPoints
+    else:
+        print("Loading task file...")
+        tasks_json = load_cached_json(tasks_file, export_cache)
+        print("Found %s items" % str(len(tasks_json)))
+        task_runs = task_runs_file
 
     #/* ======================================================================= */#
-    #/*     Create Output OGR Datasource/Layer/Definitions/etc.
+    #/*     Analyze Tasks and Write Output
     #/* ======================================================================= */#
 
-    # Get driver and make sure its valid
-    driver = ogr.GetDriverByName(outfile_driver)
-    if driver is None:
-        print("ERROR: Invalid OGR driver: %s" % outfile_driver)
-        return 1
-
-    # Overwrite output file if it exists then create new datasource
-    if isfile(outfile):
-        print("Overwriting output file: %s" % outfile)
-        driver.DeleteDataSource(outfile)
-    print("Creating output file: %s" % outfile)
-    data_source = driver.CreateDataSource(outfile)
-
-    # Define SRS
-    print("Defining SRS ...")
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(outfile_epsg_code)
-
-    # Create layer
-    print("Creating layer ...")
-    layer_name = basename(outfile).split('.')
-    layer_name = ''.join(layer_name[:len(layer_name) - 1])
-    layer = data_source.CreateLayer(layer_name, srs, ogr.wkbPoint)
-
-    # Define fields
-    print("Defining fields ...")
-    fields_definitions = [('id', 10, ogr.OFTInteger),
-                          ('site_id', 254, ogr.OFTString),
-                          ('wms_url', 254, ogr.OFTString),
-                          ('wms_id', 254, ogr.OFTString),
-                          ('wms_v', 254, ogr.OFTString),
-                          ('county', 254, ogr.OFTString),
-                          ('state', 254, ogr.OFTString),
-                          ('year', 10, ogr.OFTInteger),
-                          ('location', 254, ogr.OFTString),
-                          ('n_unk_res', 10, ogr.OFTInteger),
-                          ('n_nop_res', 10, ogr.OFTInteger),
-                          ('n_pad_res', 10, ogr.OFTInteger),
-                          ('n_tot_res', 10, ogr.OFTInteger),
-                          ('crowd_sel', 254, ogr.OFTString),
-                          ('qaqc', 254, ogr.OFTString),
-                          ('p_crd_a', 10, ogr.OFTReal),
-                          ('p_s_crd_a', 254, ogr.OFTString)]
-
     # Add extra fields
+    fields_definitions = list(FIELD_DEFINITIONS)
     if classification is not None:
         fields_definitions.append(('class', 254, ogr.OFTString))
 
-    # Create fields
-    for field in fields_definitions:
-        field_name = field[0]
-        field_width = field[1]
-        field_type = field[2]
-        print("  " + field_name)
-        field_object = ogr.FieldDefn(field_name, field_type)
-        field_object.SetWidth(field_width)
-        layer.CreateField(field_object)
-
-    #/* ======================================================================= */#
-    #/*     Analyze task.json Content
-    #/* ======================================================================= */#
-
-    # Loop through all task.json tasks
-    len_tasks_json = len(tasks_json)
-    i = 0
-    print("Analyzing tasks ...")
-    for task in tasks_json:
-
-        # Update user
-        i += 1
-        sys.stdout.write("\r\x1b[K" + "  %s/%s" % (str(i), str(len_tasks_json)))
-        sys.stdout.flush()
-
-        # Cache some information
-        input_task_id = task['id']
-        task_location = ''.join([str(task['info']['latitude']), str(task['info']['longitude']),
-                                 '---', str(task['info']['year'])])
-
-        # Get initial set of attributes from task body
-        # First value in the tuple goes into task_attributes, and second references the info block within the task
-        # The third value in the tuple is the type object to be used
-        task_attributes = {'location': task_location}
-        initial_task_grab = [('id', 'id', int),
-                             ('latitude', 'latitude', str),
-                             ('longitude', 'longitude', str),
-                             ('wms_url', 'url', str),
-                             ('county', 'county', str),
-                             ('state', 'state', str),
-                             ('site_id', 'siteID', str),
-                             ('year', 'year', int)]
-
-        for attributes in initial_task_grab:
-            attribute_name = attributes[0]
-            info_reference = attributes[1]
-            type_caster = attributes[2]
-            try:
-                task_attributes[attribute_name] = type_caster(task['info'][info_reference])
-            except (TypeError, KeyError):
-                task_attributes[attributes[0]] = None
-
-        # Get the WMS version
-        task_attributes['wms_v'] = str(task['info']['options']['version'])
-        task_attributes['wms_id'] = str(task['info']['options']['layers'])
-
-        # Get the crowd selection counts
-        crowd_selection_counts = get_crowd_selection_counts(input_task_id, task_runs_json)
-        task_attributes = dict(task_attributes.items() + crowd_selection_counts.items())
-
-        # Figure out what the crowd actually selected and the total number of responses
-        n_tot_res = int(sum(crowd_selection_counts.values()))
-        task_attributes['n_tot_res'] = n_tot_res
-        crowd_selection = get_crowd_selection(crowd_selection_counts, map_field_to_selection)
-        task_attributes['crowd_sel'] = crowd_selection
-
-        # Get crowd agreement levels
-        task_attributes = dict(task_attributes.items()
-                               + get_percent_crowd_agreement(task_attributes['crowd_sel'], crowd_selection_counts,
-                                                             n_tot_res, map_selection_to_field).items())
-
-        # Create the feature
-        feature = ogr.Feature(layer.GetLayerDefn())
-        field_values = [('id', task_attributes['id']),
-                        ('site_id', task_attributes['site_id']),
-                        ('wms_url', task_attributes['wms_url']),
-                        ('wms_id', task_attributes['wms_id']),
-                        ('wms_v', task_attributes['wms_v']),
-                        ('county', task_attributes['county']),
-                        ('state', task_attributes['state']),
-                        ('year', task_attributes['year']),
-                        ('location', task_attributes['location']),
-                        ('n_unk_res', task_attributes['n_unk_res']),
-                        ('n_nop_res', task_attributes['n_nop_res']),
-                        ('n_pad_res', task_attributes['n_pad_res']),
-                        ('n_tot_res', task_attributes['n_tot_res']),
-                        ('crowd_sel', task_attributes['crowd_sel']),
-                        ('p_crd_a', task_attributes['p_crd_a']),
-                        ('p_s_crd_a', task_attributes['p_s_crd_a'])]
-
-        # Set values for additional fields
-        if classification is not None:
-            if classification[0] == '%':
-                field_values.append(('class', str(task[classification[1:]])))
-            else:
-                field_values.append(('class', str(classification)))
-
-        # Populate fields
-        for field, value in field_values:
-            feature.SetField(field, value)
-        wkt = "POINT(%f %f)" % (float(task_attributes['longitude']), float(task_attributes['latitude']))
-        point = ogr.CreateGeometryFromWkt(wkt)
-        feature.SetGeometry(point)
-        layer.CreateFeature(feature)
-
-        # Cleanup feature
-        feature = None
-
-    #/* ======================================================================= */#
-    #/*     Cleanup
-    #/* ======================================================================= */#
-
-    # Destroy OGR objects
-    data_source = None
-    layer = None
+    exporter = ConsensusPoints(SELECTIONS, fields_definitions,
+                               lambda task: get_task_attributes(task, classification=classification),
+                               index_fields=INDEX_FIELDS)
+    try:
+        exporter.export(tasks_json, task_runs, outfile, driver_name=outfile_driver, epsg=outfile_epsg_code,
+                        overwrite=overwrite_outfile, jobs=jobs, shard_keys=shard_by,
+                        shard_mode='hash' if shard_by == ('hash',) else 'group',
+                        export_cache=export_cache, log=print)
+    except (ValueError, RuntimeError) as e:
+        print("ERROR: %s" % e)
+        return 1
 
     # Success
     print("  - Done.")
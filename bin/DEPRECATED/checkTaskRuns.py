@@ -3,8 +3,12 @@
 
 import sys
 import json
+from os.path import abspath, dirname
 from pprint import pprint
 
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+from crowdtools.location import LocationIndex, LocationKey
+
 
 PRECISION = 8
 
@@ -21,17 +25,25 @@ def load_json(input_file):
 def get_location(task, precision=PRECISION):
 
     """
-    Get a task's location
+    Get a task's location as a LocationKey - str() gives the lat + lng + '---' + year string
     """
 
-    lat = task['info']['latitude']
-    lng = task['info']['longitude']
-    year = task['info']['year']
-    if precision is not None:
-        lat = round(lat, precision)
-        lng = round(lng, precision)
+    return LocationKey.from_task(task, precision=precision)
+
+
+def group_task_runs(task_runs):
 
-    return str(lat) + str(lng) + '---' + str(year)
+    """
+    Group task runs by task ID so each task's runs are found with a single dict lookup
+    """
+
+    output = {}
+    for tr in task_runs:
+        try:
+            output[tr['task_id']].append(tr)
+        except KeyError:
+            output[tr['task_id']] = [tr]
+    return output
 
 
 def does_task_have_task_runs(task, task_runs):
@@ -39,71 +51,55 @@ def does_task_have_task_runs(task, task_runs):
     """
     Figure out if at least one task run exists for a given task
 
-    Faster than get_task_runs()
+    task_runs comes from group_task_runs()
     """
 
-    task_id = task['id']
-    for tr in task_runs:
-        if task_id == tr['task_id']:
-            return True
-    else:
-        return False
+    return task['id'] in task_runs
 
 
-def get_task_runs(task, task_runs_object):
+def get_task_runs(task, task_runs):
 
     """
     Return a list of all associated task runs for a task
+
+    task_runs comes from group_task_runs()
     """
 
-    output_list = []
-    task_id = task['id']
-    for tr in task_runs_object:
-        if task_id == tr['task_id']:
-            output_list.append(tr)
-    return output_list
+    return task_runs.get(task['id'], [])
 
 
-def location2task(location, tasks, precision=PRECISION):
+def location2task(location, index, stage):
 
     """
-    Take a location and search through a set of tasks for a matching location - return that task
+    Take a location and look up the first task with a matching location in one stage of a LocationIndex - return
+    that task
     """
 
-    for task in tasks:
-        if location == get_location(task, precision=precision):
-            return task
+    tasks = index.get(location, stage)
+    if tasks:
+        return tasks[0]
     else:
         return None
 
 
 def find_missing_task_runs(missing_locations=None,
-                           first_internal_tasks=None,
+                           index=None,
                            first_internal_task_runs=None,
-                           final_internal_tasks=None,
                            final_internal_task_runs=None,
-                           sweeper_tasks=None,
                            sweeper_task_runs=None,
-                           missing_tasks=None,
                            missing_task_runs=None):
 
     # Validate
     if missing_locations is None:
         raise ValueError("Need missing_locations")
-    if first_internal_tasks is None:
-        raise ValueError("Need first_internal_tasks")
+    if index is None:
+        raise ValueError("Need index")
     if first_internal_task_runs is None:
         raise ValueError("Need first_internal_task_runs")
-    if final_internal_tasks is None:
-        raise ValueError("Need final_internal_tasks")
     if final_internal_task_runs is None:
         raise ValueError("Need final_internal_task_runs")
-    if sweeper_tasks is None:
-        raise ValueError("Need sweeper_tasks")
     if sweeper_task_runs is None:
         raise ValueError("Need sweeper_task_runs")
-    if missing_tasks is None:
-        raise ValueError("Need missing_tasks")
     if missing_task_runs is None:
         raise ValueError("Need missing_task_runs")
 
@@ -112,57 +108,53 @@ def find_missing_task_runs(missing_locations=None,
     matched_final_internal_locations = []
     matched_sweeper_locations = []
     matched_missing_internal_locations = []
-    found_public = []
-    found_first_internal = []
-    found_final_internal = []
-    found_sweeper_internal = []
-    found_missing_internal = []
+    found_public = set()
+    found_first_internal = set()
+    found_final_internal = set()
+    found_sweeper_internal = set()
+    found_missing_internal = set()
 
     # Look in first internal for missing locations
     print("  Searching for missing task runs in first internal...")
     for missing_location in missing_locations:
-        fi_task = location2task(missing_location, first_internal_tasks)
+        fi_task = location2task(missing_location, index, 'first_internal')
         if fi_task is not None:
             matched_first_internal_locations.append(missing_location)
             if len(get_task_runs(fi_task, first_internal_task_runs)) > 0:
-                if missing_location not in found_first_internal:
-                    found_first_internal.append(missing_location)
+                found_first_internal.add(missing_location)
     print("    Matched locations: %s" % str(len(matched_first_internal_locations)))
     print("    Found %s in first internal" % str(len(found_first_internal)))
 
     # Look in final internal for missing locations
     print("  Searching for missing task runs in final internal...")
     for missing_location in missing_locations:
-        fn_task = location2task(missing_location, final_internal_tasks)
+        fn_task = location2task(missing_location, index, 'final_internal')
         if fn_task is not None:
             matched_final_internal_locations.append(missing_location)
             if len(get_task_runs(fn_task, final_internal_task_runs)) > 0:
-                if missing_location not in found_final_internal:
-                    found_final_internal.append(missing_location)
+                found_final_internal.add(missing_location)
     print("    Matched locations: %s" % str(len(matched_final_internal_locations)))
     print("    Found %s in final internal" % str(len(found_final_internal)))
 
     # Look in sweeper for missing locations
     print("  Searching for missing task runs in sweeper internal...")
     for missing_location in missing_locations:
-        sw_task = location2task(missing_location, sweeper_tasks)
+        sw_task = location2task(missing_location, index, 'sweeper')
         if sw_task is not None:
             matched_sweeper_locations.append(missing_location)
             if len(get_task_runs(sw_task, sweeper_task_runs)) > 0:
-                if missing_location not in found_sweeper_internal:
-                    found_sweeper_internal.append(missing_location)
+                found_sweeper_internal.add(missing_location)
     print("    Matched locations: %s" % str(len(matched_sweeper_locations)))
     print("    Found %s in sweeper internal" % str(len(found_sweeper_internal)))
 
     # Look in missing for missing locations
     print("  Searching for missing task runs in missing internal...")
     for missing_location in missing_locations:
-        mi_task = location2task(missing_location, missing_tasks)
+        mi_task = location2task(missing_location, index, 'missing')
         if mi_task is not None:
             matched_missing_internal_locations.append(missing_location)
             if len(get_task_runs(mi_task, missing_task_runs)) > 0:
-                if missing_location not in found_missing_internal:
-                    found_missing_internal.append(missing_location)
+                found_missing_internal.add(missing_location)
     print("    Matched locations: %s" % str(len(matched_missing_internal_locations)))
     print("    Found %s in missing internal" % str(len(found_missing_internal)))
 
@@ -234,6 +226,19 @@ def main(args):
     missing_task_runs = load_json(missing_task_runs_file)
     print("  %s" % str(len(missing_task_runs)))
 
+    # Index every stage's tasks by location and group task runs by task so lookups don't rescan the exports
+    index = LocationIndex(key_func=get_location)
+    index.add_stage('public', public_tasks)
+    index.add_stage('first_internal', first_internal_tasks)
+    index.add_stage('final_internal', final_internal_tasks)
+    index.add_stage('sweeper', sweeper_tasks)
+    index.add_stage('missing', missing_tasks)
+    public_task_runs = group_task_runs(public_task_runs)
+    first_internal_task_runs = group_task_runs(first_internal_task_runs)
+    final_internal_task_runs = group_task_runs(final_internal_task_runs)
+    sweeper_task_runs = group_task_runs(sweeper_task_runs)
+    missing_task_runs = group_task_runs(missing_task_runs)
+
     # == Check For Missing Task Runs == #
 
     # Check public
@@ -246,18 +251,15 @@ def main(args):
             missing_public_locations.append(get_location(task))
     print("  Found %s" % str(len(missing_public_locations)))
     for location in missing_public_locations:
-        missing_json.append(location2task(location, public_tasks))
+        missing_json.append(location2task(location, index, 'public'))
 
     # If there are any missing public locations, figure out WTF they went
     if len(missing_public_locations) > 0:
         find_missing_task_runs(missing_locations=missing_public_locations,
-                               first_internal_tasks=first_internal_tasks,
+                               index=index,
                                first_internal_task_runs=first_internal_task_runs,
-                               final_internal_tasks=final_internal_tasks,
                                final_internal_task_runs=final_internal_task_runs,
-                               sweeper_tasks=sweeper_tasks,
                                sweeper_task_runs=sweeper_task_runs,
-                               missing_tasks=missing_tasks,
                                missing_task_runs=missing_task_runs)
 
     # Check first internal
@@ -272,13 +274,10 @@ def main(args):
     # If there are any missing public locations, figure out WTF they went
     if len(missing_first_internal_locations) > 0:
         find_missing_task_runs(missing_locations=missing_first_internal_locations,
-                               first_internal_tasks=first_internal_tasks,
+                               index=index,
                                first_internal_task_runs=first_internal_task_runs,
-                               final_internal_tasks=final_internal_tasks,
                                final_internal_task_runs=final_internal_task_runs,
-                               sweeper_tasks=sweeper_tasks,
                                sweeper_task_runs=sweeper_task_runs,
-                               missing_tasks=missing_tasks,
                                missing_task_runs=missing_task_runs)
 
     # check final internal
@@ -293,13 +292,10 @@ def main(args):
     # If there are any missing public locations, figure out WTF they went
     if len(missing_final_internal_locations) > 0:
         find_missing_task_runs(missing_locations=missing_final_internal_locations,
-                               first_internal_tasks=first_internal_tasks,
+                               index=index,
                                first_internal_task_runs=first_internal_task_runs,
-                               final_internal_tasks=final_internal_tasks,
                                final_internal_task_runs=final_internal_task_runs,
-                               sweeper_tasks=sweeper_tasks,
                                sweeper_task_runs=sweeper_task_runs,
-                               missing_tasks=missing_tasks,
                                missing_task_runs=missing_task_runs)
 
     # Check sweeper internal
@@ -314,13 +310,10 @@ def main(args):
     # If there are any missing public locations, figure out WTF they went
     if len(missing_sweeper_locations) > 0:
         find_missing_task_runs(missing_locations=missing_sweeper_locations,
-                               first_internal_tasks=first_internal_tasks,
+                               index=index,
                                first_internal_task_runs=first_internal_task_runs,
-                               final_internal_tasks=final_internal_tasks,
                                final_internal_task_runs=final_internal_task_runs,
-                               sweeper_tasks=sweeper_tasks,
                                sweeper_task_runs=sweeper_task_runs,
-                               missing_tasks=missing_tasks,
                                missing_task_runs=missing_task_runs)
 
     # Check missing internal
@@ -335,11 +328,9 @@ def main(args):
     # If there are any missing public locations, figure out WTF they went
     if len(missing_sweeper_locations) > 0:
         find_missing_task_runs(missing_locations=missing_sweeper_locations,
-                               first_internal_tasks=first_internal_tasks,
+                               index=index,
                                first_internal_task_runs=first_internal_task_runs,
-                               final_internal_tasks=final_internal_tasks,
                                final_internal_task_runs=final_internal_task_runs,
-                               missing_tasks=missing_tasks,
                                missing_task_runs=missing_task_runs)
 
     # Success
@@ -11,7 +11,10 @@ __license__ = 'New BSD (See LICENSE.txt)'
 import os
 import sys
 import json
-from os.path import isfile
+from os.path import abspath, dirname, isfile
+
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+from crowdtools.location import LocationKey
 
 
 def print_usage():
@@ -31,27 +34,26 @@ def print_usage():
 
 def get_location(task, return_dict=False, lat_long_sep='', long_year_sep='---'):
     try:
-        lat = task['info']['latitude']
-        lng = task['info']['longitude']
-        year = task['info']['year']
+        if return_dict:
+            return {'latitude': task['info']['latitude'],
+                    'longitude': task['info']['longitude'],
+                    'year': task['info']['year']}
+        else:
+            return LocationKey.from_task(task, precision=None).to_string(lat_long_sep, long_year_sep)
     except KeyError:
         return None
-    if return_dict:
-        return {'latitude': lat,
-                'longitude': lng,
-                'year': year}
-    else:
-        return ''.join([str(lat), lat_long_sep, str(lng), long_year_sep, str(year)])
 
 
-def count_task_runs(task, task_runs, input_task_field='id', task_run_field='task_id'):
-    task_id = str(task[input_task_field])
-    count = 0
+def get_task_run_counts(task_runs, task_run_field='task_id'):
+    counts = {}
     for task_run in task_runs:
-        task_run_id = str(task_run[task_run_field])
-        if task_id == task_run_id:
-            count += 1
-    return count
+        task_id = str(task_run[task_run_field])
+        counts[task_id] = counts.get(task_id, 0) + 1
+    return counts
+
+
+def count_task_runs(task, task_run_counts, input_task_field='id'):
+    return task_run_counts.get(str(task[input_task_field]), 0)
 
 
 def main(args):
@@ -143,6 +145,7 @@ def main(args):
         with open(task_runs_file, 'r') as f:
             task_runs_json = json.load(f)
         print("Found %s items" % str(len(task_runs_json)))
+        task_run_counts = get_task_run_counts(task_runs_json)
 
     # Write data to the output file
     min_task_run_count = None
@@ -163,7 +166,7 @@ def main(args):
 
             # Define the line content based on whether or not we need the number of matching items from task_run.json
             if compute_num_task_runs:
-                num_task_runs = count_task_runs(task, task_runs_json)
+                num_task_runs = count_task_runs(task, task_run_counts)
                 line = ''.join([text_qualifier, task_location, text_qualifier, delimiter, str(num_task_runs), line_sep])
 
                 # Update min/max stats
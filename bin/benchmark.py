@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+
+
+# This document is part of CrowdTools
+# https://github.com/SkyTruth/CrowdTools
+
+
+# =================================================================================== #
+#
+# New BSD License
+#
+# Copyright (c) 2014, SkyTruth, Kevin D. Wurster
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * The names of its contributors may not be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# =================================================================================== #
+
+
+"""
+Benchmark crowdtools and the pipeline scripts against synthetic exports
+"""
+
+
+import os
+import sys
+import json
+from os.path import *
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from crowdtools.benchmark import SIZES, compare_results, run_benchmarks
+
+
+#/* ======================================================================= */#
+#/*     File Specific Information
+#/* ======================================================================= */#
+
+__docname__ = basename(__file__)
+__all__ = ['print_usage', 'print_help', 'print_license', 'print_help_info', 'print_version', 'main']
+
+
+#/* ======================================================================= */#
+#/*     Build Information
+#/* ======================================================================= */#
+
+__version__ = '0.1-dev'
+__release__ = '2014-08-27'
+__copyright__ = 'Copyright 2014, SkyTruth'
+__author__ = 'Kevin Wurster'
+__license__ = '''
+New BSD License
+
+Copyright (c) 2014, Kevin D. Wurster
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* The names of its contributors may not be used to endorse or promote products
+  derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+#/* ======================================================================= */#
+#/*     Define print_usage() function
+#/* ======================================================================= */#
+
+def print_usage():
+
+    """
+    Print commandline usage
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Usage:
+    {0} --help-info
+    {0} [options] results.json
+
+Options:
+    --overwrite         Overwrite results.json
+    --sizes=int,int     Export sizes in task runs [default: 10000,100000,1000000]
+    --only=str,str      Only run benchmarks whose names contain one of these
+    --no-functions      Skip the crowdtools function benchmarks
+    --no-scripts        Skip the pipeline script benchmarks
+    --python=path       Interpreter for the pipeline scripts
+                        [default: the current interpreter]
+    --workdir=path      Keep generated exports here and re-use them next time
+                        [default: a temporary directory]
+    --seed=int          Random seed for the synthetic exports [default: 0]
+    --compare=path      Results from a previous run to compare against
+    --threshold=float   Relative slowdown or memory growth reported as a
+                        regression [default: 0.1]
+    """.format(__docname__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help() function
+#/* ======================================================================= */#
+
+def print_help():
+
+    """
+    Print more detailed help information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help: {0}
+------{1}
+Generates synthetic exports with crowdtools.synthetic and records wall time,
+CPU time, and peak resident memory for each crowdtools function and each
+pipeline script at each size.  Every benchmark runs in a new interpreter so
+memory numbers are not affected by earlier benchmarks.  Results are written
+as JSON along with the git version of the repository so runs from different
+versions can be compared with --compare.  Benchmarks that fail, e.g. scripts
+that need GDAL when it isn't installed, are recorded with an error instead of
+stopping the run.
+    """.format(__docname__, '-' * len(__docname__)))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_license() function
+#/* ======================================================================= */#
+
+def print_license():
+
+    """
+    Print licensing information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print(__license__)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help_info() function
+#/* ======================================================================= */#
+
+def print_help_info():
+
+    """
+    Print a list of help related flags
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help Flags:
+    --help-info     This printout
+    --help          More detailed description of this utility
+    --usage         Arguments, parameters, flags, options, etc.
+    --version       Version and ownership information
+    --license       License information
+    """)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_version() function
+#/* ======================================================================= */#
+
+def print_version():
+
+    """
+    Print the module version information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+%s version %s - released %s
+
+%s
+    """ % (__docname__, __version__, __release__, __copyright__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define main()
+#/* ======================================================================= */#
+
+def main(args):
+
+    """
+    Commandline logic
+
+    :param args: commandline arguments from sys.argv[1:]
+    :type args: list|tuple
+
+    :return: 0 on success and 1 on failure
+    :rtype: int
+    """
+
+    #/* ======================================================================= */#
+    #/*     Defaults
+    #/* ======================================================================= */#
+
+    overwrite_outfile = False
+    sizes = SIZES
+    only = None
+    run_functions = True
+    run_scripts = True
+    script_python = None
+    workdir = None
+    seed = 0
+    compare_file = None
+    threshold = 0.1
+
+    #/* ======================================================================= */#
+    #/*     Containers
+    #/* ======================================================================= */#
+
+    output_file = None
+
+    #/* ======================================================================= */#
+    #/*     Parse Arguments
+    #/* ======================================================================= */#
+
+    arg_error = False
+    for arg in args:
+
+        # Help arguments
+        if arg in ('--help-info', '-help-info', '--helpinfo', '-help-info'):
+            return print_help_info()
+        elif arg in ('--help', '-help', '--h', '-h'):
+            return print_help()
+        elif arg in ('--usage', '-usage'):
+            return print_usage()
+        elif arg in ('--version', '-version'):
+            return print_version()
+        elif arg in ('--license', '-license'):
+            return print_license()
+
+        # Processing options
+        elif arg in ('--overwrite', '-overwrite'):
+            overwrite_outfile = True
+        elif '--sizes=' in arg:
+            sizes = [int(s) for s in arg.split('=', 1)[1].split(',')]
+        elif '--only=' in arg:
+            only = arg.split('=', 1)[1].split(',')
+        elif arg == '--no-functions':
+            run_functions = False
+        elif arg == '--no-scripts':
+            run_scripts = False
+        elif '--python=' in arg:
+            script_python = arg.split('=', 1)[1]
+        elif '--workdir=' in arg:
+            workdir = arg.split('=', 1)[1]
+        elif '--seed=' in arg:
+            seed = int(arg.split('=', 1)[1])
+        elif '--compare=' in arg:
+            compare_file = arg.split('=', 1)[1]
+        elif '--threshold=' in arg:
+            threshold = float(arg.split('=', 1)[1])
+
+        # Positional arguments and errors
+        elif output_file is None:
+            output_file = arg
+        else:
+            arg_error = True
+            print("ERROR: Invalid argument: %s" % str(arg))
+
+    #/* ======================================================================= */#
+    #/*     Validate configuration
+    #/* ======================================================================= */#
+
+    bail = False
+    if arg_error:
+        bail = True
+        print("ERROR: Did not successfully parse arguments")
+    if output_file is None:
+        bail = True
+        print("ERROR: Need an output results.json")
+    elif exists(output_file) and not overwrite_outfile:
+        bail = True
+        print("ERROR: Output file exists and overwrite=%s: %s" % (str(overwrite_outfile), output_file))
+    if compare_file is not None and not isfile(compare_file):
+        bail = True
+        print("ERROR: Can't access comparison file: %s" % compare_file)
+    if workdir is not None and not isdir(workdir):
+        bail = True
+        print("ERROR: Working directory doesn't exist: %s" % workdir)
+    if bail:
+        return 1
+
+    #/* ======================================================================= */#
+    #/*     Run benchmarks
+    #/* ======================================================================= */#
+
+    def report(result):
+        if result['error']:
+            print("  %-40s %9s  ERROR: %s" % (result['name'], result['size'], result['error']))
+        else:
+            print("  %-40s %9s  %9.3f s  %9.1f MB" % (result['name'], result['size'], result['wall'],
+                                                      result['peak_rss'] / 1024.0 ** 2))
+
+    print("Running benchmarks...")
+    results = run_benchmarks(sizes=sizes, workdir=workdir, only=only, functions=run_functions,
+                             scripts=run_scripts, python=script_python, seed=seed, callback=report)
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Wrote results to %s" % output_file)
+
+    #/* ======================================================================= */#
+    #/*     Compare against a previous run
+    #/* ======================================================================= */#
+
+    if compare_file is not None:
+        with open(compare_file) as f:
+            previous = json.load(f)
+        print("Comparing against %s (%s)..." % (compare_file, previous.get('version')))
+        for row in compare_results(previous, results, threshold=threshold):
+            print("  %-40s %9s  wall x%-6s  memory x%-6s %s" % (
+                row['name'], row['size'],
+                '%.2f' % row['wall_ratio'] if row['wall_ratio'] is not None else '-',
+                '%.2f' % row['peak_rss_ratio'] if row['peak_rss_ratio'] is not None else '-',
+                'REGRESSION' if row['regression'] else ''))
+
+    # Success
+    print("Done.")
+    return 0
+
+
+#/* ======================================================================= */#
+#/*     Commandline Execution
+#/* ======================================================================= */#
+
+if __name__ == '__main__':
+
+    # Didn't get enough arguments - print usage and exit
+    if len(sys.argv) == 1:
+        sys.exit(print_usage())
+
+    # Got enough arguments - give sys.argv[1:] to main()
+    else:
+        sys.exit(main(sys.argv[1:]))
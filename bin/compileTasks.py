@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+
+
+# This document is part of CrowdTools
+# https://github.com/SkyTruth/CrowdTools
+
+
+# =================================================================================== #
+#
+# New BSD License
+#
+# Copyright (c) 2014, SkyTruth, Kevin D. Wurster
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * The names of its contributors may not be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# =================================================================================== #
+
+
+"""
+Compile tasks from several PyBossa applications into a single dataset
+described by a JSON config file - see crowdtools.compiler
+"""
+
+
+import os
+import sys
+import json
+import multiprocessing
+from os.path import *
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from crowdtools.profiling import Profiler, phase
+from crowdtools.sampling import SAMPLE_MODES, TaskSampler
+from crowdtools.compiler import compile_stages, get_validation_report, load_config, write_csv, write_json, \
+    write_npz
+
+
+#/* ======================================================================= */#
+#/*     File Specific Information
+#/* ======================================================================= */#
+
+__docname__ = basename(__file__)
+__all__ = ['print_usage', 'print_help', 'print_license', 'print_help_info', 'print_version', 'main']
+
+
+#/* ======================================================================= */#
+#/*     Build Information
+#/* ======================================================================= */#
+
+__version__ = '0.1-dev'
+__release__ = '2014-08-28'
+__copyright__ = 'Copyright 2014, SkyTruth'
+__author__ = 'Kevin Wurster'
+__license__ = '''
+New BSD License
+
+Copyright (c) 2014, Kevin D. Wurster
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* The names of its contributors may not be used to endorse or promote products
+  derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+#/* ======================================================================= */#
+#/*     Define print_usage() function
+#/* ======================================================================= */#
+
+def print_usage():
+
+    """
+    Print commandline usage
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Usage:
+    {0} --help-info
+    {0} [options] --config=config.json --co=compiled.csv --so=scrubbed.csv --cj=compiled.json
+
+Options:
+    --cn=str        Also write compiled output to a NumPy .npz
+    --vr=str        Write a validation report JSON
+    --validate      Print a validation summary
+    --sample=int    Only analyze this many tasks
+    --sample-mode=str
+                    head analyzes the first tasks in every stage, random and
+                    stratified draw tasks from the first stage in one pass and
+                    only keep those locations
+                    [default: head]
+    --seed=int      Random seed for --sample-mode
+                    [default: 0]
+    --strata=str    Comma separated task info fields for stratified sampling
+                    [default: county,year]
+    --jobs=int      Number of processes used to analyze stages
+                    [default: {1}]
+    --cache=str     Directory for per-stage results - only stages whose input
+                    files changed since the last run are recomputed
+    --profile=str   Write wall time, CPU time, peak memory, and throughput for
+                    every phase to a JSON report - memory tracing slows the
+                    run down
+    --profile-dump=str
+                    Write cProfile stats for the slowest phase - read with pstats
+    --overwrite     Overwrite output files
+    """.format(__docname__, min(4, multiprocessing.cpu_count())))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help() function
+#/* ======================================================================= */#
+
+def print_help():
+
+    """
+    Print more detailed help information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help: {0}
+------{1}
+Builds a full history for every location in a project whose tasks were run
+through several PyBossa applications, plus a final set of attributes taken
+from the last application that saw each location.  The config file lists the
+stages in override order, maps selections to output fields, and lists the
+task.json fields that describe a location:
+
+    {{
+        "stages": [
+            {{"key": "public", "name": "public", "prefix": "p_",
+              "tasks": "public/task.json", "task_runs": "public/task_run.json"}},
+            {{"key": "fi_intern", "name": "first_internal", "prefix": "fi_",
+              "tasks": "first-internal/task.json", "task_runs": "first-internal/task_run.json"}}
+        ],
+        "selections": [["fracking", "n_frk_res"], ["unknown", "n_unk_res"], ["other", "n_oth_res"]],
+        "task_fields": [["lat", "latitude"], ["lng", "longitude"], ["year", "year"], ["wms_url", "url"]]
+    }}
+
+Paths are relative to the config file.  Optional keys are "precision",
+"delimiter", "error", "scrubbed_header", and "compiled_header".  Stages are
+analyzed in parallel and merged in order.
+
+Locations are written in the order they first appear in the first stage's
+task.json.  Compiled JSON keys follow "task_fields", then comp_loc and the
+final answer, then one object per stage in config order.
+    """.format(__docname__, '-' * len(__docname__)))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_license() function
+#/* ======================================================================= */#
+
+def print_license():
+
+    """
+    Print licensing information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print(__license__)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help_info() function
+#/* ======================================================================= */#
+
+def print_help_info():
+
+    """
+    Print a list of help related flags
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help Flags:
+    --help-info     This printout
+    --help          More detailed description of this utility
+    --usage         Arguments, parameters, flags, options, etc.
+    --version       Version and ownership information
+    --license       License information
+    """)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_version() function
+#/* ======================================================================= */#
+
+def print_version():
+
+    """
+    Print the module version information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+%s version %s - released %s
+
+%s
+    """ % (__docname__, __version__, __release__, __copyright__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define main()
+#/* ======================================================================= */#
+
+def main(args):
+
+    """
+    Commandline logic
+
+    :param args: commandline arguments from sys.argv[1:]
+    :type args: list|tuple
+
+    :return: 0 on success and 1 on failure
+    :rtype: int
+    """
+
+    #/* ======================================================================= */#
+    #/*     Defaults
+    #/* ======================================================================= */#
+
+    overwrite_outfiles = False
+    validate = False
+    sample_size = None
+    sample_mode = 'head'
+    sample_seed = 0
+    sample_strata = ('county', 'year')
+    cache_dir = None
+    profile_report_file = None
+    profile_dump_file = None
+    jobs = min(4, multiprocessing.cpu_count())
+
+    #/* ======================================================================= */#
+    #/*     Containers
+    #/* ======================================================================= */#
+
+    config_file = None
+    compiled_output_csv_file = None
+    compiled_output_json_file = None
+    compiled_output_npz_file = None
+    scrubbed_output_csv_file = None
+    validation_report_file = None
+
+    #/* ======================================================================= */#
+    #/*     Parse Arguments
+    #/* ======================================================================= */#
+
+    arg_error = False
+    for arg in args:
+
+        # Help arguments
+        if arg in ('--help-info', '-help-info', '--helpinfo', '-help-info'):
+            return print_help_info()
+        elif arg in ('--help', '-help', '--h', '-h'):
+            return print_help()
+        elif arg in ('--usage', '-usage'):
+            return print_usage()
+        elif arg in ('--version', '-version'):
+            return print_version()
+        elif arg in ('--license', '-license'):
+            return print_license()
+
+        # Input and output files
+        elif '--config=' in arg:
+            config_file = arg.split('=', 1)[1]
+        elif '--co=' in arg:
+            compiled_output_csv_file = arg.split('=', 1)[1]
+        elif '--so=' in arg:
+            scrubbed_output_csv_file = arg.split('=', 1)[1]
+        elif '--cj=' in arg:
+            compiled_output_json_file = arg.split('=', 1)[1]
+        elif '--cn=' in arg:
+            compiled_output_npz_file = arg.split('=', 1)[1]
+        elif '--vr=' in arg:
+            validation_report_file = arg.split('=', 1)[1]
+            validate = True
+
+        # Processing options
+        elif arg in ('--overwrite', '-overwrite'):
+            overwrite_outfiles = True
+        elif arg in ('--validate', '-validate'):
+            validate = True
+        elif '--sample=' in arg:
+            sample_size = int(arg.split('=', 1)[1])
+        elif '--sample-mode=' in arg:
+            sample_mode = arg.split('=', 1)[1]
+        elif '--seed=' in arg:
+            sample_seed = int(arg.split('=', 1)[1])
+        elif '--strata=' in arg:
+            sample_strata = tuple(arg.split('=', 1)[1].split(','))
+        elif '--jobs=' in arg:
+            jobs = int(arg.split('=', 1)[1])
+        elif '--cache=' in arg:
+            cache_dir = arg.split('=', 1)[1]
+        elif '--profile=' in arg:
+            profile_report_file = arg.split('=', 1)[1]
+        elif '--profile-dump=' in arg:
+            profile_dump_file = arg.split('=', 1)[1]
+
+        # Errors
+        else:
+            arg_error = True
+            print("ERROR: Invalid argument: %s" % str(arg))
+
+    #/* ======================================================================= */#
+    #/*     Validate configuration
+    #/* ======================================================================= */#
+
+    bail = False
+    if arg_error:
+        bail = True
+        print("ERROR: Did not successfully parse arguments")
+    config = None
+    if config_file is None or not os.access(config_file, os.R_OK):
+        bail = True
+        print("ERROR: Can't access config file: %s" % config_file)
+    else:
+        try:
+            config = load_config(config_file)
+        except (ValueError, KeyError, TypeError) as e:
+            bail = True
+            print("ERROR: Invalid config file: %s - %s" % (config_file, e))
+    if config is not None:
+        for stage in config.stages:
+            for path in (stage.tasks, stage.task_runs):
+                if not os.access(path, os.R_OK):
+                    bail = True
+                    print("ERROR: Can't access %s input file: %s" % (stage.key, path))
+    for label, outfile in (('compiled output CSV', compiled_output_csv_file),
+                           ('scrubbed output CSV', scrubbed_output_csv_file),
+                           ('compiled output JSON', compiled_output_json_file)):
+        if outfile is None:
+            bail = True
+            print("ERROR: No %s supplied" % label)
+        elif isfile(outfile) and not overwrite_outfiles:
+            bail = True
+            print("ERROR: Output file exists and overwrite=%s: %s" % (str(overwrite_outfiles), outfile))
+    for outfile in (compiled_output_npz_file, validation_report_file, profile_report_file, profile_dump_file):
+        if outfile is not None and isfile(outfile) and not overwrite_outfiles:
+            bail = True
+            print("ERROR: Output file exists and overwrite=%s: %s" % (str(overwrite_outfiles), outfile))
+    if compiled_output_npz_file is not None:
+        try:
+            import numpy
+        except ImportError:
+            bail = True
+            print("ERROR: Writing compiled output NPZ requires numpy")
+    if cache_dir is not None and not isdir(cache_dir):
+        bail = True
+        print("ERROR: Cache directory doesn't exist: %s" % cache_dir)
+    if jobs < 1:
+        bail = True
+        print("ERROR: Invalid --jobs: %s" % jobs)
+    if sample_mode not in SAMPLE_MODES:
+        bail = True
+        print("ERROR: Invalid --sample-mode: %s" % sample_mode)
+    elif sample_mode != 'head' and sample_size is None:
+        bail = True
+        print("ERROR: --sample-mode=%s requires --sample" % sample_mode)
+    if bail:
+        return 1
+
+    #/* ======================================================================= */#
+    #/*     Compile
+    #/* ======================================================================= */#
+
+    def log(message):
+        print(message)
+
+    sampler = None
+    if sample_mode != 'head':
+        sampler = TaskSampler(sample_size, mode=sample_mode, seed=sample_seed, strata=sample_strata)
+        sample_size = None
+
+    profiler = None
+    if profile_report_file is not None or profile_dump_file is not None:
+        profiler = Profiler(cprofile=profile_dump_file is not None)
+
+    compiled = compile_stages(config, sample=sample_size, jobs=jobs, cache_dir=cache_dir, log=log, sampler=sampler,
+                              profiler=profiler)
+    locations = compiled['locations']
+
+    if validate:
+        print("Validating stages...")
+        with phase(profiler, "validation report") as info:
+            report = get_validation_report(config, compiled)
+            info['records'] = len(locations)
+        for stage in config.stages:
+            print("  %s with no task runs: %s" % (
+                stage.label, len(report['stages'][stage.name]['tasks_without_task_runs'])))
+        print("  Total unique locations with no task runs: %s" % len(report['locations_without_task_runs']))
+        print("  Never completed: %s" % len(report['locations_never_completed']))
+        if validation_report_file is not None:
+            print("Writing validation report: %s" % validation_report_file)
+            with open(validation_report_file, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    #/* ======================================================================= */#
+    #/*     Write Outputs
+    #/* ======================================================================= */#
+
+    outputs = [("compiled output JSON", write_json, (locations, compiled_output_json_file)),
+               ("scrubbed output CSV", write_csv, (locations, config.scrubbed_header, scrubbed_output_csv_file)),
+               ("compiled output CSV", write_csv, (locations, config.compiled_header, compiled_output_csv_file))]
+    if compiled_output_npz_file is not None:
+        outputs.append(("compiled output NPZ", write_npz,
+                        (locations, config.compiled_header, compiled_output_npz_file)))
+    for label, writer, writer_args in outputs:
+        print("Writing %s..." % label)
+        with phase(profiler, "write " + label) as info:
+            writer(*writer_args)
+            info['records'] = len(locations)
+
+    if profiler is not None:
+        profiler.close()
+        if profile_report_file is not None:
+            print("Writing profile report: %s" % profile_report_file)
+            profiler.write_report(profile_report_file)
+        if profile_dump_file is not None:
+            print("Writing cProfile stats for slowest phase (%s): %s"
+                  % (profiler.dump_stats(profile_dump_file), profile_dump_file))
+
+    # Success
+    print("Done.")
+    return 0
+
+
+#/* ======================================================================= */#
+#/*     Commandline Execution
+#/* ======================================================================= */#
+
+if __name__ == '__main__':
+
+    # Didn't get enough arguments - print usage and exit
+    if len(sys.argv) == 1:
+        sys.exit(print_usage())
+
+    # Got enough arguments - give sys.argv[1:] to main()
+    else:
+        sys.exit(main(sys.argv[1:]))
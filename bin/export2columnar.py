@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+
+# This document is part of CrowdTools
+# https://github.com/SkyTruth/CrowdTools
+
+
+# =================================================================================== #
+#
+# New BSD License
+#
+# Copyright (c) 2014, SkyTruth, Kevin D. Wurster
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * The names of its contributors may not be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# =================================================================================== #
+
+
+"""
+Convert a PyBossa task.json or task_run.json export to a memory-mappable
+directory of .npy columns
+"""
+
+
+import os
+import sys
+from os.path import *
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from crowdtools.columnar import convert_export
+
+
+#/* ======================================================================= */#
+#/*     File Specific Information
+#/* ======================================================================= */#
+
+__docname__ = basename(__file__)
+__all__ = ['print_usage', 'print_help', 'print_license', 'print_help_info', 'print_version', 'main']
+
+
+#/* ======================================================================= */#
+#/*     Build Information
+#/* ======================================================================= */#
+
+__version__ = '0.1-dev'
+__release__ = '2014-08-25'
+__copyright__ = 'Copyright 2014, SkyTruth'
+__author__ = 'Kevin Wurster'
+__license__ = '''
+New BSD License
+
+Copyright (c) 2014, Kevin D. Wurster
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* The names of its contributors may not be used to endorse or promote products
+  derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+#/* ======================================================================= */#
+#/*     Define print_usage() function
+#/* ======================================================================= */#
+
+def print_usage():
+
+    """
+    Print commandline usage
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Usage:
+    {0} --help-info
+    {0} [options] export.json outdir
+
+Options:
+    --overwrite     Overwrite output directory
+    --kind=str      Export type: task or task_run
+                    [default: detected from the file]
+    """.format(__docname__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help() function
+#/* ======================================================================= */#
+
+def print_help():
+
+    """
+    Print more detailed help information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help: {0}
+------{1}
+Streams a task.json or task_run.json export into a directory containing one
+.npy file per column, a strings.json table for text columns, and a
+manifest.json describing the columns and the source file.  Load the output
+with crowdtools.columnar.ColumnarExport, which memory-maps the columns so
+multiple processes can share a single on-disk copy of a large export.
+    """.format(__docname__, '-' * len(__docname__)))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_license() function
+#/* ======================================================================= */#
+
+def print_license():
+
+    """
+    Print licensing information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print(__license__)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help_info() function
+#/* ======================================================================= */#
+
+def print_help_info():
+
+    """
+    Print a list of help related flags
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help Flags:
+    --help-info     This printout
+    --help          More detailed description of this utility
+    --usage         Arguments, parameters, flags, options, etc.
+    --version       Version and ownership information
+    --license       License information
+    """)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_version() function
+#/* ======================================================================= */#
+
+def print_version():
+
+    """
+    Print the module version information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+%s version %s - released %s
+
+%s
+    """ % (__docname__, __version__, __release__, __copyright__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define main()
+#/* ======================================================================= */#
+
+def main(args):
+
+    """
+    Commandline logic
+
+    :param args: commandline arguments from sys.argv[1:]
+    :type args: list|tuple
+
+    :return: 0 on success and 1 on failure
+    :rtype: int
+    """
+
+    #/* ======================================================================= */#
+    #/*     Defaults
+    #/* ======================================================================= */#
+
+    overwrite_outdir = False
+    export_kind = None
+
+    #/* ======================================================================= */#
+    #/*     Containers
+    #/* ======================================================================= */#
+
+    input_file = None
+    output_dir = None
+
+    #/* ======================================================================= */#
+    #/*     Parse Arguments
+    #/* ======================================================================= */#
+
+    arg_error = False
+    for arg in args:
+
+        # Help arguments
+        if arg in ('--help-info', '-help-info', '--helpinfo', '-help-info'):
+            return print_help_info()
+        elif arg in ('--help', '-help', '--h', '-h'):
+            return print_help()
+        elif arg in ('--usage', '-usage'):
+            return print_usage()
+        elif arg in ('--version', '-version'):
+            return print_version()
+        elif arg in ('--license', '-license'):
+            return print_license()
+
+        # Processing options
+        elif arg in ('--overwrite', '-overwrite'):
+            overwrite_outdir = True
+        elif '--kind=' in arg:
+            export_kind = arg.split('=', 1)[1]
+
+        # Positional arguments and errors
+        elif input_file is None:
+            input_file = arg
+        elif output_dir is None:
+            output_dir = arg
+        else:
+            arg_error = True
+            print("ERROR: Invalid argument: %s" % str(arg))
+
+    #/* ======================================================================= */#
+    #/*     Validate configuration
+    #/* ======================================================================= */#
+
+    bail = False
+    if arg_error:
+        bail = True
+        print("ERROR: Did not successfully parse arguments")
+    if input_file is None or not isfile(input_file) or not os.access(input_file, os.R_OK):
+        bail = True
+        print("ERROR: Can't access input file: %s" % input_file)
+    if output_dir is None:
+        bail = True
+        print("ERROR: Need an output directory")
+    elif exists(output_dir) and not overwrite_outdir:
+        bail = True
+        print("ERROR: Output directory exists and overwrite=%s: %s" % (str(overwrite_outdir), output_dir))
+    if export_kind not in (None, 'task', 'task_run'):
+        bail = True
+        print("ERROR: Invalid --kind: %s" % export_kind)
+    if bail:
+        return 1
+
+    #/* ======================================================================= */#
+    #/*     Convert
+    #/* ======================================================================= */#
+
+    print("Converting %s..." % input_file)
+    manifest = convert_export(input_file, output_dir, kind=export_kind, overwrite=overwrite_outdir)
+    print("  Wrote %s %s rows to %s" % (manifest['rows'], manifest['kind'], output_dir))
+
+    # Success
+    print("Done.")
+    return 0
+
+
+#/* ======================================================================= */#
+#/*     Commandline Execution
+#/* ======================================================================= */#
+
+if __name__ == '__main__':
+
+    # Didn't get enough arguments - print usage and exit
+    if len(sys.argv) == 1:
+        sys.exit(print_usage())
+
+    # Got enough arguments - give sys.argv[1:] to main()
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+
+# This document is part of CrowdTools
+# https://github.com/SkyTruth/CrowdTools
+
+
+# =================================================================================== #
+#
+# New BSD License
+#
+# Copyright (c) 2014, SkyTruth, Kevin D. Wurster
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * The names of its contributors may not be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# =================================================================================== #
+
+
+"""
+Write a synthetic PyBossa task.json and task_run.json for testing and benchmarking
+"""
+
+
+import os
+import sys
+from os.path import *
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from crowdtools.synthetic import PROFILES, write_export
+
+
+#/* ======================================================================= */#
+#/*     File Specific Information
+#/* ======================================================================= */#
+
+__docname__ = basename(__file__)
+__all__ = ['print_usage', 'print_help', 'print_license', 'print_help_info', 'print_version', 'main']
+
+
+#/* ======================================================================= */#
+#/*     Build Information
+#/* ======================================================================= */#
+
+__version__ = '0.1-dev'
+__release__ = '2014-08-27'
+__copyright__ = 'Copyright 2014, SkyTruth'
+__author__ = 'Kevin Wurster'
+__license__ = '''
+New BSD License
+
+Copyright (c) 2014, Kevin D. Wurster
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+* Redistributions of source code must retain the above copyright notice, this
+  list of conditions and the following disclaimer.
+
+* Redistributions in binary form must reproduce the above copyright notice,
+  this list of conditions and the following disclaimer in the documentation
+  and/or other materials provided with the distribution.
+
+* The names of its contributors may not be used to endorse or promote products
+  derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+
+#/* ======================================================================= */#
+#/*     Define print_usage() function
+#/* ======================================================================= */#
+
+def print_usage():
+
+    """
+    Print commandline usage
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Usage:
+    {0} --help-info
+    {0} [options] n_task_runs outdir
+
+Options:
+    --overwrite         Overwrite existing task.json and task_run.json in outdir
+    --profile=str       Export to model: tadpole, dartfrog, moorfrog, or digitizer
+                        [default: dartfrog]
+    --redundancy=int    Task runs per task [default: the profile's n_answers]
+    --selections=str    Answers and weights, e.g. pad:0.6,nopad:0.3,unknown:0.1
+                        [default: the profile's]
+    --agreement=float   Probability a task run gives the task's true answer
+                        [default: 0.85]
+    --incomplete=float  Fraction of tasks with fewer task runs than redundancy
+                        [default: 0.02]
+    --users=int         Number of distinct users [default: 50]
+    --anonymous=float   Fraction of task runs from anonymous users [default: 0]
+    --seed=int          Random seed [default: 0]
+    """.format(__docname__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help() function
+#/* ======================================================================= */#
+
+def print_help():
+
+    """
+    Print more detailed help information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help: {0}
+------{1}
+Generates exports with the same layout as the Tadpole, DartFrog, MoorFrog, and
+Digitizer exports in Data/FrackFinder at any scale.  Tasks are written one at
+a time so even very large exports use little memory.  The same arguments and
+seed always produce the same files.
+    """.format(__docname__, '-' * len(__docname__)))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_license() function
+#/* ======================================================================= */#
+
+def print_license():
+
+    """
+    Print licensing information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print(__license__)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help_info() function
+#/* ======================================================================= */#
+
+def print_help_info():
+
+    """
+    Print a list of help related flags
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help Flags:
+    --help-info     This printout
+    --help          More detailed description of this utility
+    --usage         Arguments, parameters, flags, options, etc.
+    --version       Version and ownership information
+    --license       License information
+    """)
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_version() function
+#/* ======================================================================= */#
+
+def print_version():
+
+    """
+    Print the module version information
+
+    :return: returns 1 for for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+%s version %s - released %s
+
+%s
+    """ % (__docname__, __version__, __release__, __copyright__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define main()
+#/* ======================================================================= */#
+
+def main(args):
+
+    """
+    Commandline logic
+
+    :param args: commandline arguments from sys.argv[1:]
+    :type args: list|tuple
+
+    :return: 0 on success and 1 on failure
+    :rtype: int
+    """
+
+    #/* ======================================================================= */#
+    #/*     Defaults
+    #/* ======================================================================= */#
+
+    overwrite_outfiles = False
+    options = {
+        'profile': 'dartfrog',
+        'seed': 0
+    }
+
+    #/* ======================================================================= */#
+    #/*     Containers
+    #/* ======================================================================= */#
+
+    n_task_runs = None
+    output_dir = None
+
+    #/* ======================================================================= */#
+    #/*     Parse Arguments
+    #/* ======================================================================= */#
+
+    arg_error = False
+    for arg in args:
+
+        # Help arguments
+        if arg in ('--help-info', '-help-info', '--helpinfo', '-help-info'):
+            return print_help_info()
+        elif arg in ('--help', '-help', '--h', '-h'):
+            return print_help()
+        elif arg in ('--usage', '-usage'):
+            return print_usage()
+        elif arg in ('--version', '-version'):
+            return print_version()
+        elif arg in ('--license', '-license'):
+            return print_license()
+
+        # Processing options
+        elif arg in ('--overwrite', '-overwrite'):
+            overwrite_outfiles = True
+        elif '--profile=' in arg:
+            options['profile'] = arg.split('=', 1)[1]
+        elif '--redundancy=' in arg:
+            options['redundancy'] = int(arg.split('=', 1)[1])
+        elif '--selections=' in arg:
+            options['selections'] = tuple(
+                (s.split(':')[0], float(s.split(':')[1])) for s in arg.split('=', 1)[1].split(','))
+        elif '--agreement=' in arg:
+            options['agreement'] = float(arg.split('=', 1)[1])
+        elif '--incomplete=' in arg:
+            options['incomplete'] = float(arg.split('=', 1)[1])
+        elif '--users=' in arg:
+            options['n_users'] = int(arg.split('=', 1)[1])
+        elif '--anonymous=' in arg:
+            options['anonymous'] = float(arg.split('=', 1)[1])
+        elif '--seed=' in arg:
+            options['seed'] = int(arg.split('=', 1)[1])
+
+        # Positional arguments and errors
+        elif n_task_runs is None:
+            n_task_runs = int(arg)
+        elif output_dir is None:
+            output_dir = arg
+        else:
+            arg_error = True
+            print("ERROR: Invalid argument: %s" % str(arg))
+
+    #/* ======================================================================= */#
+    #/*     Validate configuration
+    #/* ======================================================================= */#
+
+    bail = False
+    if arg_error:
+        bail = True
+        print("ERROR: Did not successfully parse arguments")
+    if n_task_runs is None or n_task_runs < 1:
+        bail = True
+        print("ERROR: Need a positive number of task runs: %s" % n_task_runs)
+    if output_dir is None or not isdir(output_dir):
+        bail = True
+        print("ERROR: Need an existing output directory: %s" % output_dir)
+    else:
+        for name in ('task.json', 'task_run.json'):
+            if exists(join(output_dir, name)) and not overwrite_outfiles:
+                bail = True
+                print("ERROR: Output file exists and overwrite=%s: %s" % (str(overwrite_outfiles),
+                                                                          join(output_dir, name)))
+    if options['profile'] not in PROFILES:
+        bail = True
+        print("ERROR: Invalid --profile: %s" % options['profile'])
+    if bail:
+        return 1
+
+    #/* ======================================================================= */#
+    #/*     Generate
+    #/* ======================================================================= */#
+
+    print("Generating %s task runs..." % n_task_runs)
+    task_file, task_run_file, n_tasks, n_runs = write_export(output_dir, n_task_runs, **options)
+    print("  Wrote %s tasks to %s" % (n_tasks, task_file))
+    print("  Wrote %s task runs to %s" % (n_runs, task_run_file))
+
+    # Success
+    print("Done.")
+    return 0
+
+
+#/* ======================================================================= */#
+#/*     Commandline Execution
+#/* ======================================================================= */#
+
+if __name__ == '__main__':
+
+    # Didn't get enough arguments - print usage and exit
+    if len(sys.argv) == 1:
+        sys.exit(print_usage())
+
+    # Got enough arguments - give sys.argv[1:] to main()
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -49,6 +49,10 @@ import sys
 import json
 from os.path import *
 
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from crowdtools.cache import ExportCache
+from crowdtools.cache import load_cached_json
+
 
 #/* ======================================================================= */#
 #/*     File Specific Information
@@ -121,6 +125,9 @@ Options:
     --overwrite     Overwrite output file
     --prefix=str    Prefix for all task fields
                     [default: _t_]
+    --no-export-cache
+                    Parse task.json and task_run.json instead of re-using the
+                    copies cached in $CROWDTOOLS_CACHE_DIR or ~/.cache/crowdtools
     """.format(__docname__))
 
     return 1
@@ -290,6 +297,7 @@ def main(args):
     # I/O configuration
     overwrite_outfile = False
     field_prefix = '_t_'
+    use_export_cache = True
 
     #/* ======================================================================= */#
     #/*     Containers
@@ -337,6 +345,9 @@ def main(args):
             elif '-prefix=' in arg:
                 i += 1
                 field_prefix = arg.split('=', 1)[1]
+            elif arg == '--no-export-cache':
+                i += 1
+                use_export_cache = False
 
             # Positional arguments and errors
             else:
@@ -425,14 +436,14 @@ def main(args):
 
     print("Loading data...")
 
+    export_cache = ExportCache() if use_export_cache else None
+
     # Load task.json
-    with open(task_file, 'r') as f:
-        tasks = json.load(f)
+    tasks = load_cached_json(task_file, export_cache)
     print("  Found %s tasks" % str(len(tasks)))
 
     # Load task_run.json
-    with open(task_run_file, 'r') as f:
-        task_runs = json.load(f)
+    task_runs = load_cached_json(task_run_file, export_cache)
     print("  Found %s task runs" % str(len(task_runs)))
 
     #/* ======================================================================= */#
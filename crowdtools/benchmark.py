@@ -0,0 +1,586 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Wall time and peak memory benchmarks for crowdtools and the pipeline scripts
+
+Every benchmark runs in a freshly spawned interpreter so its peak resident
+set size isn't polluted by whatever ran before it.  Inputs are synthetic
+exports from crowdtools.synthetic, generated once per size and profile and
+re-used across runs.  Results are plain JSON so runs from different versions
+can be diffed with compare_results().
+"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import datetime
+import tempfile
+import subprocess
+import multiprocessing
+from os.path import abspath, dirname, exists, join
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from crowdtools.synthetic import write_export
+
+
+# Number of task runs in each benchmark export
+SIZES = (10000, 100000, 1000000)
+
+# Root of the repository - pipeline script paths are relative to this
+REPO_ROOT = dirname(dirname(abspath(__file__)))
+
+_DARTFROG_BIN = join('Data', 'FrackFinder', 'PA', '2005-2010', 'Transformations_and_QAQC', 'DartFrog', 'bin')
+_PA_2013 = join('Data', 'FrackFinder', 'PA', '2013', 'Transformations_and_QAQC')
+
+
+#/* ======================================================================= */#
+#/*     crowdtools function benchmarks
+#/* ======================================================================= */#
+
+# Each setup function receives the export dict built by get_export() and
+# returns the arguments for the timed function.  Only the timed function
+# counts towards wall and CPU time.
+
+def _setup_paths(export):
+    return export['task'], export['task_run']
+
+
+def _setup_task_runs(export):
+    with open(export['task_run']) as f:
+        return json.load(f),
+
+
+def _setup_tasks_and_index(export):
+    from crowdtools.common import TaskRunIndex
+    with open(export['task']) as f:
+        tasks = json.load(f)
+    with open(export['task_run']) as f:
+        index = TaskRunIndex(json.load(f))
+    return tasks, index
+
+
+def _setup_tasks(export):
+    with open(export['task']) as f:
+        return json.load(f),
+
+
+def _setup_table(export):
+    from crowdtools.table import TaskRunTable
+    return TaskRunTable.from_file(export['task_run']),
+
+
+def _setup_tasks_and_table(export):
+    from crowdtools.table import TaskRunTable
+    with open(export['task']) as f:
+        tasks = json.load(f)
+    return tasks, TaskRunTable.from_file(export['task_run'])
+
+
+def _setup_task_coordinates(export):
+    with open(export['task']) as f:
+        tasks = json.load(f)
+    return [task['info']['longitude'] for task in tasks], [task['info']['latitude'] for task in tasks]
+
+
+def _setup_shards(export):
+    x, y = _setup_task_coordinates(export)
+    return x, y, join(export['scratch'], 'shards', 'output.shp')
+
+
+def _setup_warm_cache(export):
+    from crowdtools.cache import ExportCache
+    cache = ExportCache(cache_dir=join(export['scratch'], 'cache'))
+    cache.clear()
+    cache.load_json(export['task_run'])
+    return cache, export['task_run']
+
+
+def _setup_convert(export):
+    return export['task_run'], join(export['scratch'], 'columnar')
+
+
+def _json_load(task_file, task_run_file):
+    for path in (task_file, task_run_file):
+        with open(path) as f:
+            json.load(f)
+
+
+def _iter_json_array(task_file, task_run_file):
+    from crowdtools.stream import iter_json_array
+    for path in (task_file, task_run_file):
+        for element in iter_json_array(path):
+            pass
+
+
+def _load_records(task_file, task_run_file):
+    from crowdtools.records import load_task_runs, load_tasks
+    return load_tasks(task_file), load_task_runs(task_run_file)
+
+
+def _task_run_index(task_runs):
+    from crowdtools.common import TaskRunIndex
+    return TaskRunIndex(task_runs)
+
+
+def _selection_counts(tasks, index):
+    from crowdtools.common import get_crowd_selection_counts, get_crowd_agreement_level
+    for task in tasks:
+        counts = get_crowd_selection_counts(task, index)
+        get_crowd_agreement_level(counts, index.count(task['id']))
+
+
+def _union_tasks(tasks):
+    from crowdtools.common import union_tasks
+    return union_tasks([tasks, tasks])
+
+
+def _location_index(tasks):
+    from crowdtools.location import LocationIndex
+    index = LocationIndex()
+    index.add_stage('stage', tasks)
+    return index
+
+
+def _task_run_table(task_runs):
+    from crowdtools.table import TaskRunTable
+    return TaskRunTable.from_task_runs(task_runs)
+
+
+def _compute_consensus(table):
+    from crowdtools.consensus import compute_consensus
+    return compute_consensus(table)
+
+
+def _consensus_points(tasks, table):
+    from crowdtools.points import ConsensusPoints
+    selections = (('fracking', 'n_frk_res'), ('unknown', 'n_unk_res'), ('other', 'n_oth_res'), ('ERROR', 'ERROR'))
+    for row in ConsensusPoints(selections, (), lambda task: {}).iter_rows(tasks, table):
+        pass
+
+
+def _points_to_wkb(x, y):
+    from crowdtools.vector import points_to_wkb
+    return points_to_wkb(x, y)
+
+
+def _envelope_pairs(x, y):
+    from crowdtools.intersect import envelope_pairs
+    return envelope_pairs([(lng - 0.001, lng + 0.001, lat - 0.001, lat + 0.001) for lng, lat in zip(x, y)])
+
+
+def _export_shards(x, y, outfile):
+    from crowdtools.shards import export_shards
+    from crowdtools.vector import ogr, points_to_wkb
+    wkbs = points_to_wkb(x, y)
+
+    def produce(indexes):
+        for i in indexes:
+            yield i, {'id': i}, wkbs[i]
+
+    if not exists(dirname(outfile)):
+        os.makedirs(dirname(outfile))
+    export_shards(range(len(wkbs)), produce, outfile, (('id', 10, 'int'),), ogr.wkbPoint, 4, mode='hash',
+                  overwrite=True, index_fields=('id',))
+
+
+def _cache_hit(cache, path):
+    return cache.load_json(path)
+
+
+def _convert_export(infile, outdir):
+    from crowdtools.columnar import convert_export
+    convert_export(infile, outdir, overwrite=True)
+
+
+# name, export profile, setup, timed function
+FUNCTIONS = (
+    ('json.load', 'dartfrog', _setup_paths, _json_load),
+    ('stream.iter_json_array', 'dartfrog', _setup_paths, _iter_json_array),
+    ('records.load_tasks+load_task_runs', 'dartfrog', _setup_paths, _load_records),
+    ('common.TaskRunIndex', 'dartfrog', _setup_task_runs, _task_run_index),
+    ('common.get_crowd_selection_counts', 'dartfrog', _setup_tasks_and_index, _selection_counts),
+    ('common.union_tasks', 'dartfrog', _setup_tasks, _union_tasks),
+    ('location.LocationIndex', 'dartfrog', _setup_tasks, _location_index),
+    ('table.TaskRunTable.from_task_runs', 'dartfrog', _setup_task_runs, _task_run_table),
+    ('consensus.compute_consensus', 'dartfrog', _setup_table, _compute_consensus),
+    ('points.ConsensusPoints.iter_rows', 'dartfrog', _setup_tasks_and_table, _consensus_points),
+    ('vector.points_to_wkb', 'dartfrog', _setup_task_coordinates, _points_to_wkb),
+    ('intersect.envelope_pairs', 'dartfrog', _setup_task_coordinates, _envelope_pairs),
+    ('shards.export_shards', 'dartfrog', _setup_shards, _export_shards),
+    ('cache.ExportCache.load_json', 'dartfrog', _setup_warm_cache, _cache_hit),
+    ('columnar.convert_export', 'dartfrog', _setup_convert, _convert_export),
+)
+
+
+#/* ======================================================================= */#
+#/*     Pipeline script benchmarks
+#/* ======================================================================= */#
+
+def _task_compiler_args(export, outdir):
+    args = []
+    for stage in ('pt', 'fit', 'fint', 'st', 'mt'):
+        args += ['--%s=%s' % (stage, export['task']), '--%sr=%s' % (stage, export['task_run'])]
+    return args + ['--co=' + join(outdir, 'compiled.csv'), '--so=' + join(outdir, 'scrubbed.csv'),
+                   '--cj=' + join(outdir, 'compiled.json'), '--overwrite']
+
+
+def _task2shp_args(export, outdir):
+    return ['--overwrite', export['task'], export['task_run'], join(outdir, 'output.shp')]
+
+
+def _task2shp_no_overwrite_args(export, outdir):
+    return [export['task'], export['task_run'], join(outdir, 'output.shp')]
+
+
+def _task2shp_jobs_args(export, outdir):
+    return ['--jobs=4', export['task'], export['task_run'], join(outdir, 'output.gpkg')]
+
+
+def _moorfrog_args(export, outdir):
+    return ['--overwrite', export['task'], export['task_run'], outdir]
+
+
+def _digitizer_args(export, outdir):
+    return ['--overwrite', export['task_run'], join(outdir, 'output.shp')]
+
+
+# name, export profile, script relative to the repository root, function building the arguments
+SCRIPTS = (
+    ('DartFrog/taskCompiler.py', 'dartfrog', join(_DARTFROG_BIN, 'taskCompiler.py'), _task_compiler_args),
+    ('DartFrog/task2shp.py', 'dartfrog', join(_DARTFROG_BIN, 'task2shp.py'), _task2shp_no_overwrite_args),
+    ('DartFrog/task2shp.py --jobs=4', 'dartfrog', join(_DARTFROG_BIN, 'task2shp.py'), _task2shp_jobs_args),
+    ('Tadpole-PA-2013/task2shp.py', 'tadpole', join(_PA_2013, 'Tadpole', 'bin', 'task2shp.py'), _task2shp_args),
+    ('MoorFrog-PA-2013/task2shp.py', 'moorfrog', join(_PA_2013, 'MoorFrog', 'bin', 'task2shp.py'), _moorfrog_args),
+    ('Digitizer-PA-2013/task2shp.py', 'digitizer', join(_PA_2013, 'Digitizer', 'bin', 'task2shp.py'),
+     _digitizer_args),
+)
+
+
+#/* ======================================================================= */#
+#/*     Measurement
+#/* ======================================================================= */#
+
+def _max_rss(children=False):
+
+    """
+    :param children: measure terminated child processes instead of this process
+    :type children: bool
+    :return: peak resident set size in bytes or None where the resource module isn't available
+    :rtype: int|None
+    """
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X reports bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _cpu_time(children=False):
+
+    """
+    :param children: measure terminated child processes instead of this process
+    :type children: bool
+    :return: user + system CPU seconds or None where the resource module isn't available
+    :rtype: float|None
+    """
+
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run_function(name, export, conn):
+
+    """
+    Child process entry point for a crowdtools function benchmark
+    """
+
+    try:
+        for n, profile, setup, func in FUNCTIONS:
+            if n == name:
+                break
+        else:
+            raise ValueError("Unknown benchmark: %s" % name)
+        args = setup(export)
+        baseline = _max_rss()
+        cpu = _cpu_time()
+        start = time.time()
+        func(*args)
+        wall = time.time() - start
+        if cpu is not None:
+            cpu = _cpu_time() - cpu
+        peak = _max_rss()
+        rss_delta = None if peak is None else peak - baseline
+        conn.send({'wall': wall, 'cpu': cpu, 'peak_rss': peak, 'rss_delta': rss_delta, 'error': None})
+    except Exception as e:
+        conn.send({'error': '%s: %s' % (e.__class__.__name__, e)})
+    conn.close()
+
+
+def _run_script(name, export, python, conn):
+
+    """
+    Child process entry point for a pipeline script benchmark
+    """
+
+    try:
+        for n, profile, script, build_args in SCRIPTS:
+            if n == name:
+                break
+        else:
+            raise ValueError("Unknown benchmark: %s" % name)
+        outdir = join(export['scratch'], 'script-output')
+        if exists(outdir):
+            shutil.rmtree(outdir)
+        os.makedirs(outdir)
+
+        # Scripts cache parsed exports - start every run cold so results stay comparable
+        cache_dir = join(export['scratch'], 'script-cache')
+        if exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        env = dict(os.environ, CROWDTOOLS_CACHE_DIR=cache_dir)
+
+        cmd = [python, join(REPO_ROOT, script)] + build_args(export, outdir)
+        start = time.time()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=outdir, env=env)
+        output = proc.communicate()[0]
+        wall = time.time() - start
+        result = {
+            'wall': wall,
+            'cpu': _cpu_time(children=True),
+            'peak_rss': _max_rss(children=True),
+            'rss_delta': None,
+            'error': None
+        }
+        if proc.returncode != 0:
+            tail = output.decode('utf-8', 'replace').strip().splitlines()[-3:]
+            result['error'] = 'Exit code %i: %s' % (proc.returncode, ' / '.join(tail))
+        conn.send(result)
+    except Exception as e:
+        conn.send({'error': '%s: %s' % (e.__class__.__name__, e)})
+    conn.close()
+
+
+def _spawn(target, args):
+
+    """
+    Run a benchmark in a fresh interpreter and collect its result
+    """
+
+    try:
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:
+        context = multiprocessing
+    parent, child = context.Pipe(duplex=False)
+    proc = context.Process(target=target, args=args + (child,))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {'error': 'Benchmark process died'}
+    proc.join()
+    if proc.exitcode and not result.get('error'):
+        result['error'] = 'Benchmark process exited with %s' % proc.exitcode
+
+    return result
+
+
+def get_export(workdir, profile, size, seed=0):
+
+    """
+    Get a synthetic export, generating it the first time it is requested
+
+    :param workdir: directory holding generated exports
+    :type workdir: str
+    :param profile: crowdtools.synthetic profile name
+    :type profile: str
+    :param size: number of task runs
+    :type size: int
+    :param seed: random seed for the generator
+    :type seed: int
+    :return: paths to 'task', 'task_run', and a 'scratch' directory benchmarks can write to
+    :rtype: dict
+    """
+
+    directory = join(workdir, '%s-%i-%i' % (profile, size, seed))
+    export = {
+        'task': join(directory, 'task.json'),
+        'task_run': join(directory, 'task_run.json'),
+        'scratch': join(directory, 'scratch')
+    }
+    done = join(directory, '.complete')
+    if not exists(done):
+        if not exists(directory):
+            os.makedirs(directory)
+        write_export(directory, size, profile=profile, seed=seed)
+        open(done, 'w').close()
+    if not exists(export['scratch']):
+        os.makedirs(export['scratch'])
+
+    return export
+
+
+def get_version():
+
+    """
+    :return: `git describe` output for the repository or None if it can't be determined
+    :rtype: str|None
+    """
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            out = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=REPO_ROOT, stderr=devnull)
+        return out.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=SIZES, workdir=None, only=None, functions=True, scripts=True, python=None,
+                   seed=0, callback=None):
+
+    """
+    Run the benchmark suite
+
+    :param sizes: export sizes in number of task runs
+    :type sizes: tuple
+    :param workdir: where synthetic exports are kept - defaults to a temporary directory removed afterwards
+    :type workdir: str|None
+    :param only: only run benchmarks whose name contains one of these substrings
+    :type only: list|None
+    :param functions: run the crowdtools function benchmarks
+    :type functions: bool
+    :param scripts: run the pipeline script benchmarks
+    :type scripts: bool
+    :param python: interpreter for the pipeline scripts - defaults to the current interpreter
+    :type python: str|None
+    :param seed: random seed for the synthetic exports
+    :type seed: int
+    :param callback: called with each result as it completes
+    :type callback: function|None
+    :return: JSON serializable results
+    :rtype: dict
+    """
+
+    if resource is None:
+        raise RuntimeError("Benchmarks require the resource module")
+    python = python or sys.executable
+    remove_workdir = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='crowdtools-benchmark-')
+
+    jobs = []
+    if functions:
+        jobs += [('function', name, profile) for name, profile, setup, func in FUNCTIONS]
+    if scripts:
+        jobs += [('script', name, profile) for name, profile, script, build_args in SCRIPTS]
+    if only:
+        jobs = [j for j in jobs if any(o in j[1] for o in only)]
+
+    output = {
+        'version': get_version(),
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'script_python': python,
+        'platform': platform.platform(),
+        'seed': seed,
+        'results': []
+    }
+
+    try:
+        for size in sizes:
+            for kind, name, profile in jobs:
+                export = get_export(workdir, profile, size, seed=seed)
+                if kind == 'function':
+                    result = _spawn(_run_function, (name, export))
+                else:
+                    result = _spawn(_run_script, (name, export, python))
+                result.update(name=name, kind=kind, size=size)
+                output['results'].append(result)
+                if callback is not None:
+                    callback(result)
+    finally:
+        if remove_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return output
+
+
+def compare_results(old, new, threshold=0.1):
+
+    """
+    Line up two benchmark runs
+
+    :param old: results from run_benchmarks() - typically loaded from a previous version's JSON
+    :type old: dict
+    :param new: results from run_benchmarks()
+    :type new: dict
+    :param threshold: relative change in wall time or peak memory flagged as a regression
+    :type threshold: float
+    :return: one dict per benchmark present in both runs with old/new values, ratios, and a regression flag
+    :rtype: list
+    """
+
+    previous = dict(((r['name'], r['size']), r) for r in old['results'])
+    comparison = []
+    for r in new['results']:
+        o = previous.get((r['name'], r['size']))
+        if o is None or o.get('error') or r.get('error'):
+            continue
+        row = {'name': r['name'], 'size': r['size'], 'regression': False}
+        for field in ('wall', 'peak_rss'):
+            row['old_' + field] = o[field]
+            row['new_' + field] = r[field]
+            if o[field]:
+                ratio = float(r[field]) / o[field]
+                row[field + '_ratio'] = ratio
+                if ratio > 1 + threshold:
+                    row['regression'] = True
+            else:
+                row[field + '_ratio'] = None
+        comparison.append(row)
+
+    return comparison
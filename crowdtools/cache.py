@@ -0,0 +1,358 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+On-disk cache of parsed PyBossa exports
+
+QAQC work re-runs the same utilities against the same task.json and
+task_run.json files over and over, and every run pays to parse them again.
+ExportCache pickles the parsed (or columnar) form of an export under a key
+built from the file's path, size, mtime, and content hash, so warm runs load
+a binary blob instead of parsing JSON.  The cache directory is kept under a
+size limit by evicting the least recently used entries.
+
+Every lookup hashes the file's content, so an export rewritten in place with
+the same size and mtime (cp -p, rsync -t, unpacking an archive) is never
+mistaken for the cached one.  Hashing is far cheaper than parsing JSON.
+
+Python 2 dicts do not come back from pickle with the key order json.load()
+gave them, and the utilities write that order straight back out, so parsed
+JSON is only cached on Python 3.  Columnar tables are cached on both.
+"""
+
+
+import os
+import sys
+import json
+import errno
+import hashlib
+import tempfile
+from os.path import abspath, expanduser, getsize, isdir, isfile, join
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# Used when neither a cache directory nor $CROWDTOOLS_CACHE_DIR is given
+DEFAULT_CACHE_DIR = join('~', '.cache', 'crowdtools')
+
+# Evict least recently used entries once the cache is larger than this
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Bump when the pickled representation of anything in the cache changes
+CACHE_VERSION = 1
+
+# Suffix for cache entries - anything else in the cache directory is left alone
+ENTRY_EXT = '.pkl'
+
+# Unpickled dicts only iterate in their original key order from Python 3.7 on
+PICKLE_KEEPS_DICT_ORDER = sys.version_info >= (3, 7)
+
+
+def file_fingerprint(path, block_size=1024 * 1024):
+
+    """
+    Describe the exact version of a file on disk
+
+    :param path: input file path
+    :type path: str
+    :param block_size: number of bytes to hash at a time
+    :type block_size: int
+    :return: absolute path, size in bytes, mtime, and SHA-1 of the file's content
+    :rtype: tuple
+    """
+
+    path = abspath(path)
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return path, stat.st_size, stat.st_mtime, digest.hexdigest()
+
+
+def load_cached_json(path, export_cache=None):
+
+    """
+    Parse a JSON file, through export_cache when one is given
+
+    :param path: path to a JSON file
+    :type path: str
+    :param export_cache: cache of parsed exports or None to always parse the file
+    :type export_cache: ExportCache|None
+    :rtype: list|dict
+    """
+
+    if export_cache is not None:
+        return export_cache.load_json(path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class ExportCache(object):
+
+    """
+    Size-bounded cache of parsed exports keyed by file fingerprint
+
+        cache = ExportCache()
+        task_runs = cache.load_json('task_run.json')
+        table = cache.load_table('task_run.json')
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+
+        """
+        :param cache_dir: directory to store entries in - defaults to $CROWDTOOLS_CACHE_DIR or ~/.cache/crowdtools
+        :type cache_dir: str|None
+        :param max_bytes: maximum size of the cache directory
+        :type max_bytes: int
+        """
+
+        if cache_dir is None:
+            cache_dir = os.environ.get('CROWDTOOLS_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.cache_dir = abspath(expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, fingerprint, kind):
+
+        """
+        :param fingerprint: output from file_fingerprint()
+        :type fingerprint: tuple
+        :param kind: name of the representation being cached
+        :type kind: str
+        :return: path to the cache entry
+        :rtype: str
+        """
+
+        # Pickles written by Python 3 can't be read by Python 2, so each major version gets its own entries
+        key = repr((CACHE_VERSION, sys.version_info[0], kind) + tuple(fingerprint))
+        return join(self.cache_dir, kind + '-' + hashlib.sha1(key.encode('utf-8')).hexdigest() + ENTRY_EXT)
+
+    def get(self, path, kind, builder, ordered=False):
+
+        """
+        Return the cached representation of a file, building and storing it on a miss
+
+        :param path: input file path
+        :type path: str
+        :param kind: name of the representation - different kinds of the same file are cached separately
+        :type kind: str
+        :param builder: called with the path on a cache miss and must return a picklable object
+        :type builder: function
+        :param ordered: the representation contains dicts whose key order must survive the
+                        round trip - always built from the file where pickle can't guarantee that
+        :type ordered: bool
+        :rtype: any
+        """
+
+        if ordered and not PICKLE_KEEPS_DICT_ORDER:
+            return builder(path)
+
+        entry = self._entry_path(file_fingerprint(path), kind)
+
+        if isfile(entry):
+            try:
+                with open(entry, 'rb') as f:
+                    value = pickle.load(f)
+                os.utime(entry, None)
+                self.hits += 1
+                return value
+            except Exception:
+                # Truncated or unreadable entry - rebuild it
+                self._remove(entry)
+
+        self.misses += 1
+        value = builder(path)
+        self._store(entry, value)
+        self.evict()
+
+        return value
+
+    def load_json(self, path):
+
+        """
+        Cached equivalent of crowdtools.common.load_json()
+
+        :param path: path to a JSON file
+        :type path: str
+        :rtype: list|dict
+        """
+
+        def build(p):
+            with open(p, 'r') as f:
+                return json.load(f)
+
+        return self.get(path, 'json', build, ordered=True)
+
+    def load_table(self, path, selections=(), selection_key='selection'):
+
+        """
+        Cached equivalent of crowdtools.table.TaskRunTable.from_file()
+
+        :param path: path to task_run.json
+        :type path: str
+        :param selections: passed to from_file()
+        :type selections: list|tuple
+        :param selection_key: passed to from_file()
+        :type selection_key: str
+        :rtype: crowdtools.table.TaskRunTable
+        """
+
+        from crowdtools.table import TaskRunTable
+
+        def build(p):
+            return TaskRunTable.from_file(p, selections=selections, selection_key=selection_key)
+
+        if not selections and selection_key == 'selection':
+            kind = 'table'
+        else:
+            kind = 'table-' + hashlib.sha1(repr((list(selections), selection_key)).encode('utf-8')).hexdigest()
+
+        return self.get(path, kind, build)
+
+    def _store(self, entry, value):
+
+        """
+        Atomically write an entry so concurrent readers never see a partial file
+
+        :param entry: target cache entry path
+        :type entry: str
+        :param value: object to pickle
+        :type value: any
+        :rtype: None
+        """
+
+        if not isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, entry)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+    def _remove(self, entry):
+
+        """
+        Delete a file, ignoring files that have already been removed
+
+        :param entry: path to remove
+        :type entry: str
+        :rtype: None
+        """
+
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+    def entries(self):
+
+        """
+        :return: (last access time, size, path) for every entry, least recently used first
+        :rtype: list
+        """
+
+        if not isdir(self.cache_dir):
+            return []
+
+        output = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(ENTRY_EXT):
+                entry = join(self.cache_dir, name)
+                try:
+                    stat = os.stat(entry)
+                except OSError:
+                    continue
+                output.append((stat.st_mtime, stat.st_size, entry))
+
+        return sorted(output)
+
+    def size(self):
+
+        """
+        :return: total size of all entries in bytes
+        :rtype: int
+        """
+
+        return sum(size for atime, size, entry in self.entries())
+
+    def evict(self):
+
+        """
+        Delete least recently used entries until the cache fits in max_bytes
+
+        :return: number of entries removed
+        :rtype: int
+        """
+
+        entries = self.entries()
+        total = sum(size for atime, size, entry in entries)
+        removed = 0
+        for atime, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(entry)
+            total -= size
+            removed += 1
+
+        return removed
+
+    def clear(self):
+
+        """
+        Delete every entry
+
+        :return: number of entries removed
+        :rtype: int
+        """
+
+        entries = self.entries()
+        for atime, size, entry in entries:
+            self._remove(entry)
+
+        return len(entries)
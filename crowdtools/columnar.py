@@ -0,0 +1,375 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Memory-mapped columnar format for PyBossa exports
+
+convert_export() turns a task.json or task_run.json into a directory with
+one .npy file per column, a strings.json table for interned string columns,
+and a small manifest.json.  ColumnarExport opens that directory with
+np.load(mmap_mode='r'), so any number of processes can share the same
+on-disk copy of an export and random access never parses anything.
+
+    convert_export('task_run.json', 'task_run.columnar')
+    export = ColumnarExport('task_run.columnar')
+    table = export.to_task_run_table()
+"""
+
+
+import os
+import json
+import shutil
+from array import array
+from os.path import exists, isdir, join
+
+import numpy as np
+
+from crowdtools.cache import file_fingerprint
+from crowdtools.stream import iter_json_array
+from crowdtools.table import _INT64, MISSING, TIME_UNIT, StringTable, TaskRunTable
+
+
+# Identifies directories written by convert_export()
+FORMAT_NAME = 'crowdtools-columnar'
+FORMAT_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+STRINGS_FILE = 'strings.json'
+
+# Column types and the NumPy dtype each is stored as - 'str' columns store codes into strings.json
+COLUMN_DTYPES = {'int': np.int64,
+                 'float': np.float64,
+                 'time': np.dtype(TIME_UNIT),
+                 'str': np.int32}
+
+# (column, type, candidate paths) for task.json - the first path that exists in a task is used
+TASK_SCHEMA = (('id', 'int', (('id', ), )),
+               ('app_id', 'int', (('app_id', ), )),
+               ('created', 'time', (('created', ), )),
+               ('state', 'str', (('state', ), )),
+               ('n_answers', 'int', (('n_answers', ), ('info', 'n_answers'))),
+               ('latitude', 'float', (('info', 'latitude'), )),
+               ('longitude', 'float', (('info', 'longitude'), )),
+               ('year', 'int', (('info', 'year'), )),
+               ('county', 'str', (('info', 'county'), )),
+               ('url', 'str', (('info', 'url'), )),
+               ('site_id', 'str', (('info', 'siteID'), ('info', 'SiteID'))))
+
+# task_run.json is stored with exactly the columns of TaskRunTable
+TASK_RUN_STRING_COLUMNS = {'selection': 'selections',
+                           'user_ip': 'user_ips'}
+
+
+def _lookup(obj, paths):
+
+    """
+    :param obj: task or task run
+    :type obj: dict
+    :param paths: candidate key paths
+    :type paths: tuple
+    :return: value at the first path that exists or None
+    :rtype: any
+    """
+
+    for path in paths:
+        value = obj
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            return value
+
+    return None
+
+
+def build_columns(elements, schema):
+
+    """
+    Build typed columns from an iterable of tasks in a single pass
+
+    :param elements: tasks from json.load(), load_json(), or iter_json_array()
+    :type elements: iterable
+    :param schema: (column, type, candidate paths) triplets like TASK_SCHEMA
+    :type schema: tuple
+    :return: columns and string tables for every 'str' column
+    :rtype: tuple
+    """
+
+    buffers = {}
+    tables = {}
+    for name, kind, paths in schema:
+        if kind == 'int':
+            buffers[name] = array(_INT64)
+        elif kind == 'float':
+            buffers[name] = array('d')
+        elif kind == 'str':
+            buffers[name] = array('i')
+            tables[name] = StringTable()
+        elif kind == 'time':
+            buffers[name] = []
+        else:
+            raise ValueError("Unknown column type for %s: %s" % (name, kind))
+
+    nan = float('nan')
+    for element in elements:
+        for name, kind, paths in schema:
+            value = _lookup(element, paths)
+            if kind == 'int':
+                try:
+                    buffers[name].append(int(value))
+                except (TypeError, ValueError):
+                    buffers[name].append(MISSING)
+            elif kind == 'float':
+                try:
+                    buffers[name].append(float(value))
+                except (TypeError, ValueError):
+                    buffers[name].append(nan)
+            elif kind == 'str':
+                buffers[name].append(tables[name].intern(value if value is None else u'%s' % value))
+            else:
+                buffers[name].append(value or 'NaT')
+
+    columns = {}
+    for name, kind, paths in schema:
+        if kind == 'time':
+            columns[name] = np.array(buffers[name], dtype=COLUMN_DTYPES[kind])
+        else:
+            columns[name] = np.frombuffer(buffers[name], dtype=COLUMN_DTYPES[kind]).copy()
+
+    return columns, tables
+
+
+def detect_kind(path):
+
+    """
+    Figure out whether a file is a task.json or task_run.json export
+
+    :param path: path to an export
+    :type path: str
+    :return: 'task_run' if the first element has a task_id, otherwise 'task'
+    :rtype: str
+    """
+
+    for element in iter_json_array(path):
+        return 'task_run' if 'task_id' in element else 'task'
+
+    return 'task'
+
+
+def convert_export(infile, outdir, kind=None, overwrite=False):
+
+    """
+    Convert a PyBossa export to a directory of .npy columns
+
+    :param infile: path to task.json or task_run.json
+    :type infile: str
+    :param outdir: output directory - must not exist unless overwrite is True
+    :type outdir: str
+    :param kind: 'task' or 'task_run' - detected from the file when None
+    :type kind: str|None
+    :param overwrite: replace outdir if it exists
+    :type overwrite: bool
+    :return: the manifest that was written
+    :rtype: dict
+    """
+
+    if kind is None:
+        kind = detect_kind(infile)
+
+    if kind == 'task_run':
+        table = TaskRunTable.from_file(infile)
+        columns = dict((name, getattr(table, name)) for name in TaskRunTable.COLUMNS)
+        tables = dict((column, getattr(table, attr)) for column, attr in TASK_RUN_STRING_COLUMNS.items())
+        types = {'id': 'int', 'task_id': 'int', 'user_id': 'int', 'app_id': 'int', 'user_ip': 'str',
+                 'created': 'time', 'finish_time': 'time', 'present_task': 'float', 'selection': 'str'}
+        order = TaskRunTable.COLUMNS
+    elif kind == 'task':
+        columns, tables = build_columns(iter_json_array(infile), TASK_SCHEMA)
+        types = dict((name, column_type) for name, column_type, paths in TASK_SCHEMA)
+        order = [name for name, column_type, paths in TASK_SCHEMA]
+    else:
+        raise ValueError("Unknown export kind: %s" % kind)
+
+    if exists(outdir):
+        if not overwrite:
+            raise IOError("Output directory exists: %s" % outdir)
+        shutil.rmtree(outdir)
+    os.makedirs(outdir)
+
+    manifest_columns = []
+    for name in order:
+        filename = name + '.npy'
+        np.save(join(outdir, filename), columns[name])
+        manifest_columns.append({'name': name,
+                                 'type': types[name],
+                                 'dtype': str(columns[name].dtype),
+                                 'file': filename})
+
+    with open(join(outdir, STRINGS_FILE), 'w') as f:
+        json.dump(dict((name, table.strings) for name, table in tables.items()), f)
+
+    path, size, mtime, sha1 = file_fingerprint(infile)
+    manifest = {'format': FORMAT_NAME,
+                'version': FORMAT_VERSION,
+                'kind': kind,
+                'rows': len(columns[order[0]]) if order else 0,
+                'source': {'path': path, 'size': size, 'mtime': mtime, 'sha1': sha1},
+                'columns': manifest_columns}
+    with open(join(outdir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class ColumnarExport(object):
+
+    """
+    Read a directory written by convert_export()
+
+    Columns are memory-mapped on first access, so opening an export is cheap
+    and pages are shared between every process reading the same directory.
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+
+        """
+        :param directory: directory written by convert_export()
+        :type directory: str
+        :param mmap_mode: passed to np.load() - None reads columns into memory
+        :type mmap_mode: str|None
+        """
+
+        if not isdir(directory):
+            raise IOError("Not a directory: %s" % directory)
+
+        with open(join(directory, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT_NAME or self.manifest.get('version') != FORMAT_VERSION:
+            raise ValueError("Unsupported columnar export: %s" % directory)
+
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        self.kind = self.manifest['kind']
+        self.columns = [c['name'] for c in self.manifest['columns']]
+        self._files = dict((c['name'], c['file']) for c in self.manifest['columns'])
+        self._types = dict((c['name'], c['type']) for c in self.manifest['columns'])
+        self._arrays = {}
+        self._strings = None
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def __contains__(self, name):
+        return name in self._files
+
+    def __getitem__(self, name):
+
+        """
+        :param name: column name
+        :type name: str
+        :return: memory-mapped column
+        :rtype: numpy.ndarray
+        """
+
+        try:
+            return self._arrays[name]
+        except KeyError:
+            column = self._arrays[name] = np.load(join(self.directory, self._files[name]), mmap_mode=self.mmap_mode)
+            return column
+
+    def strings(self, name):
+
+        """
+        :param name: name of a 'str' column
+        :type name: str
+        :return: string table for the column's codes
+        :rtype: crowdtools.table.StringTable
+        """
+
+        if self._strings is None:
+            with open(join(self.directory, STRINGS_FILE), 'r') as f:
+                self._strings = dict((column, StringTable(strings)) for column, strings in json.load(f).items())
+
+        return self._strings[name]
+
+    def decode(self, name, rows=slice(None)):
+
+        """
+        :param name: column name
+        :type name: str
+        :param rows: rows to read - defaults to every row
+        :type rows: slice|numpy.ndarray
+        :return: column values with 'str' columns decoded to strings
+        :rtype: numpy.ndarray
+        """
+
+        values = self[name][rows]
+        if self._types[name] == 'str':
+            return self.strings(name).decode(values)
+        return values
+
+    def row(self, i):
+
+        """
+        :param i: row index
+        :type i: int
+        :return: every column for a single row, with strings decoded
+        :rtype: dict
+        """
+
+        output = {}
+        for name in self.columns:
+            value = self[name][i]
+            if self._types[name] == 'str':
+                output[name] = None if value == MISSING else self.strings(name).strings[value]
+            else:
+                output[name] = value.item() if hasattr(value, 'item') else value
+
+        return output
+
+    def to_task_run_table(self):
+
+        """
+        Wrap the memory-mapped columns in a TaskRunTable without copying them
+
+        :rtype: crowdtools.table.TaskRunTable
+        """
+
+        if self.kind != 'task_run':
+            raise ValueError("Only task_run exports can be converted to a TaskRunTable: %s" % self.directory)
+
+        columns = dict((name, self[name]) for name in TaskRunTable.COLUMNS)
+        return TaskRunTable(columns, self.strings('selection'), self.strings('user_ip'))
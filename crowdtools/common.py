@@ -33,9 +33,14 @@
 
 import os
 import json
+import hashlib
 from os.path import isfile
 
 
+# Keys that change when the same task is exported from a different application
+TASK_VOLATILE_FIELDS = ('id', 'app_id', 'created', 'state')
+
+
 def load_json(infile):
 
     """
@@ -58,6 +63,132 @@ def load_json(infile):
     return output
 
 
+class TaskRunIndex(object):
+
+    """
+    Group the contents of task_run.json by task id in a single pass
+
+    Every function in this module that accepts a raw list of task runs also
+    accepts an instance of this class, which turns each per-task lookup from a
+    full scan of task_run.json into a dictionary lookup.  Build the index once
+    and reuse it when looping over tasks.
+
+    Selection counts are computed while the index is built.  Task runs that are
+    missing info.selection are still indexed but the task they belong to is
+    flagged so get_crowd_selection_counts() raises the same KeyError it would
+    raise when scanning the raw list.
+    """
+
+    def __init__(self, task_runs, task_run_id_field='task_id'):
+
+        """
+        :param task_runs: task_run.json converted to a JSON object via json.load() or common.load_json()
+        :type task_runs: list
+        :param task_run_id_field: the key used to get the task identifier from each task run
+        :type task_run_id_field: str
+        """
+
+        self.task_run_id_field = task_run_id_field
+        self._task_runs = {}
+        self._selection_counts = {}
+        self._missing_selection = set()
+        self._n_task_runs = 0
+
+        for tr in task_runs:
+            task_id = tr[task_run_id_field]
+            self._n_task_runs += 1
+
+            try:
+                self._task_runs[task_id].append(tr)
+            except KeyError:
+                self._task_runs[task_id] = [tr]
+                self._selection_counts[task_id] = {}
+
+            try:
+                selection = tr['info']['selection']
+            except (KeyError, TypeError):
+                self._missing_selection.add(task_id)
+                continue
+
+            counts = self._selection_counts[task_id]
+            try:
+                counts[selection] += 1
+            except KeyError:
+                counts[selection] = 1
+
+    def __len__(self):
+        return self._n_task_runs
+
+    def __iter__(self):
+        for task_runs in self._task_runs.values():
+            for tr in task_runs:
+                yield tr
+
+    def __contains__(self, task_id):
+        return task_id in self._task_runs
+
+    def task_ids(self):
+
+        """
+        :return: every task id that has at least one task run
+        :rtype: list
+        """
+
+        return list(self._task_runs.keys())
+
+    def get_task_runs(self, task_id):
+
+        """
+        :param task_id: task.json['id'] for the task of interest
+        :type task_id: int
+        :return: task runs for the task in the order they appeared in task_run.json
+        :rtype: list
+        """
+
+        return list(self._task_runs.get(task_id, ()))
+
+    def count(self, task_id):
+
+        """
+        :param task_id: task.json['id'] for the task of interest
+        :type task_id: int
+        :return: number of task runs for the task
+        :rtype: int
+        """
+
+        return len(self._task_runs.get(task_id, ()))
+
+    def selection_counts(self, task_id):
+
+        """
+        :param task_id: task.json['id'] for the task of interest
+        :type task_id: int
+        :return: number of times each selection was made for the task - a copy callers are free to modify
+        :rtype: dict
+        """
+
+        if task_id in self._missing_selection:
+            raise KeyError("Task %s has a task run without info.selection" % task_id)
+
+        return dict(self._selection_counts.get(task_id, {}))
+
+
+def _check_index_field(index, task_run_id_field):
+
+    """
+    Make sure a TaskRunIndex was keyed on the field the caller is asking about
+
+    :param index: index to check
+    :type index: TaskRunIndex
+    :param task_run_id_field: field the caller expects task runs to be grouped on
+    :type task_run_id_field: str
+    :rtype: None
+    """
+
+    if index.task_run_id_field != task_run_id_field:
+        raise ValueError("TaskRunIndex is keyed on '%s', not '%s'" % (index.task_run_id_field, task_run_id_field))
+
+
 def get_task_runs(task, task_run_json, unique=True):
 
     """
@@ -66,96 +197,239 @@ def get_task_runs(task, task_run_json, unique=True):
     :param task: input task object
     :type task: dict
     :param task_run_json: task_run.json converted to a JSON object via json.load() or common.load_json()
-    :type task_run_json: list
-    :param unique: specifies whether output list will contain unique values or not
+    :type task_run_json: list|TaskRunIndex
+    :param unique: specifies whether the output will contain duplicate task runs (compared by task run id) or not
     :type unique: bool
     :rtype: list
     """
 
     # Perform comparison
-    output = []
     task_id = task['id']
-    for task_run in task_run_json:
-        if task_id == task_run['task_id']:
-            output.append(task)
+    if isinstance(task_run_json, TaskRunIndex):
+        _check_index_field(task_run_json, 'task_id')
+        output = task_run_json.get_task_runs(task_id)
+    else:
+        output = []
+        for task_run in task_run_json:
+            if task_id == task_run['task_id']:
+                output.append(task_run)
+
     if unique:
-        return set(output)
+        seen = set()
+        unique_output = []
+        for task_run in output:
+            if task_run['id'] not in seen:
+                seen.add(task_run['id'])
+                unique_output.append(task_run)
+        return unique_output
     else:
         return output
 
 
-def get_overlapping_tasks(compare_id=False, *task_groups):
+def get_task_fingerprint(task, ignore_fields=TASK_VOLATILE_FIELDS):
 
     """
-    Compare lists of input tasks and return the tasks that appear in all sets
+    Compute a stable hash of a task that ignores volatile keys
+
+    Two tasks with the same fingerprint describe the same piece of work even if
+    they were exported from different applications.  The input task is never
+    modified or copied.
+
+    :param task: input task object
+    :type task: dict
+    :param ignore_fields: keys to leave out of the fingerprint - use dots to reach into nested objects ('info.url')
+    :type ignore_fields: tuple|list|set
+    :rtype: str
+    """
+
+    view = _strip_fields(task, ignore_fields) if ignore_fields else task
+    canonical = json.dumps(view, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _strip_fields(obj, fields):
+
+    """
+    Return a shallow view of obj without the (possibly dotted) fields
+
+    Only the containers along an ignored path are rebuilt - everything else is
+    shared with the input object.
+
+    :param obj: object to strip fields from
+    :type obj: dict
+    :param fields: keys to remove
+    :type fields: list
+    :rtype: dict
+    """
+
+    top_level = set()
+    nested = {}
+    for field in fields:
+        key, _, remainder = field.partition('.')
+        if remainder:
+            nested.setdefault(key, []).append(remainder)
+        else:
+            top_level.add(key)
+
+    view = {}
+    for key, val in obj.items():
+        if key in top_level:
+            continue
+        elif key in nested and isinstance(val, dict):
+            view[key] = _strip_fields(val, nested[key])
+        else:
+            view[key] = val
+
+    return view
+
+
+def _fingerprint_groups(task_groups, ignore_fields):
+
+    """
+    Fingerprint every task in every group exactly once
+
+    :param task_groups: lists of tasks
+    :type task_groups: list|tuple
+    :param ignore_fields: passed to get_task_fingerprint()
+    :type ignore_fields: tuple|list|set
+    :return: one list of (fingerprint, task) pairs per input group
+    :rtype: list
+    """
+
+    return [[(get_task_fingerprint(task, ignore_fields), task) for task in group] for group in task_groups]
+
+
+def intersect_tasks(task_groups, ignore_fields=TASK_VOLATILE_FIELDS):
+
+    """
+    Get the tasks that appear in every group
+
+    Output contains one task per fingerprint, taken from the first group, in the
+    order it appears in that group.
 
-    :param compare_id: toggle whether or not the id tag should be used in the comparison
-    :type compare_id: bool
     :param task_groups: lists of tasks from json.load(open('infile.json')) OR load_json()
-    :type task_groups: list
-    :rtype: bool|list
+    :type task_groups: list|tuple
+    :param ignore_fields: passed to get_task_fingerprint()
+    :type ignore_fields: tuple|list|set
+    :rtype: list
     """
 
-    # Validate input
-    if len(task_groups) <= 1:
-        return False
+    if not task_groups:
+        return []
 
-    # Get a task from a group and make sure it exists in the other groups
-    # group_index is used to speed up the loop that searches for overlapping tasks
-    # No need to search the current group since that is where we got the task
-    overlapping_tasks = []
-    group_index = 0
+    fingerprinted = _fingerprint_groups(task_groups, ignore_fields)
+    common = set(fp for fp, task in fingerprinted[0])
+    for group in fingerprinted[1:]:
+        common.intersection_update(fp for fp, task in group)
+
+    output = []
+    for fp, task in fingerprinted[0]:
+        if fp in common:
+            common.discard(fp)
+            output.append(task)
+
+    return output
 
-    # Get a group of tasks
-    for group in task_groups:
 
-        # Loop through all tasks in the group
+def union_tasks(task_groups, ignore_fields=TASK_VOLATILE_FIELDS):
+
+    """
+    Get every distinct task across all groups
+
+    Output contains the first task encountered for each fingerprint, in group
+    order and then task order.
+
+    :param task_groups: lists of tasks from json.load(open('infile.json')) OR load_json()
+    :type task_groups: list|tuple
+    :param ignore_fields: passed to get_task_fingerprint()
+    :type ignore_fields: tuple|list|set
+    :rtype: list
+    """
+
+    seen = set()
+    output = []
+    for group in task_groups:
         for task in group:
+            fp = get_task_fingerprint(task, ignore_fields)
+            if fp not in seen:
+                seen.add(fp)
+                output.append(task)
+
+    return output
+
+
+def difference_tasks(task_groups, ignore_fields=TASK_VOLATILE_FIELDS):
+
+    """
+    Get the tasks in the first group that do not appear in any of the other groups
+
+    :param task_groups: lists of tasks from json.load(open('infile.json')) OR load_json()
+    :type task_groups: list|tuple
+    :param ignore_fields: passed to get_task_fingerprint()
+    :type ignore_fields: tuple|list|set
+    :rtype: list
+    """
 
-            # Cache the task since we may be removing the id key in order to get a better comparison
-            task_cache = task
-            if not compare_id:
-                del task['id']
+    if not task_groups:
+        return []
 
-            # Check to make sure the task isn't already in the output overlapping_tasks list - speeds things up
-            if task not in overlapping_tasks:
+    exclude = set()
+    for group in task_groups[1:]:
+        exclude.update(get_task_fingerprint(task, ignore_fields) for task in group)
 
-                # Figure out how many groups we need to check the task against and iterate through their indexes
-                for check_index in range(0, len(task_groups)):
+    output = []
+    for task in task_groups[0]:
+        fp = get_task_fingerprint(task, ignore_fields)
+        if fp not in exclude:
+            exclude.add(fp)
+            output.append(task)
 
-                    # Don't check the group we're working with in the outer loop - compare the indexes for a quick check
-                    if group_index is not check_index:
+    return output
 
-                        # Check if the task exists in the current check_group - let python do all the work if compare_id
-                        if compare_id:
-                            if task in task_groups[check_index]:
-                                overlapping_tasks.append(task_cache)
-                        else:
 
-                            # We have to compare the id field, so loop through tasks individually
-                            for check_task in task_groups[check_index]:
+def get_overlapping_tasks(compare_id=False, *task_groups):
 
-                                # Remove the id key if necessary
-                                if not compare_id:
-                                    del check_task['id']
+    """
+    Compare lists of input tasks and return the tasks that appear in all sets
 
-                                # Get location and compare
-                                if task == check_task:
+    Input tasks are not modified.
 
-                                    # Hey, it exists - Append to the output container
-                                    overlapping_tasks.append(task_cache)
+    :param compare_id: toggle whether or not the id tag should be used in the comparison
+    :type compare_id: bool
+    :param task_groups: lists of tasks from json.load(open('infile.json')) OR load_json()
+    :type task_groups: list
+    :rtype: bool|list
+    """
 
-        # Iterate the group index in preparation for processing the next group
-        group_index += 1
+    # Validate input
+    if len(task_groups) <= 1:
+        return False
+
+    return intersect_tasks(task_groups, ignore_fields=() if compare_id else ('id', ))
+
+
+def get_non_overlapping_tasks(compare_id=False, *task_groups):
+
+    """
+    Compare lists of input tasks and return the tasks that are missing from at least one set
 
-    # Trash potentially giant input object to save memory
-    task_groups = None
+    Input tasks are not modified.
 
-    return overlapping_tasks
+    :param compare_id: toggle whether or not the id tag should be used in the comparison
+    :type compare_id: bool
+    :param task_groups: lists of tasks from json.load(open('infile.json')) OR load_json()
+    :type task_groups: list
+    :rtype: bool|list
+    """
 
+    # Validate input
+    if len(task_groups) <= 1:
+        return False
 
-def get_non_overlapping_tasks():
-    pass
+    ignore_fields = () if compare_id else ('id', )
+    overlapping = intersect_tasks(task_groups, ignore_fields=ignore_fields)
+    return difference_tasks([union_tasks(task_groups, ignore_fields=ignore_fields), overlapping],
+                            ignore_fields=ignore_fields)
 
 
 def is_task_complete(task, task_runs, redundancy, task_id_field='id', task_run_id_field='task_id', error=None):
@@ -167,7 +441,7 @@ def is_task_complete(task, task_runs, redundancy, task_id_field='id', task_run_i
     :param task: input task object
     :type task: dict
     :param task_runs: content from task_run.json
-    :type task_runs: list
+    :type task_runs: list|TaskRunIndex
     :param redundancy: number of times a task must be completed
     :type redundancy: int
     :param task_id_field: the key used to get the unique task identifier
@@ -183,9 +457,14 @@ def is_task_complete(task, task_runs, redundancy, task_id_field='id', task_run_i
     if redundancy <= 0:
         return error
 
+    # Indexed lookup
+    task_id = task[task_id_field]
+    if isinstance(task_runs, TaskRunIndex):
+        _check_index_field(task_runs, task_run_id_field)
+        return task_runs.count(task_id) >= redundancy
+
     # Loop and check
     count = 0
-    task_id = task[task_id_field]
     for tr in task_runs:
         tr_id = tr[task_run_id_field]
         if task_id == tr_id:
@@ -203,7 +482,7 @@ def get_crowd_selection_counts(task, task_runs, task_id_field='id', task_run_id_
     :param task: input task object
     :type task: dict
     :param task_runs: content from task_run.json
-    :type task_runs: list
+    :type task_runs: list|TaskRunIndex
     :param task_id_field: the key used to get the unique task identifier
     :type task_id_field: str
     :param task_run_id_field: the key used to get the unique task_run identifier
@@ -211,11 +490,16 @@ def get_crowd_selection_counts(task, task_runs, task_id_field='id', task_run_id_
     :rtype: dict
     """
 
+    # Indexed lookup - counts were computed when the index was built
+    task_id = task[task_id_field]
+    if isinstance(task_runs, TaskRunIndex):
+        _check_index_field(task_runs, task_run_id_field)
+        return task_runs.selection_counts(task_id)
+
     # Container to aggregate results
     counts = {}
 
     # Loop through task runs and aggregate counts
-    task_id = task[task_id_field]
     for tr in task_runs:
 
         # Get the task_run id
@@ -282,8 +566,41 @@ def get_crowd_selection(selection_counts, delimiter='|', error=None):
     return crowd_selection
 
 
-def get_crowd_agreement_level(selection_counts, ):
-    pass
+def get_crowd_agreement_level(selection_counts, total_responses=None, delimiter='|', error=None):
+
+    """
+    Figure out how well the crowd agreed on its selection
+
+    Output matches the p_crd_a and p_s_crd_a fields written by the task2shp
+    utilities: p_crd_a is the integer percent of responses that went to the
+    crowd selection and is set to the error value when responses are tied,
+    in which case p_s_crd_a holds the percent for each tied selection in the
+    same order get_crowd_selection() joins them.
+
+    :param selection_counts: output from get_crowd_selection_counts()
+    :type selection_counts: dict
+    :param total_responses: denominator for the percentages - defaults to the sum of selection_counts
+    :type total_responses: int|None
+    :param delimiter: character to place between tied agreement levels - level1|level2
+    :type delimiter: str
+    :param error: value to use if the agreement level can't be determined
+    :type error: any
+    :rtype: dict
+    """
+
+    if total_responses is None:
+        total_responses = sum(selection_counts.values())
+
+    # No responses means there is no crowd selection to agree on
+    max_selection = max(selection_counts.values()) if selection_counts else 0
+    if max_selection == 0 or total_responses == 0:
+        return {'p_crd_a': error, 'p_s_crd_a': error}
+
+    levels = [count * 100 // total_responses for count in selection_counts.values() if count == max_selection]
+    if len(levels) == 1:
+        return {'p_crd_a': levels[0], 'p_s_crd_a': None}
+    else:
+        return {'p_crd_a': error, 'p_s_crd_a': delimiter.join(str(level) for level in levels)}
 
 
 def get_unique_tasks(compare_id=False, *task_groups):
@@ -292,6 +609,8 @@ def get_unique_tasks(compare_id=False, *task_groups):
     Compare lists of tasks and get a unique set in return.
     False is returned if an error is encountered
 
+    Input tasks are not modified.
+
     :param compare_id: toggle whether or not the id field is included in the comparison
     :type compare_id: bool
     :param task_groups: input lists of tasks from json.load(open('file.json')) or load_json()
@@ -303,56 +622,4 @@ def get_unique_tasks(compare_id=False, *task_groups):
     if len(task_groups) <= 1:
         return False
 
-    # Get a task from a group and make sure it exists in the other groups
-    # group_index is used to speed up the loop that searches for overlapping tasks
-    # No need to search the current group since that is where we got the task
-    unique_tasks = []
-    group_index = 0
-
-    # Get a group of tasks
-    for group in task_groups:
-
-        # Loop through all tasks in the group
-        for task in group:
-
-            # Cache the task since we may be removing the id key in order to get a better comparison
-            task_cache = task
-            if not compare_id:
-                del task['id']
-
-            # Check to make sure the task isn't already in the output overlapping_tasks list - speeds things up
-            if task not in unique_tasks:
-
-                # Figure out how many groups we need to check the task against and iterate through their indexes
-                for check_index in range(0, len(task_groups)):
-
-                    # Don't check the group we're working with in the outer loop - compare the indexes for a quick check
-                    if group_index is not check_index:
-
-                        # Check if the task exists in the current check_group - let python do all the work if compare_id
-                        if compare_id:
-                            is_unique
-                            if task in task_groups[check_index]:
-                                unique_tasks.append(task_cache)
-                        else:
-
-                            # We have to compare the id field, so loop through tasks individually
-                            for check_task in task_groups[check_index]:
-
-                                # Remove the id key if necessary
-                                if not compare_id:
-                                    del check_task['id']
-
-                                # Get location and compare
-                                if task == check_task:
-
-                                    # Hey, it exists - Append to the output container
-                                    overlapping_tasks.append(task_cache)
-
-        # Iterate the group index in preparation for processing the next group
-        group_index += 1
-
-    # Trash potentially giant input object to save memory
-    task_groups = None
-
-    return overlapping_tasks
+    return union_tasks(task_groups, ignore_fields=() if compare_id else ('id', ))
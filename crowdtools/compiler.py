@@ -0,0 +1,1174 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+
+
+
+"""
+Config-driven compiler for projects that ran the same tasks through several
+PyBossa applications
+
+A project like DartFrog moved tasks through a public application and a series
+of internal applications.  Each task describes one location (lat + lng + year)
+and the compiled output holds every location's history across applications
+plus a final answer taken from the last application that saw it.
+
+Everything project specific lives in a CompilerConfig:
+
+    {
+        "stages": [
+            {"key": "public", "name": "public", "prefix": "p_",
+             "tasks": "public/task.json", "task_runs": "public/task_run.json"},
+            {"key": "fi_intern", "name": "first_internal", "prefix": "fi_",
+             "tasks": "first-internal/task.json", "task_runs": "first-internal/task_run.json"}
+        ],
+        "selections": [["fracking", "n_frk_res"], ["unknown", "n_unk_res"], ["other", "n_oth_res"]],
+        "task_fields": [["lat", "latitude"], ["lng", "longitude"], ["year", "year"], ["wms_url", "url"]]
+    }
+
+Stages are listed in override order and the first stage defines the master
+location list.  Selections are listed in the order ties are reported.  Stages
+only depend on their own task.json and task_run.json so compile_stages()
+analyzes them in parallel worker processes and then merges them in order.
+
+Outputs list locations in master location list order, which is the order
+they first appear in the first stage's task.json.  Each location in the
+compiled JSON lists the task fields, comp_loc, and the final answer in
+CompilerConfig.location_fields order followed by one object per stage in
+override order with its fields in CompilerConfig.stats_fields order.  The
+original DartFrog compiler wrote whatever order its repeatedly deep-copied
+Python 2 dictionaries were left in, so its raw bytes differ from these
+outputs even though the content is the same.
+"""
+
+
+import os
+import json
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from os.path import dirname, isabs, isfile, join
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from crowdtools.cache import file_fingerprint
+from crowdtools.location import DEFAULT_PRECISION, LocationKey
+from crowdtools.profiling import Profiler, phase
+from crowdtools.stream import iter_json_array
+
+
+# Bump when the contents of the cache files written by compile_stages() change
+CACHE_VERSION = 3
+
+# Location attributes pulled from task.json['info'] - (output field, info key) pairs
+DEFAULT_TASK_FIELDS = (('lat', 'latitude'), ('lng', 'longitude'), ('year', 'year'))
+
+# Computed for every stage in addition to one count per selection
+RESPONSE_FIELDS = ('n_tot_res', 'crowd_sel', 'p_crd_a', 'p_s_crd_a')
+
+
+class Stage(object):
+
+    """
+    One application's export and how it is labeled in the compiled output
+    """
+
+    def __init__(self, key, name, tasks, task_runs, prefix=None, label=None):
+
+        """
+        :param key: stage's key in the compiled output JSON, e.g. 'fi_intern'
+        :type key: str
+        :param name: value written to comp_loc, e.g. 'first_internal'
+        :type name: str
+        :param tasks: path to task.json
+        :type tasks: str
+        :param task_runs: path to task_run.json
+        :type task_runs: str
+        :param prefix: prepended to the stage's fields in the compiled output CSV - defaults to key + '_'
+        :type prefix: str|None
+        :param label: human readable name - defaults to name
+        :type label: str|None
+        """
+
+        self.key = key
+        self.name = name
+        self.tasks = tasks
+        self.task_runs = task_runs
+        self.prefix = key + '_' if prefix is None else prefix
+        self.label = name if label is None else label
+
+    def __repr__(self):
+        return "Stage(%r, %r)" % (self.key, self.name)
+
+
+class CompilerConfig(object):
+
+    """
+    Describes a project's stages and how tasks and task runs become output fields
+    """
+
+    def __init__(self, stages, selections, task_fields=DEFAULT_TASK_FIELDS, precision=DEFAULT_PRECISION,
+                 delimiter='|', error=None, scrubbed_header=None, compiled_header=None):
+
+        """
+        :param stages: stages in override order - the first defines the master location list
+        :type stages: list
+        :param selections: (task_run.json['info']['selection'], output field) pairs in the order ties are reported
+        :type selections: list|tuple
+        :param task_fields: (output field, task.json['info'] key) pairs for the location attributes
+        :type task_fields: list|tuple
+        :param precision: decimal places lat/lng are rounded to when building location keys
+        :type precision: int
+        :param delimiter: joins tied selections and their agreement levels
+        :type delimiter: str
+        :param error: agreement level used when it can't be computed
+        :type error: None|int
+        :param scrubbed_header: scrubbed output CSV columns - see default_scrubbed_header()
+        :type scrubbed_header: list|tuple|None
+        :param compiled_header: compiled output CSV columns - see default_compiled_header()
+        :type compiled_header: list|tuple|None
+        """
+
+        self.stages = list(stages)
+        self.selections = tuple((str(s), str(f)) for s, f in selections)
+        self.task_fields = tuple((str(f), str(k)) for f, k in task_fields)
+        self.precision = precision
+        self.delimiter = delimiter
+        self.error = error
+
+        if not self.stages:
+            raise ValueError("Need at least one stage")
+        for attr in ('key', 'name', 'prefix'):
+            values = [getattr(stage, attr) for stage in self.stages]
+            if len(set(values)) != len(values):
+                raise ValueError("Duplicate stage %s: %s" % (attr, values))
+        if not self.selections:
+            raise ValueError("Need at least one selection")
+        fields = [f for f, k in self.task_fields] + ['comp_loc'] + list(self.stats_fields)
+        if len(set(fields)) != len(fields):
+            raise ValueError("Duplicate output fields: %s" % fields)
+
+        self.scrubbed_header = tuple(scrubbed_header or self.default_scrubbed_header())
+        self.compiled_header = tuple(compiled_header or self.default_compiled_header())
+        for item in self.scrubbed_header + self.compiled_header:
+            self.resolve(item)
+
+    @property
+    def stage_keys(self):
+        return tuple(stage.key for stage in self.stages)
+
+    @property
+    def selection_fields(self):
+        return tuple(field for selection, field in self.selections)
+
+    @property
+    def stats_fields(self):
+
+        """
+        Fields computed for every stage
+        """
+
+        return self.selection_fields + RESPONSE_FIELDS
+
+    @property
+    def location_fields(self):
+
+        """
+        Location attributes and final answer - the most recent stage's stats
+        """
+
+        return tuple(field for field, key in self.task_fields) + ('comp_loc',) + self.stats_fields
+
+    def get_stage(self, key):
+
+        """
+        :param key: Stage.key
+        :type key: str
+        :rtype: Stage
+        """
+
+        for stage in self.stages:
+            if stage.key == key:
+                return stage
+        raise KeyError("Unknown stage: %s" % key)
+
+    def resolve(self, item):
+
+        """
+        Figure out where an output column's values come from
+
+        :param item: 'location', a location field, or a stage's stats field with its prefix, e.g. 'fi_crowd_sel'
+        :type item: str
+
+        :return: (stage key or None for location fields, field) - field is None for 'location'
+        :rtype: tuple
+        """
+
+        if item == 'location':
+            return None, None
+        elif item in self.location_fields:
+            return None, item
+        for stage in self.stages:
+            if item.startswith(stage.prefix) and item[len(stage.prefix):] in self.stats_fields:
+                return stage.key, item[len(stage.prefix):]
+        raise KeyError("Can't pull values for item: %s" % item)
+
+    def default_scrubbed_header(self):
+        return ('location',) + self.location_fields
+
+    def default_compiled_header(self):
+        return self.default_scrubbed_header() + tuple(
+            stage.prefix + field for stage in self.stages for field in self.stats_fields)
+
+    def signature(self):
+
+        """
+        Everything except file paths that affects a stage's results
+
+        :rtype: str
+        """
+
+        return json.dumps([self.selections, self.task_fields, self.precision, self.delimiter, self.error,
+                           [(s.key, s.name) for s in self.stages]], sort_keys=True)
+
+    @classmethod
+    def from_dict(cls, obj, base_dir=None):
+
+        """
+        Build a config from the structure described in the module docstring
+
+        :param obj: parsed config file
+        :type obj: dict
+        :param base_dir: relative stage paths are relative to this directory
+        :type base_dir: str|None
+
+        :rtype: CompilerConfig
+        """
+
+        def path(p):
+            return p if base_dir is None or isabs(p) else join(base_dir, p)
+
+        stages = []
+        for item in obj['stages']:
+            stages.append(Stage(item['key'], item.get('name', item['key']), path(item['tasks']),
+                                path(item['task_runs']), prefix=item.get('prefix'), label=item.get('label')))
+        kwargs = dict((k, obj[k]) for k in ('task_fields', 'precision', 'delimiter', 'error', 'scrubbed_header',
+                                            'compiled_header') if k in obj)
+
+        return cls(stages, obj['selections'], **kwargs)
+
+
+def load_config(path):
+
+    """
+    Load a CompilerConfig from a JSON file - stage paths are relative to the file
+
+    :param path: config file
+    :type path: str
+    :rtype: CompilerConfig
+    """
+
+    with open(path, 'r') as f:
+        obj = json.load(f)
+
+    return CompilerConfig.from_dict(obj, base_dir=dirname(os.path.abspath(path)))
+
+
+def get_location(task, precision=DEFAULT_PRECISION):
+
+    """
+    Get a single task's location
+
+    Lat/lng precision differs between applications, so values are rounded
+    before building the key.  Locations are joined on the key and only turned
+    into the lat + lng + '---' + year string with str() when written out.
+
+    :param task: task from json.load(open('task.json'))
+    :type task: dict
+    :param precision: decimal places lat/lng are rounded to
+    :type precision: int
+
+    :return: location primary key
+    :rtype: crowdtools.location.LocationKey
+    """
+
+    return LocationKey.from_task(task, precision)
+
+
+def load_export(path, kind, info_keys=(), task_ids=None, export_cache=None):
+
+    """
+    Stream a task.json or task_run.json and only keep the fields the compiler
+    uses, which keeps results passed back from worker processes small
+
+    :param path: path to task.json or task_run.json
+    :type path: str
+    :param kind: 'task' or 'task_run'
+    :type kind: str
+    :param info_keys: task.json['info'] keys to keep in addition to the location
+    :type info_keys: list|tuple
+    :param task_ids: only keep task runs belonging to these tasks
+    :type task_ids: set|frozenset|None
+    :param export_cache: cache the slimmed down export so later runs skip parsing the file
+    :type export_cache: crowdtools.cache.ExportCache|None
+
+    :return: slimmed down tasks or task runs in their original order
+    :rtype: list
+    """
+
+    if export_cache is not None and kind in ('task', 'task_run'):
+        name = 'compiler-%s-%s' % (kind, hashlib.sha1(repr(sorted(info_keys)).encode('utf-8')).hexdigest())
+        output = export_cache.get(path, name, lambda p: load_export(p, kind, info_keys=info_keys))
+        if task_ids is not None and kind == 'task_run':
+            output = [task_run for task_run in output if task_run['task_id'] in task_ids]
+        return output
+
+    output = []
+    if kind == 'task':
+        keep = set(info_keys) | set(('latitude', 'longitude', 'year'))
+        for task in iter_json_array(path):
+            info = dict((key, val) for key, val in task['info'].items() if key in keep)
+            output.append({'id': task['id'], 'info': info})
+    elif kind == 'task_run':
+        for task_run in iter_json_array(path):
+            if task_ids is not None and task_run['task_id'] not in task_ids:
+                continue
+            info = {}
+            if 'selection' in task_run['info']:
+                info['selection'] = task_run['info']['selection']
+            output.append({'task_id': task_run['task_id'], 'info': info})
+    else:
+        raise ValueError("Invalid export kind: %s" % kind)
+
+    return output
+
+
+def get_task_stats(task_runs, config):
+
+    """
+    Compute a single task's stats from its task runs
+
+    Output matches the historical DartFrog compiled output: selection counts
+    are None rather than 0 when nobody chose them, n_tot_res is None without
+    responses, and a task without responses gets every selection in crowd_sel
+    since they all tie.  Agreement levels are a percent of all task runs,
+    truncated to an int.
+
+    :param task_runs: the task's task runs
+    :type task_runs: list
+    :param config: project configuration
+    :type config: CompilerConfig
+
+    :return: stats fields as keys and values as values, and the number of errors
+    :rtype: tuple
+    """
+
+    fields = dict(config.selections)
+    counts = dict((field, None) for field in config.selection_fields)
+    n_errors = 0
+    for task_run in task_runs:
+        try:
+            field = fields[task_run['info']['selection']]
+        except KeyError:
+            if 'selection' in task_run['info']:
+                raise ValueError("Unknown selection: %s" % task_run['info']['selection'])
+            n_errors += 1
+            continue
+        counts[field] = 1 if counts[field] is None else counts[field] + 1
+    if all(count is None for count in counts.values()):
+        n_errors += 1
+
+    total = sum(count for count in counts.values() if count is not None) or None
+    top = max([count for count in counts.values() if count is not None] or [None])
+    tied = [(selection, field) for selection, field in config.selections if counts[field] == top]
+
+    stats = dict(counts)
+    stats['n_tot_res'] = total
+    stats['crowd_sel'] = config.delimiter.join(selection for selection, field in tied)
+    stats['p_crd_a'] = None
+    stats['p_s_crd_a'] = None
+    if not task_runs:
+        stats['p_crd_a'] = config.error
+        stats['p_s_crd_a'] = config.error
+    elif len(tied) == 1:
+        stats['p_crd_a'] = (counts[tied[0][1]] or 0) * 100 // len(task_runs)
+    else:
+        stats['p_crd_a'] = config.error
+        stats['p_s_crd_a'] = config.delimiter.join(
+            str((counts[field] or 0) * 100 // len(task_runs)) for selection, field in tied)
+
+    return stats, n_errors
+
+
+def analyze_stage(tasks, task_runs, config, stage, sample=None):
+
+    """
+    Compute task stats for a single stage
+
+    Results only depend on the stage's own tasks and task runs so stages can
+    be analyzed independently, cached, and merged later with merge_stage().
+
+    :param tasks: output from load_export()
+    :type tasks: list
+    :param task_runs: output from load_export()
+    :type task_runs: list
+    :param config: project configuration
+    :type config: CompilerConfig
+    :param stage: stage being processed
+    :type stage: Stage
+    :param sample: only analyze this many tasks
+    :type sample: int|None
+
+    :return: a (location, location attributes, task stats, number of errors) tuple for each task in task order
+    :rtype: list
+    """
+
+    if sample is not None:
+        tasks = tasks[:sample]
+
+    # Group task runs once so each task's runs are a single lookup
+    task_runs_by_id = {}
+    for task_run in task_runs:
+        task_runs_by_id.setdefault(task_run['task_id'], []).append(task_run)
+
+    results = []
+    for task in tasks:
+        attributes = dict((field, task['info'][key]) for field, key in config.task_fields)
+        attributes['comp_loc'] = stage.name
+        stats, n_errors = get_task_stats(task_runs_by_id.get(task['id'], []), config)
+        results.append((get_location(task, config.precision), attributes, stats, n_errors))
+
+    return results
+
+
+def validate_stage(tasks, task_runs, precision=DEFAULT_PRECISION):
+
+    """
+    Check a single stage's tasks against its task runs in one pass over each
+
+    :param tasks: output from load_export()
+    :type tasks: list
+    :param task_runs: output from load_export()
+    :type task_runs: list
+    :param precision: see get_location()
+    :type precision: int
+
+    :return: task and task run counts, task runs whose task isn't in task.json,
+             locations with at least one task that has task runs, and tasks
+             without any task runs
+    :rtype: dict
+    """
+
+    task_run_counts = {}
+    for task_run in task_runs:
+        task_id = task_run['task_id']
+        task_run_counts[task_id] = task_run_counts.get(task_id, 0) + 1
+
+    tasks_without_task_runs = []
+    completed_locations = set()
+    for task in tasks:
+        location = get_location(task, precision)
+        if task_run_counts.pop(task['id'], 0) > 0:
+            completed_locations.add(location)
+        else:
+            tasks_without_task_runs.append({'id': task['id'], 'location': str(location)})
+
+    # Anything left over belongs to a task that isn't in task.json
+    return {'n_tasks': len(tasks),
+            'n_task_runs': len(task_runs),
+            'n_orphaned_task_runs': sum(task_run_counts.values()),
+            'completed_locations': completed_locations,
+            'tasks_without_task_runs': tasks_without_task_runs}
+
+
+def run_stage(config, key, sample=None, locations=None, profile=None, export_cache=None):
+
+    """
+    Load, analyze, and validate one stage - runs in worker processes
+
+    :param config: project configuration
+    :type config: CompilerConfig
+    :param key: Stage.key
+    :type key: str
+    :param sample: see analyze_stage()
+    :type sample: int|None
+    :param locations: only keep tasks at these locations and their task runs
+    :type locations: set|frozenset|None
+    :param profile: measure each step with a crowdtools.profiling.Profiler built from these arguments
+    :type profile: dict|None
+    :param export_cache: see load_export()
+    :type export_cache: crowdtools.cache.ExportCache|None
+
+    :return: every task's location, analyze_stage() results, and validate_stage() results, plus
+             Profiler.to_state() output as 'profile' when profiling
+    :rtype: dict
+    """
+
+    stage = config.get_stage(key)
+    profiler = None if profile is None else Profiler(process=key, **profile)
+
+    with phase(profiler, "%s: load tasks" % key) as info:
+        tasks = load_export(stage.tasks, 'task', info_keys=[k for f, k in config.task_fields],
+                            export_cache=export_cache)
+        task_ids = None
+        if locations is not None:
+            tasks = [task for task in tasks if get_location(task, config.precision) in locations]
+            task_ids = frozenset(task['id'] for task in tasks)
+        info['records'] = len(tasks)
+    with phase(profiler, "%s: load task runs" % key) as info:
+        task_runs = load_export(stage.task_runs, 'task_run', task_ids=task_ids, export_cache=export_cache)
+        info['records'] = len(task_runs)
+    with phase(profiler, "%s: analyze" % key) as info:
+        result = {'task_locations': [get_location(task, config.precision) for task in tasks],
+                  'results': analyze_stage(tasks, task_runs, config, stage, sample=sample)}
+        info['records'] = len(result['results'])
+    with phase(profiler, "%s: validate" % key) as info:
+        result['validation'] = validate_stage(tasks, task_runs, config.precision)
+        info['records'] = len(tasks) + len(task_runs)
+
+    if profiler is not None:
+        profiler.close()
+        result['profile'] = profiler.to_state()
+
+    return result
+
+
+def _run_stage(args):
+    return args[1], run_stage(*args)
+
+
+def iter_stages(config, keys, sample=None, jobs=1, locations=None, profile=None, export_cache=None):
+
+    """
+    Run stages in a pool of worker processes and yield them in order
+
+    :param config: project configuration
+    :type config: CompilerConfig
+    :param keys: Stage.key for each stage to run
+    :type keys: list
+    :param sample: see analyze_stage()
+    :type sample: int|None
+    :param jobs: number of worker processes - 1 runs stages in this process
+    :type jobs: int
+    :param locations: see run_stage()
+    :type locations: set|frozenset|None
+    :param profile: see run_stage()
+    :type profile: dict|None
+    :param export_cache: see run_stage()
+    :type export_cache: crowdtools.cache.ExportCache|None
+
+    :return: (key, run_stage() output) pairs in the same order as keys
+    :rtype: generator
+    """
+
+    args = [(config, key, sample, locations, profile, export_cache) for key in keys]
+    if jobs <= 1 or len(args) <= 1:
+        for a in args:
+            yield _run_stage(a)
+        return
+
+    pool = multiprocessing.Pool(min(jobs, len(args)))
+    try:
+        for result in pool.imap(_run_stage, args):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class LocationStore(object):
+
+    """
+    Columnar container for every location's history
+
+    One row per location and one list per field.  The location attributes and
+    final answer live in `columns` and each stage's stats live in their own
+    column group in `stages`, so stages are merged by updating values in place
+    instead of building a nested dictionary per location.
+    """
+
+    def __init__(self, location_list, config):
+
+        """
+        :param location_list: unique locations
+        :type location_list: list
+        :param config: project configuration
+        :type config: CompilerConfig
+        """
+
+        n = len(location_list)
+        self.config = config
+        self.locations = list(location_list)
+        self.rows = dict((location, i) for i, location in enumerate(self.locations))
+        self.columns = dict((field, [None] * n) for field in config.location_fields)
+        self.stages = dict((key, dict((field, [None] * n) for field in config.stats_fields))
+                           for key in config.stage_keys)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, location):
+        return location in self.rows
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def to_state(self):
+
+        """
+        Get the store's contents as plain lists and dictionaries for caching
+
+        :rtype: dict
+        """
+
+        return {'locations': self.locations, 'columns': self.columns, 'stages': self.stages}
+
+    @classmethod
+    def from_state(cls, state, config):
+
+        """
+        Rebuild a store from to_state() output
+
+        :param state: output from to_state()
+        :type state: dict
+        :param config: project configuration
+        :type config: CompilerConfig
+
+        :rtype: LocationStore
+        """
+
+        store = cls(state['locations'], config)
+        store.columns = state['columns']
+        store.stages = state['stages']
+
+        return store
+
+    def update(self, location, values, stage=None):
+
+        """
+        Set fields for a single location
+
+        :param location: location primary key
+        :type location: LocationKey
+        :param values: field names as keys and values as values
+        :type values: dict
+        :param stage: update this stage's column group instead of the location columns
+        :type stage: str|None
+        """
+
+        row = self.rows[location]
+        columns = self.columns if stage is None else self.stages[stage]
+        for field, value in values.items():
+            columns[field][row] = value
+
+    def clear(self, location):
+
+        """
+        Reset every field for a single location
+
+        :param location: location primary key
+        :type location: LocationKey
+        """
+
+        row = self.rows[location]
+        for column in self.columns.values():
+            column[row] = None
+        for columns in self.stages.values():
+            for column in columns.values():
+                column[row] = None
+
+    def get(self, location, field, stage=None):
+
+        """
+        :param location: location primary key
+        :type location: LocationKey
+        :param field: field name
+        :type field: str
+        :param stage: get the value from this stage's column group
+        :type stage: str|None
+        """
+
+        columns = self.columns if stage is None else self.stages[stage]
+        return columns[field][self.rows[location]]
+
+    def column(self, item):
+
+        """
+        Get the list holding an output column's values for every row
+
+        :param item: see CompilerConfig.resolve()
+        :type item: str
+
+        :rtype: list
+        """
+
+        stage, field = self.config.resolve(item)
+        if field is None:
+            return [str(location) for location in self.locations]
+        elif stage is None:
+            return self.columns[field]
+        return self.stages[stage][field]
+
+    def to_dict(self, location):
+
+        """
+        Get a location in the nested form written to the compiled output JSON
+        with keys in the order described in the module docstring
+
+        :param location: location primary key
+        :type location: LocationKey
+
+        :rtype: OrderedDict
+        """
+
+        row = self.rows[location]
+        output = OrderedDict((field, self.columns[field][row]) for field in self.config.location_fields)
+        for key in self.config.stage_keys:
+            columns = self.stages[key]
+            output[key] = OrderedDict((field, columns[field][row]) for field in self.config.stats_fields)
+
+        return output
+
+
+def merge_stage(locations, results, key):
+
+    """
+    Apply one stage's analyze_stage() results to the master location list
+
+    Called once per stage in override order.  The stage's stats go into its own
+    column group and also become the location's final answer.  Tasks whose
+    location isn't in the master list are dropped.
+
+    :param locations: all locations being compiled - updated in place
+    :type locations: LocationStore
+    :param results: output from analyze_stage()
+    :type results: list
+    :param key: Stage.key
+    :type key: str
+    """
+
+    for location, attributes, stats, n_errors in results:
+        if location in locations:
+            locations.update(location, attributes)
+            locations.update(location, stats)
+            locations.update(location, stats, stage=key)
+
+
+def remerge_locations(locations, stage_results, touched):
+
+    """
+    Rebuild a subset of locations from every stage's results
+
+    When only some stages changed, only the locations those stages touch can
+    have different values, including a different final answer, so only those
+    are cleared and re-merged in override order.
+
+    :param locations: all locations being compiled - updated in place
+    :type locations: LocationStore
+    :param stage_results: (Stage.key, analyze_stage() results) pairs in override order
+    :type stage_results: list
+    :param touched: locations to rebuild
+    :type touched: set
+    """
+
+    # Within a stage the last task at a location wins, just like merge_stage()
+    by_location = []
+    for key, results in stage_results:
+        last = {}
+        for result in results:
+            if result[0] in touched:
+                last[result[0]] = result
+        by_location.append((key, last))
+
+    for location in touched:
+        if location in locations:
+            locations.clear(location)
+            for key, last in by_location:
+                if location in last:
+                    attributes, stats = last[location][1:3]
+                    locations.update(location, attributes)
+                    locations.update(location, stats)
+                    locations.update(location, stats, stage=key)
+
+
+def stage_fingerprint(config, key, sample=None, locations=None):
+
+    """
+    Identify a stage's inputs by content so cached results can be re-used
+
+    :param config: project configuration
+    :type config: CompilerConfig
+    :param key: Stage.key
+    :type key: str
+    :param sample: see analyze_stage()
+    :type sample: int|None
+    :param locations: see run_stage()
+    :type locations: set|frozenset|None
+
+    :return: size and SHA-1 of both files plus anything else that affects the results
+    :rtype: tuple
+    """
+
+    stage = config.get_stage(key)
+    tasks_fp = file_fingerprint(stage.tasks)
+    task_runs_fp = file_fingerprint(stage.task_runs)
+    signature = hashlib.sha1(config.signature().encode('utf-8')).hexdigest()
+    if locations is not None:
+        locations = '\n'.join(sorted(str(location) for location in locations))
+        locations = hashlib.sha1(locations.encode('utf-8')).hexdigest()
+
+    return CACHE_VERSION, signature, sample, locations, tasks_fp[1], tasks_fp[3], task_runs_fp[1], task_runs_fp[3]
+
+
+def read_cache(cache_dir, name):
+
+    """
+    :param cache_dir: cache directory or None
+    :type cache_dir: str|None
+    :param name: cache entry name
+    :type name: str
+
+    :return: the cached object or None if there isn't a readable one
+    :rtype: dict|None
+    """
+
+    path = None if cache_dir is None else join(cache_dir, name + '.pkl')
+    if path is None or not isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def write_cache(cache_dir, name, obj):
+
+    """
+    Atomically write a cache entry - does nothing without a cache directory
+
+    :param cache_dir: cache directory or None
+    :type cache_dir: str|None
+    :param name: cache entry name
+    :type name: str
+    :param obj: picklable object
+    :type obj: dict
+    """
+
+    if cache_dir is not None:
+        tmp_file = join(cache_dir, name + '.pkl.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, join(cache_dir, name + '.pkl'))
+
+
+def _log(log, message):
+    if log is not None:
+        log(message)
+
+
+def compile_stages(config, sample=None, jobs=1, cache_dir=None, log=None, sampler=None, profiler=None,
+                   export_cache=None):
+
+    """
+    Analyze every stage and merge them into a single LocationStore
+
+    Stages whose inputs haven't changed since the last run with the same
+    cache_dir are loaded from the cache.  The rest are analyzed in parallel and
+    merged in override order.  When the first stage is unchanged only the
+    locations touched by changed stages are re-merged.
+
+    With a sampler, tasks are drawn from the first stage and every stage only
+    keeps tasks at the sampled locations, so all stages describe the same
+    locations.
+
+    :param config: project configuration
+    :type config: CompilerConfig
+    :param sample: see analyze_stage()
+    :type sample: int|None
+    :param jobs: number of worker processes
+    :type jobs: int
+    :param cache_dir: directory for per-stage results or None to disable caching
+    :type cache_dir: str|None
+    :param log: called with progress messages
+    :type log: function|None
+    :param sampler: sample locations from the first stage's tasks
+    :type sampler: crowdtools.sampling.TaskSampler|None
+    :param profiler: records each step, including the steps run in worker processes
+    :type profiler: crowdtools.profiling.Profiler|None
+    :param export_cache: parsed exports from earlier runs - see load_export()
+    :type export_cache: crowdtools.cache.ExportCache|None
+
+    :return: 'locations' -> LocationStore, 'stage_results' -> run_stage() output
+             plus a 'fingerprint' per Stage.key, 'dropped' -> (Stage.key, location)
+             for tasks outside the master list, and 'n_errors' -> number of
+             dropped tasks plus task runs without a selection and tasks without
+             any responses at kept locations
+    :rtype: dict
+    """
+
+    keys = config.stage_keys
+
+    sampled = None
+    if sampler is not None:
+        with phase(profiler, "sample tasks") as info:
+            tasks = sampler.sample_file(config.stages[0].tasks)
+            sampled = frozenset(get_location(task, config.precision) for task in tasks)
+            info['records'] = len(tasks)
+        _log(log, "Sampled %s %s tasks at %s locations" % (len(tasks), sampler.mode, len(sampled)))
+        del tasks
+
+    # Re-use cached results for stages whose input files haven't changed
+    stage_results = {}
+    fingerprints = {}
+    stale = []
+    for stage in config.stages:
+        with phase(profiler if cache_dir else None, "%s: read cache" % stage.key):
+            fingerprints[stage.key] = stage_fingerprint(config, stage.key, sample, sampled) if cache_dir else None
+            cached = read_cache(cache_dir, stage.key)
+        if cached is not None and cached['fingerprint'] == fingerprints[stage.key]:
+            _log(log, "Using cached %s results" % stage.label.lower())
+            stage_results[stage.key] = cached
+        else:
+            stale.append(stage.key)
+
+    profile = None
+    if profiler is not None:
+        profile = {'cprofile': profiler.cprofile, 'trace_memory': profiler.memory == 'tracemalloc'}
+    if stale:
+        _log(log, "Analyzing %s stages with %s processes..." % (len(stale), max(1, min(jobs, len(stale)))))
+    for key, result in iter_stages(config, stale, sample=sample, jobs=jobs, locations=sampled, profile=profile,
+                                   export_cache=export_cache):
+        stage = config.get_stage(key)
+        _log(log, "  %s: %s tasks and %s task runs" % (
+            stage.label, result['validation']['n_tasks'], result['validation']['n_task_runs']))
+        if 'profile' in result:
+            profiler.merge(result.pop('profile'))
+        result['fingerprint'] = fingerprints[key]
+        stage_results[key] = result
+        with phase(profiler if cache_dir else None, "%s: write cache" % key):
+            write_cache(cache_dir, key, result)
+
+    # The first stage defines the master location list, in the order its tasks list them
+    location_list = []
+    location_set = set()
+    for location in stage_results[keys[0]]['task_locations']:
+        if location not in location_set:
+            location_set.add(location)
+            location_list.append(location)
+    _log(log, "Found %s locations" % len(location_list))
+
+    dropped = []
+    n_errors = 0
+    for key in keys:
+        for location in stage_results[key]['task_locations']:
+            if location not in location_set:
+                dropped.append((key, location))
+        for location, attributes, stats, task_errors in stage_results[key]['results']:
+            n_errors += task_errors if location in location_set else 1
+    if dropped:
+        for stage in config.stages:
+            _log(log, "  Missing %s: %s" % (stage.label, len([d for d in dropped if d[0] == stage.key])))
+
+    with phase(profiler if cache_dir else None, "read locations cache"):
+        merged = read_cache(cache_dir, 'locations')
+    if merged is not None and keys[0] not in stale and sorted(merged['fingerprints']) == sorted(keys) \
+            and merged['fingerprints'][keys[0]] == fingerprints[keys[0]]:
+        _log(log, "Re-merging locations touched by: %s" % ', '.join(stale or ['nothing']))
+        with phase(profiler, "re-merge") as info:
+            locations = LocationStore.from_state(merged['locations'], config)
+            touched = set()
+            for key in keys:
+                if merged['fingerprints'][key] != fingerprints[key]:
+                    touched.update(merged['stage_locations'][key])
+                    touched.update(r[0] for r in stage_results[key]['results'])
+            remerge_locations(locations, [(k, stage_results[k]['results']) for k in keys], touched)
+            info['records'] = len(touched)
+        _log(log, "  %s locations touched" % len(touched))
+    else:
+        locations = LocationStore(location_list, config)
+        for stage in config.stages:
+            _log(log, "Merging %s results..." % stage.label.lower())
+            with phase(profiler, "%s: merge" % stage.key) as info:
+                merge_stage(locations, stage_results[stage.key]['results'], stage.key)
+                info['records'] = len(stage_results[stage.key]['results'])
+
+    if cache_dir is not None:
+        with phase(profiler, "write locations cache"):
+            write_cache(cache_dir, 'locations', {
+                'fingerprints': fingerprints,
+                'stage_locations': dict((k, set(r[0] for r in stage_results[k]['results'])) for k in keys),
+                'locations': locations.to_state()
+            })
+
+    return {'locations': locations, 'stage_results': stage_results, 'dropped': dropped, 'n_errors': n_errors}
+
+
+def get_validation_report(config, compiled):
+
+    """
+    Check every stage for dropped locations, tasks without task runs, and
+    locations that were never completed
+
+    A location is complete if any of its tasks in any stage has task runs.
+
+    :param config: project configuration
+    :type config: CompilerConfig
+    :param compiled: output from compile_stages()
+    :type compiled: dict
+
+    :return: per stage and overall results - see compile_stages() for the inputs
+    :rtype: dict
+    """
+
+    location_set = set(compiled['locations'])
+    report = {'stages': {}}
+    dropped_locations = set()
+    locations_no_task_runs = set()
+    completed_locations = set()
+    all_locations = set()
+    for stage in config.stages:
+        result = compiled['stage_results'][stage.key]
+        validation = result['validation']
+        stage_locations = set(result['task_locations'])
+        stage_dropped = stage_locations - location_set
+        report['stages'][stage.name] = {
+            'n_tasks': validation['n_tasks'],
+            'n_task_runs': validation['n_task_runs'],
+            'n_orphaned_task_runs': validation['n_orphaned_task_runs'],
+            'n_completed_locations': len(validation['completed_locations']),
+            'dropped_locations': sorted(str(location) for location in stage_dropped),
+            'tasks_without_task_runs': validation['tasks_without_task_runs']
+        }
+        dropped_locations.update(stage_dropped)
+        locations_no_task_runs.update(t['location'] for t in validation['tasks_without_task_runs'])
+        completed_locations.update(validation['completed_locations'])
+        all_locations.update(stage_locations)
+    report['dropped_locations'] = sorted(str(location) for location in dropped_locations)
+    report['locations_without_task_runs'] = sorted(locations_no_task_runs)
+    report['locations_never_completed'] = sorted(str(location) for location in all_locations - completed_locations)
+
+    return report
+
+
+def write_json(locations, outfile):
+
+    """
+    Write the compiled output JSON one location at a time in master location
+    list order - the output is the same as json.dump() on an OrderedDict
+
+    :param locations: compiled locations
+    :type locations: LocationStore
+    :param outfile: target JSON file
+    :type outfile: str
+    """
+
+    with open(outfile, 'w') as f:
+        f.write('{')
+        for i, location in enumerate(locations):
+            if i > 0:
+                f.write(', ')
+            f.write(json.dumps(str(location)) + ': ' + json.dumps(locations.to_dict(location)))
+        f.write('}')
+
+
+def write_csv(locations, header, outfile):
+
+    """
+    Stream locations to a CSV with every value quoted and NULL values left empty
+
+    :param locations: compiled locations
+    :type locations: LocationStore
+    :param header: output columns - see CompilerConfig.resolve()
+    :type header: list|tuple
+    :param outfile: target CSV file
+    :type outfile: str
+    """
+
+    import csv
+
+    columns = [locations.column(item) for item in header]
+    with open(outfile, 'wb' if str is bytes else 'w') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator=os.linesep)
+        writer.writerow(header)
+        for row in range(len(locations)):
+            writer.writerow(['' if column[row] is None else str(column[row]) for column in columns])
+
+
+def write_npz(locations, header, outfile):
+
+    """
+    Write one typed array per output column to a NumPy .npz
+
+    Selection counts, n_tot_res, and p_crd_a are int64 with -1 for NULL.  Task
+    fields holding only ints are int64 too, other numeric task fields are
+    float64 with NaN for NULL, and everything else is text.
+
+    :param locations: compiled locations
+    :type locations: LocationStore
+    :param header: output columns - see CompilerConfig.resolve()
+    :type header: list|tuple
+    :param outfile: target NPZ file
+    :type outfile: str
+    """
+
+    import numpy as np
+
+    config = locations.config
+    int_fields = config.selection_fields + ('n_tot_res', 'p_crd_a')
+    task_fields = [field for field, key in config.task_fields]
+
+    arrays = {}
+    for item in header:
+        column = locations.column(item)
+        field = config.resolve(item)[1]
+        values = [v for v in column if v is not None]
+        numeric = field in task_fields and values and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)
+        if field in int_fields or numeric and all(isinstance(v, int) for v in values):
+            arrays[item] = np.array([-1 if v is None else int(v) for v in column], dtype=np.int64)
+        elif numeric:
+            arrays[item] = np.array([np.nan if v is None else float(v) for v in column], dtype=np.float64)
+        else:
+            arrays[item] = np.array([u'' if v is None else u'%s' % v for v in column], dtype='U')
+
+    with open(outfile, 'wb') as f:
+        np.savez(f, **arrays)
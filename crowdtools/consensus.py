@@ -0,0 +1,255 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Batch consensus for every task in an export at once
+
+crowdtools.common.get_crowd_selection_counts() and get_crowd_selection()
+work one task at a time.  compute_consensus() builds a (task x selection)
+count matrix with a single np.bincount() and derives every task's crowd
+selection, tie string, total responses, and percent agreement from it.
+Output follows the conventions of the per-task functions and the p_crd_a /
+p_s_crd_a fields written by the task2shp utilities.
+"""
+
+
+import numpy as np
+
+from crowdtools.table import MISSING
+
+
+class Consensus(object):
+
+    """
+    Crowd consensus for a set of tasks
+
+    Row i of every array describes task_ids[i].  Columns of counts follow
+    selections.
+
+    Attributes:
+        task_ids    -> int64 task ids
+        selections  -> selection labels, one per column of counts
+        counts      -> int64 (task x selection) number of responses
+        n_task_runs -> int64 number of task runs, including runs without a usable selection
+        n_tot_res   -> int64 number of counted responses (row sums of counts)
+        crowd_sel   -> object selection with the most responses, ties joined with the delimiter, None without responses
+        p_crd_a     -> object integer percent agreement, error value when tied or without responses
+        p_s_crd_a   -> object tied percent agreement joined with the delimiter, None unless tied
+    """
+
+    def __init__(self, task_ids, selections, counts, n_task_runs, delimiter='|', error=None):
+
+        """
+        :param task_ids: task ids, one per row of counts
+        :type task_ids: numpy.ndarray
+        :param selections: selection labels, one per column of counts
+        :type selections: list|tuple
+        :param counts: (task x selection) response counts
+        :type counts: numpy.ndarray
+        :param n_task_runs: number of task runs for each task - the denominator for percent agreement
+        :type n_task_runs: numpy.ndarray
+        :param delimiter: placed between tied selections and tied agreement levels
+        :type delimiter: str
+        :param error: value used when agreement can't be determined
+        :type error: any
+        """
+
+        self.task_ids = np.asarray(task_ids, dtype=np.int64)
+        self.selections = list(selections)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.n_task_runs = np.asarray(n_task_runs, dtype=np.int64)
+        self.n_tot_res = self.counts.sum(axis=1)
+        self.delimiter = delimiter
+        self.error = error
+        self._rows = None
+
+        n_tasks = len(self.task_ids)
+        self.crowd_sel = np.empty(n_tasks, dtype=object)
+        self.p_crd_a = np.empty(n_tasks, dtype=object)
+        self.p_s_crd_a = np.empty(n_tasks, dtype=object)
+        self.p_crd_a.fill(error)
+        if not n_tasks or not self.selections:
+            return
+
+        # Figure out which selections tied for the most responses - tasks without any responses have no selection
+        max_count = self.counts.max(axis=1)
+        is_max = (self.counts == max_count[:, None]) & (max_count[:, None] > 0)
+        n_winners = is_max.sum(axis=1)
+
+        # Percent agreement uses the same integer math as the task2shp utilities
+        denominator = np.where(self.n_task_runs > 0, self.n_task_runs, 1)
+        levels = self.counts * 100 // denominator[:, None]
+        valid = self.n_task_runs > 0
+
+        # Single winners are the common case and are handled entirely with array operations
+        single = n_winners == 1
+        labels = np.array(self.selections, dtype=object)
+        winner = self.counts.argmax(axis=1)
+        self.crowd_sel[single] = labels[winner[single]]
+        agreed = single & valid
+        self.p_crd_a[agreed] = levels[agreed, winner[agreed]].tolist()
+
+        # Ties need string joins so loop over just those rows
+        for row in np.flatnonzero(n_winners > 1):
+            columns = np.flatnonzero(is_max[row])
+            self.crowd_sel[row] = delimiter.join(labels[columns])
+            if valid[row]:
+                self.p_s_crd_a[row] = delimiter.join(str(level) for level in levels[row, columns])
+
+    def __len__(self):
+        return len(self.task_ids)
+
+    def row(self, task_id):
+
+        """
+        :param task_id: task.json['id']
+        :type task_id: int
+        :return: row index for task_id
+        :rtype: int
+        """
+
+        if self._rows is None:
+            self._rows = dict((tid, i) for i, tid in enumerate(self.task_ids.tolist()))
+        return self._rows[task_id]
+
+    def selection_counts(self, task_id, field_map=None):
+
+        """
+        Per-task counts in the same form as crowdtools.common.get_crowd_selection_counts()
+
+        :param task_id: task.json['id']
+        :type task_id: int
+        :param field_map: rename selections in the output ({'fracking': 'n_frk_res'})
+        :type field_map: dict|None
+        :rtype: dict
+        """
+
+        field_map = field_map or {}
+        counts = self.counts[self.row(task_id)].tolist()
+        return dict((field_map.get(s, s), c) for s, c in zip(self.selections, counts))
+
+    def get(self, task_id, field_map=None):
+
+        """
+        Every consensus attribute for one task
+
+        :param task_id: task.json['id']
+        :type task_id: int
+        :param field_map: rename selections in the output ({'fracking': 'n_frk_res'})
+        :type field_map: dict|None
+        :return: selection counts plus n_tot_res, crowd_sel, p_crd_a and p_s_crd_a
+        :rtype: dict
+        """
+
+        i = self.row(task_id)
+        output = self.selection_counts(task_id, field_map=field_map)
+        output['n_tot_res'] = int(self.n_tot_res[i])
+        output['crowd_sel'] = self.crowd_sel[i]
+        output['p_crd_a'] = self.p_crd_a[i]
+        output['p_s_crd_a'] = self.p_s_crd_a[i]
+        return output
+
+    def iter_dicts(self, field_map=None):
+
+        """
+        :param field_map: rename selections in the output ({'fracking': 'n_frk_res'})
+        :type field_map: dict|None
+        :return: (task_id, get(task_id)) for every task in row order
+        :rtype: generator
+        """
+
+        for task_id in self.task_ids.tolist():
+            yield task_id, self.get(task_id, field_map=field_map)
+
+
+def compute_consensus(table, task_ids=None, selections=None, missing_label=None, delimiter='|', error=None):
+
+    """
+    Compute crowd consensus for every task in a TaskRunTable
+
+    :param table: task runs
+    :type table: crowdtools.table.TaskRunTable
+    :param task_ids: tasks to report on, in output order - tasks without task runs get empty counts.
+                     Defaults to every task with at least one task run, sorted by id.
+    :type task_ids: list|numpy.ndarray|None
+    :param selections: selections to count, in column and tie order - defaults to every selection in the table.
+                       Task runs with other selections still count toward the agreement denominator.
+    :type selections: list|tuple|None
+    :param missing_label: count task runs without a selection under this label instead of ignoring them
+    :type missing_label: str|None
+    :param delimiter: placed between tied selections and tied agreement levels
+    :type delimiter: str
+    :param error: value used when agreement can't be determined
+    :type error: any
+    :rtype: Consensus
+    """
+
+    # Map table selection codes onto output columns - unlisted selections map to -1 and are not counted
+    if selections is None:
+        selections = list(table.selections.strings)
+    selections = list(selections)
+    code_to_column = np.full(len(table.selections) + 1, -1, dtype=np.int64)
+    for column, selection in enumerate(selections):
+        code = table.selections.code(selection)
+        if code != MISSING:
+            code_to_column[code] = column
+    if missing_label is not None:
+        if missing_label not in selections:
+            selections.append(missing_label)
+        code_to_column[-1] = selections.index(missing_label)
+    columns = code_to_column[np.where(table.selection == MISSING, len(table.selections), table.selection)]
+
+    # Map each task run onto an output row - task runs for unlisted tasks map to -1 and are dropped
+    if task_ids is None:
+        task_ids = np.unique(table.task_id)
+    task_ids = np.asarray(task_ids, dtype=np.int64)
+    if len(task_ids):
+        sorter = np.argsort(task_ids, kind='mergesort')
+        position = np.searchsorted(task_ids, table.task_id, sorter=sorter)
+        rows = sorter[np.clip(position, 0, len(task_ids) - 1)]
+        rows = np.where(task_ids[rows] == table.task_id, rows, -1)
+    else:
+        rows = np.full(len(table), -1, dtype=np.int64)
+
+    # One bincount builds the whole matrix
+    n_tasks = len(task_ids)
+    n_selections = len(selections)
+    in_task = rows >= 0
+    n_task_runs = np.bincount(rows[in_task], minlength=n_tasks)
+    counted = in_task & (columns >= 0)
+    flat = rows[counted] * n_selections + columns[counted]
+    counts = np.bincount(flat, minlength=n_tasks * n_selections).reshape(n_tasks, n_selections)
+
+    return Consensus(task_ids, selections, counts, n_task_runs, delimiter=delimiter, error=error)
@@ -0,0 +1,226 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+
+"""
+Find intersecting features in a layer without comparing every pair
+
+The Digitizer task2shp utilities flagged intersecting ponds by testing every
+feature against every other feature, which is quadratic in the size of the
+export and dominated everything else once a few thousand task runs had been
+digitized.  envelope_pairs() buckets feature envelopes into a uniform grid
+so only features whose bounding boxes overlap are handed to the exact OGR
+Intersect() test, and flag_intersections() applies the resulting attribute
+updates and deletions to the layer in one transaction.
+"""
+
+
+import numpy as np
+
+from crowdtools.vector import ogr, require_ogr
+
+
+# Envelopes spanning more grid cells than this are compared against every envelope instead of being bucketed
+MAX_CELLS = 256
+
+
+def _log(log, message):
+    if log is not None:
+        log(message)
+
+
+def envelope_pairs(envelopes, cell_size=None):
+
+    """
+    Find every pair of overlapping or touching bounding boxes
+
+    :param envelopes: (min_x, max_x, min_y, max_y) for every item, which is
+                      the order ogr.Geometry.GetEnvelope() returns
+    :type envelopes: list|numpy.ndarray
+    :param cell_size: grid cell size - defaults to the median envelope size
+    :type cell_size: float|None
+
+    :return: (i, j) item index pairs with i < j in ascending order
+    :rtype: list
+    """
+
+    envelopes = np.asarray(envelopes, dtype=np.float64).reshape(-1, 4)
+    min_x, max_x, min_y, max_y = envelopes.T
+    if len(envelopes) < 2:
+        return []
+
+    if cell_size is None:
+        cell_size = float(np.median(np.maximum(max_x - min_x, max_y - min_y)))
+        if not cell_size > 0:
+            cell_size = max(float(max_x.max() - min_x.min()), float(max_y.max() - min_y.min())) / len(envelopes)
+        if not cell_size > 0:
+            cell_size = 1.0
+    elif cell_size <= 0:
+        raise ValueError("Invalid cell size: %s" % cell_size)
+
+    col_start = np.floor((min_x - min_x.min()) / cell_size).astype(np.int64)
+    col_stop = np.floor((max_x - min_x.min()) / cell_size).astype(np.int64) + 1
+    row_start = np.floor((min_y - min_y.min()) / cell_size).astype(np.int64)
+    row_stop = np.floor((max_y - min_y.min()) / cell_size).astype(np.int64) + 1
+    oversized = (col_stop - col_start) * (row_stop - row_start) > MAX_CELLS
+
+    col_start, col_stop = col_start.tolist(), col_stop.tolist()
+    row_start, row_stop = row_start.tolist(), row_stop.tolist()
+
+    # Items are appended in index order, so every bucket is sorted
+    buckets = {}
+    for i in np.flatnonzero(~oversized).tolist():
+        for col in range(col_start[i], col_stop[i]):
+            for row in range(row_start[i], row_stop[i]):
+                buckets.setdefault((col, row), []).append(i)
+
+    # Plain floats are much faster than NumPy scalars in the pairwise loop
+    x0, x1, y0, y1 = min_x.tolist(), max_x.tolist(), min_y.tolist(), max_y.tolist()
+    pairs = set()
+    for items in buckets.values():
+        for a, i in enumerate(items):
+            for j in items[a + 1:]:
+                if x0[j] <= x1[i] and x0[i] <= x1[j] and y0[j] <= y1[i] and y0[i] <= y1[j]:
+                    pairs.add((i, j))
+
+    # Oversized envelopes would fill too many cells, so check them against everything at once
+    for i in np.flatnonzero(oversized).tolist():
+        overlap = (min_x <= max_x[i]) & (min_x[i] <= max_x) & (min_y <= max_y[i]) & (min_y[i] <= max_y)
+        overlap[i] = False
+        for j in np.flatnonzero(overlap).tolist():
+            pairs.add((i, j) if i < j else (j, i))
+
+    return sorted(pairs)
+
+
+def find_intersections(geometries, cell_size=None):
+
+    """
+    Find every pair of intersecting simple geometries
+
+    :param geometries: OGR geometries - None, empty, and non-simple geometries never intersect anything
+    :type geometries: list
+    :param cell_size: see envelope_pairs()
+    :type cell_size: float|None
+
+    :return: (i, j) geometry index pairs with i < j in ascending order
+    :rtype: list
+    """
+
+    candidates = [i for i, geometry in enumerate(geometries)
+                  if geometry is not None and not geometry.IsEmpty() and geometry.IsSimple()]
+    envelopes = [geometries[i].GetEnvelope() for i in candidates]
+
+    pairs = []
+    for a, b in envelope_pairs(envelopes, cell_size=cell_size):
+        i, j = candidates[a], candidates[b]
+        if geometries[i].Intersect(geometries[j]):
+            pairs.append((i, j))
+
+    return pairs
+
+
+def flag_intersections(layer, field='intersect', keep=None, class_field='class', cell_size=None, log=None):
+
+    """
+    Set field to 1 on every feature that intersects another feature
+
+    When keep is given, one feature of every intersecting pair with different
+    classes is deleted: the first one in layer order unless its class is
+    keep, otherwise the second one unless its class is keep.  Pairs are
+    visited exactly like a nested loop over the layer that skips features
+    deleted along the way, so the same features survive.
+
+    :param layer: layer to update in place
+    :type layer: ogr.Layer
+    :param field: integer field receiving the flag
+    :type field: str
+    :param keep: class_field value of the features to keep
+    :type keep: str|None
+    :param class_field: field holding each feature's class
+    :type class_field: str
+    :param cell_size: see envelope_pairs()
+    :type cell_size: float|None
+    :param log: called with warnings
+    :type log: function|None
+
+    :return: number of intersecting pairs
+    :rtype: int
+    """
+
+    require_ogr()
+
+    layer.ResetReading()
+    features = [feature for feature in layer]
+    partners = [[] for feature in features]
+    for i, j in find_intersections([feature.GetGeometryRef() for feature in features], cell_size=cell_size):
+        partners[i].append(j)
+        partners[j].append(i)
+
+    # A feature is compared against every feature that hasn't been the primary feature yet
+    intersect_count = 0
+    flagged = set()
+    deleted = set()
+    visited = set()
+    for p in range(len(features)):
+        if p in deleted:
+            continue
+        visited.add(p)
+        for i in sorted(partners[p]):
+            if i in visited:
+                continue
+            intersect_count += 1
+            flagged.update((p, i))
+            if keep is not None:
+                if features[p].GetField(class_field) is features[i].GetField(class_field):
+                    _log(log, "WARNING: Could not filter intersect: homogeneous class")
+                elif features[p].GetField(class_field) != keep:
+                    deleted.add(p)
+                elif features[i].GetField(class_field) != keep:
+                    deleted.add(i)
+
+    # Apply every update in a single transaction
+    transaction = bool(layer.TestCapability(ogr.OLCTransactions)) and bool(flagged or deleted)
+    if transaction:
+        layer.StartTransaction()
+    for i in sorted(flagged - deleted):
+        features[i].SetField(field, 1)
+        layer.SetFeature(features[i])
+    for i in sorted(deleted):
+        layer.DeleteFeature(features[i].GetFID())
+    if transaction:
+        layer.CommitTransaction()
+
+    return intersect_count
@@ -0,0 +1,251 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Location keys and a cross-stage location index
+
+Tasks describe a site in space-time and the utilities link tasks across
+applications with a lat + lng + '---' + year string.  LocationKey holds the
+same three values in a tuple instead, with lat/lng rounded the same way, so
+building a key involves no string formatting and joining on it is a single
+hash lookup.  str() of a key is the string the compiled outputs and the
+task2shp.py scripts write.
+
+Keys compare the rounded numbers rather than their text, so they match the
+same tasks the string keys do.  Years are kept as str(year) so 2014 and
+'2014' still match.
+"""
+
+
+# Lat/lng are rounded to this many decimal places when building location keys - the tasks moved to the
+# first internal application lost some precision
+DEFAULT_PRECISION = 8
+
+
+class LocationKey(tuple):
+
+    """
+    A site-year as a (latitude, longitude, year) tuple
+
+        key = LocationKey.from_task(task)
+        str(key)  # '41.78324957-76.67636006---2008'
+
+    Keys hash and compare like tuples so they can be used directly as dict
+    keys and set members.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, latitude, longitude, year, precision=DEFAULT_PRECISION):
+
+        """
+        :param latitude: degrees
+        :type latitude: float
+        :param longitude: degrees
+        :type longitude: float
+        :param year: year - compared by str()
+        :type year: int|str|None
+        :param precision: decimal places lat/lng are rounded to - None keeps them as they are
+        :type precision: int|None
+        :rtype: LocationKey
+        """
+
+        if precision is not None:
+            latitude = round(latitude, precision)
+            longitude = round(longitude, precision)
+
+        return tuple.__new__(cls, (latitude, longitude, str(year)))
+
+    def __getnewargs__(self):
+        # Values are already rounded
+        return tuple(self) + (None,)
+
+    @classmethod
+    def from_task(cls, task, precision=DEFAULT_PRECISION):
+
+        """
+        :param task: task from task.json
+        :type task: dict
+        :param precision: see LocationKey()
+        :type precision: int|None
+        :rtype: LocationKey
+        """
+
+        info = task['info']
+        return cls(info['latitude'], info['longitude'], info['year'], precision)
+
+    @property
+    def latitude(self):
+        return self[0]
+
+    @property
+    def longitude(self):
+        return self[1]
+
+    @property
+    def year(self):
+        return self[2]
+
+    def to_string(self, lat_lng_sep='', lng_year_sep='---'):
+
+        """
+        :param lat_lng_sep: placed between latitude and longitude
+        :type lat_lng_sep: str
+        :param lng_year_sep: placed between longitude and year
+        :type lng_year_sep: str
+        :rtype: str
+        """
+
+        return ''.join([str(self[0]), lat_lng_sep, str(self[1]), lng_year_sep, self[2]])
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return 'LocationKey(%r, %r, %r)' % tuple(self)
+
+
+class LocationIndex(object):
+
+    """
+    Map LocationKeys to the tasks at that location in every stage
+
+    Stages are added in order and each lookup is a single dict access:
+
+        index = LocationIndex()
+        index.add_stage('public', public_tasks)
+        index.add_stage('fi_intern', first_internal_tasks)
+        index.get(key, 'fi_intern')
+    """
+
+    def __init__(self, key_func=LocationKey.from_task):
+
+        """
+        :param key_func: computes a task's location key
+        :type key_func: function
+        """
+
+        self.key_func = key_func
+        self.stages = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def add_stage(self, stage, tasks):
+
+        """
+        :param stage: name of the stage the tasks came from
+        :type stage: str
+        :param tasks: tasks from task.json
+        :type tasks: iterable
+        :return: number of tasks added
+        :rtype: int
+        """
+
+        if stage in self.stages:
+            raise ValueError("Stage already added: %s" % stage)
+        self.stages.append(stage)
+
+        n = 0
+        index = self._index
+        key_func = self.key_func
+        for task in tasks:
+            key = key_func(task)
+            try:
+                stages = index[key]
+            except KeyError:
+                stages = index[key] = {}
+            try:
+                stages[stage].append(task)
+            except KeyError:
+                stages[stage] = [task]
+            n += 1
+
+        return n
+
+    def get(self, key, stage):
+
+        """
+        :param key: location key
+        :type key: LocationKey
+        :param stage: stage name
+        :type stage: str
+        :return: tasks at the location in the stage - empty when there are none
+        :rtype: list
+        """
+
+        return self._index.get(key, {}).get(stage, [])
+
+    def stages_for(self, key):
+
+        """
+        :param key: location key
+        :type key: LocationKey
+        :return: stages with at least one task at the location, in the order they were added
+        :rtype: list
+        """
+
+        present = self._index.get(key, {})
+        return [stage for stage in self.stages if stage in present]
+
+    def keys(self, stage=None):
+
+        """
+        :param stage: only return locations present in this stage
+        :type stage: str|None
+        :rtype: list
+        """
+
+        if stage is None:
+            return list(self._index)
+        return [key for key, stages in self._index.items() if stage in stages]
+
+    def missing_from(self, stage):
+
+        """
+        :param stage: stage name
+        :type stage: str
+        :return: locations that appear in some other stage but not this one
+        :rtype: list
+        """
+
+        return [key for key, stages in self._index.items() if stage not in stages]
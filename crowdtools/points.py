@@ -0,0 +1,313 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+
+
+
+"""
+Export crowd consensus as one point per task
+
+The Tadpole and DartFrog task2shp utilities used to scan every task run once
+per task to count responses, which is quadratic in the size of the export.
+ConsensusPoints loads task_run.json into a TaskRunTable in a single pass,
+computes counts, crowd selection, and agreement for every task at once with
+crowdtools.consensus, and writes the point features.  Each utility only
+declares its selections, output fields, and how to read attributes from a
+task.
+
+Results match the original per-task functions: task runs without one of the
+listed selections are counted under an error label that takes part in the
+crowd selection, and ties are joined in the order the selections are listed.
+"""
+
+
+from os.path import isfile
+
+import numpy as np
+
+from crowdtools.consensus import Consensus, compute_consensus
+from crowdtools.shards import DEFAULT_SHARD_KEYS, export_shards
+from crowdtools.table import TaskRunTable
+from crowdtools.vector import DEFAULT_BATCH_SIZE, LayerWriter, ogr, points_to_wkb, require_ogr
+
+
+# Label for task runs without a recognized selection
+ERROR_LABEL = 'ERROR'
+
+
+def _log(log, message):
+    if log is not None:
+        log(message)
+
+
+def compute_point_consensus(task_ids, table, selections, error_label=ERROR_LABEL, delimiter='|', error=None):
+
+    """
+    Consensus where task runs without a listed selection are counted under error_label
+
+    :param task_ids: task.json['id'] values - duplicates are collapsed
+    :type task_ids: list|numpy.ndarray
+    :param table: task runs
+    :type table: crowdtools.table.TaskRunTable
+    :param selections: selections in tie order - may include error_label to place its column
+    :type selections: list|tuple
+    :param error_label: label for task runs with a missing or unlisted selection
+    :type error_label: str
+    :param delimiter: placed between tied selections and tied agreement levels
+    :type delimiter: str
+    :param error: value used when agreement can't be determined
+    :type error: any
+
+    :rtype: crowdtools.consensus.Consensus
+    """
+
+    selections = list(selections)
+    if error_label not in selections:
+        selections.append(error_label)
+    listed = [s for s in selections if s != error_label]
+
+    # Everything that isn't a listed selection is an error, so the error column is whatever is left over
+    task_ids = np.unique(np.asarray(task_ids, dtype=np.int64))
+    consensus = compute_consensus(table, task_ids=task_ids, selections=listed)
+    counts = np.insert(consensus.counts, selections.index(error_label),
+                       consensus.n_task_runs - consensus.n_tot_res, axis=1)
+
+    return Consensus(task_ids, selections, counts, consensus.n_task_runs, delimiter=delimiter, error=error)
+
+
+class ConsensusPoints(object):
+
+    """
+    Write one point per task with the crowd's response counts, selection, and agreement
+    """
+
+    def __init__(self, selections, fields, get_attributes, selection_key='selection', error_label=ERROR_LABEL,
+                 set_field='SetField', index_fields=()):
+
+        """
+        :param selections: (selection, count field) pairs in tie order - pair error_label with its count key
+        :type selections: list|tuple
+        :param fields: (name, width, OGR type) output field definitions in layer order
+        :type fields: list|tuple
+        :param get_attributes: returns a dict of attributes for a task - must include latitude and longitude
+        :type get_attributes: function
+        :param selection_key: task_run['info'] key holding the selection
+        :type selection_key: str
+        :param error_label: label for task runs with a missing or unrecognized selection
+        :type error_label: str
+        :param set_field: name of the ogr.Feature method used to populate fields
+        :type set_field: str
+        :param index_fields: output fields to build attribute indexes for - see crowdtools.vector.create_indexes()
+        :type index_fields: list|tuple
+        """
+
+        self.selections = tuple(selections)
+        self.fields = tuple(fields)
+        self.get_attributes = get_attributes
+        self.selection_key = selection_key
+        self.error_label = error_label
+        self.set_field = set_field
+        self.index_fields = tuple(index_fields)
+        self.field_map = dict(self.selections)
+
+    def load_table(self, task_runs, export_cache=None):
+
+        """
+        :param task_runs: path to task_run.json, which is streamed, or a list of task runs
+        :type task_runs: str|list
+        :param export_cache: cache the table built from a task_run.json path
+        :type export_cache: crowdtools.cache.ExportCache|None
+        :rtype: crowdtools.table.TaskRunTable
+        """
+
+        labels = [s for s, field in self.selections]
+        if isinstance(task_runs, (str, type(u''))) and export_cache is not None:
+            return export_cache.load_table(task_runs, selections=labels, selection_key=self.selection_key)
+        if isinstance(task_runs, (str, type(u''))):
+            return TaskRunTable.from_file(task_runs, selections=labels, selection_key=self.selection_key)
+        return TaskRunTable.from_task_runs(task_runs, selections=labels, selection_key=self.selection_key)
+
+    def iter_rows(self, tasks, table):
+
+        """
+        :param tasks: task.json content
+        :type tasks: list
+        :param table: task runs from load_table()
+        :type table: crowdtools.table.TaskRunTable
+
+        :return: attribute dict for every task in task order
+        :rtype: generator
+        """
+
+        consensus = compute_point_consensus([task['id'] for task in tasks], table,
+                                            [s for s, field in self.selections], error_label=self.error_label)
+        for task in tasks:
+            attributes = self.get_attributes(task)
+            attributes.update(consensus.get(task['id'], field_map=self.field_map))
+            yield attributes
+
+    def _get_geometries(self, rows):
+
+        """
+        :param rows: attribute dicts from iter_rows()
+        :type rows: list
+
+        :return: point WKB for every row
+        :rtype: list
+        """
+
+        return points_to_wkb([float(attributes['longitude']) for attributes in rows],
+                             [float(attributes['latitude']) for attributes in rows])
+
+    def write(self, outfile, rows, driver_name=None, epsg=4326, overwrite=False, batch_size=DEFAULT_BATCH_SIZE,
+              log=None):
+
+        """
+        :param outfile: output datasource
+        :type outfile: str
+        :param rows: attribute dicts from iter_rows()
+        :type rows: iterable
+        :param driver_name: OGR driver - defaults to one matching the outfile extension
+        :type driver_name: str|None
+        :param epsg: EPSG code for the task coordinates
+        :type epsg: int
+        :param overwrite: delete outfile first if it exists
+        :type overwrite: bool
+        :param batch_size: number of features written per transaction
+        :type batch_size: int
+        :param log: called with progress messages
+        :type log: function|None
+
+        :return: number of features written
+        :rtype: int
+        """
+
+        require_ogr()
+
+        if overwrite and isfile(outfile):
+            _log(log, "Overwriting output file: %s" % outfile)
+        _log(log, "Creating output file: %s" % outfile)
+        rows = list(rows)
+        geometries = self._get_geometries(rows)
+        with LayerWriter(outfile, self.fields, ogr.wkbPoint, epsg=epsg, driver=driver_name, overwrite=overwrite,
+                         batch_size=batch_size, set_field=self.set_field, index_fields=self.index_fields) as writer:
+            _log(log, "Writing features ...")
+            for attributes, wkb in zip(rows, geometries):
+                writer.write_wkb(attributes, wkb)
+
+        return len(writer)
+
+    def write_shards(self, tasks, table, outfile, jobs, shard_keys=DEFAULT_SHARD_KEYS, shard_mode='group',
+                     driver_name=None, epsg=4326, overwrite=False, batch_size=DEFAULT_BATCH_SIZE, workdir=None,
+                     log=None):
+
+        """
+        Analyze and write tasks in parallel - the output matches write(outfile, iter_rows(tasks, table))
+
+        :param tasks: task.json content
+        :type tasks: list
+        :param table: task runs from load_table()
+        :type table: crowdtools.table.TaskRunTable
+        :param outfile: output datasource
+        :type outfile: str
+        :param jobs: number of worker processes
+        :type jobs: int
+        :param shard_keys: task.json['info'] keys grouping tasks into shards in 'group' mode
+        :type shard_keys: list|tuple
+        :param shard_mode: one of crowdtools.shards.SHARD_MODES - 'hash' shards by task id
+        :type shard_mode: str
+        :param workdir: directory for temporary shards
+        :type workdir: str|None
+
+        Remaining arguments are the same as write().
+
+        :return: number of features written
+        :rtype: int
+        """
+
+        if shard_mode == 'hash':
+            keys = [task['id'] for task in tasks]
+        else:
+            keys = [tuple((task.get('info') or {}).get(field) for field in shard_keys) for task in tasks]
+
+        def produce(indexes):
+            rows = list(self.iter_rows([tasks[i] for i in indexes], table))
+            return zip(indexes, rows, self._get_geometries(rows))
+
+        if overwrite and isfile(outfile):
+            _log(log, "Overwriting output file: %s" % outfile)
+        _log(log, "Creating output file: %s" % outfile)
+        return export_shards(keys, produce, outfile, self.fields, ogr.wkbPoint, jobs, mode=shard_mode, epsg=epsg,
+                             driver=driver_name, overwrite=overwrite, batch_size=batch_size,
+                             set_field=self.set_field, index_fields=self.index_fields, workdir=workdir, log=log)
+
+    def export(self, tasks, task_runs, outfile, log=None, jobs=1, shard_keys=DEFAULT_SHARD_KEYS, shard_mode='group',
+               workdir=None, export_cache=None, **kwargs):
+
+        """
+        Analyze every task and write the output in one call
+
+        :param tasks: task.json content
+        :type tasks: list
+        :param task_runs: path to task_run.json or a list of task runs
+        :type task_runs: str|list
+        :param outfile: output datasource
+        :type outfile: str
+        :param log: called with progress messages
+        :type log: function|None
+        :param jobs: analyze and write tasks in this many processes with write_shards()
+        :type jobs: int
+        :param shard_keys: see write_shards()
+        :type shard_keys: list|tuple
+        :param shard_mode: see write_shards()
+        :type shard_mode: str
+        :param workdir: see write_shards()
+        :type workdir: str|None
+        :param export_cache: see load_table()
+        :type export_cache: crowdtools.cache.ExportCache|None
+        :param kwargs: passed to write() or write_shards()
+
+        :return: number of features written
+        :rtype: int
+        """
+
+        _log(log, "Loading task runs ...")
+        table = self.load_table(task_runs, export_cache=export_cache)
+        _log(log, "Found %s task runs" % len(table))
+        _log(log, "Analyzing tasks ...")
+        if jobs > 1:
+            return self.write_shards(tasks, table, outfile, jobs, shard_keys=shard_keys, shard_mode=shard_mode,
+                                     workdir=workdir, log=log, **kwargs)
+        return self.write(outfile, self.iter_rows(tasks, table), log=log, **kwargs)
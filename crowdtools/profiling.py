@@ -0,0 +1,296 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+
+
+
+"""
+Per-phase timing and memory report for long running utilities
+
+    profiler = Profiler()
+    with profiler.phase('load tasks') as info:
+        tasks = load_json('task.json')
+        info['records'] = len(tasks)
+    profiler.write_report('profile.json')
+
+Every phase records wall time, CPU time, peak memory, and an optional record
+count used to compute throughput.  Peak memory comes from tracemalloc where
+it is available (Python 3.4+) and is the peak allocated during the phase.
+Otherwise it falls back to the process' peak resident set size so far.
+With cprofile=True every phase runs under cProfile and the stats for the
+slowest one are kept for dump_stats().
+
+Phases measured in worker processes are shipped back with to_state() and
+added with merge().
+"""
+
+
+import os
+import sys
+import json
+import time
+import marshal
+import platform
+import contextlib
+
+try:
+    import cProfile
+except ImportError:
+    import profile as cProfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _max_rss():
+
+    """
+    :return: peak resident set size of this process in bytes or None where the resource module isn't available
+    :rtype: int|None
+    """
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X reports bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class _NullPhase(object):
+
+    """
+    Stands in for Profiler.phase() when profiling is disabled
+    """
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def phase(profiler, name):
+
+    """
+    Profiler.phase() that also works when profiler is None
+
+    :param profiler: profiler or None
+    :type profiler: Profiler|None
+    :param name: phase name
+    :type name: str
+    """
+
+    if profiler is None:
+        return _NullPhase()
+    return profiler.phase(name)
+
+
+class Profiler(object):
+
+    """
+    Collects per-phase measurements - see the module docstring
+    """
+
+    def __init__(self, cprofile=False, trace_memory=True, process='main'):
+
+        """
+        :param cprofile: run every phase under cProfile and keep the slowest phase's stats
+        :type cprofile: bool
+        :param trace_memory: use tracemalloc when available - it slows allocation heavy code down
+        :type trace_memory: bool
+        :param process: labels phases measured by this profiler
+        :type process: str
+        """
+
+        self.cprofile = cprofile
+        self.process = process
+        self.phases = []
+        self.slowest = None
+        self.start_wall = time.time()
+        self.start_cpu = _cpu_time()
+
+        self._started_tracing = False
+        if trace_memory and tracemalloc is not None:
+            self.memory = 'tracemalloc'
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        elif resource is not None:
+            self.memory = 'max_rss'
+        else:
+            self.memory = None
+
+    def close(self):
+
+        """
+        Stop tracemalloc if this profiler started it
+        """
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+
+        """
+        Measure a block of code - yields a dictionary where 'records' can be
+        set to the number of records processed
+
+        :param name: phase name
+        :type name: str
+        """
+
+        info = {}
+        if self.memory == 'tracemalloc':
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        prof = cProfile.Profile() if self.cprofile else None
+
+        start_wall = time.time()
+        start_cpu = _cpu_time()
+        if prof is not None:
+            prof.enable()
+        try:
+            yield info
+        finally:
+            if prof is not None:
+                prof.disable()
+            wall_time = time.time() - start_wall
+            cpu_time = _cpu_time() - start_cpu
+
+            record = {'name': name,
+                      'process': self.process,
+                      'wall_time': wall_time,
+                      'cpu_time': cpu_time,
+                      'records': info.get('records'),
+                      'records_per_second': None}
+            if self.memory == 'tracemalloc':
+                current, peak = tracemalloc.get_traced_memory()
+                record['peak_memory'] = peak
+                record['memory_delta'] = current - start_memory
+            else:
+                record['peak_memory'] = _max_rss()
+            if record['records'] is not None and wall_time > 0:
+                record['records_per_second'] = record['records'] / wall_time
+            self.phases.append(record)
+
+            if prof is not None and (self.slowest is None or wall_time > self.slowest['wall_time']):
+                prof.create_stats()
+                self.slowest = {'name': name, 'process': self.process, 'wall_time': wall_time,
+                                'stats': prof.stats}
+
+    def to_state(self):
+
+        """
+        Get measurements as plain data that can be passed between processes
+
+        :rtype: dict
+        """
+
+        return {'phases': self.phases, 'slowest': self.slowest}
+
+    def merge(self, state):
+
+        """
+        Add measurements from another profiler
+
+        :param state: output from Profiler.to_state()
+        :type state: dict
+        """
+
+        self.phases += state['phases']
+        slowest = state['slowest']
+        if slowest is not None and (self.slowest is None or slowest['wall_time'] > self.slowest['wall_time']):
+            self.slowest = slowest
+
+    def report(self):
+
+        """
+        :return: every phase plus totals for this process
+        :rtype: dict
+        """
+
+        phases = sorted(self.phases, key=lambda p: p['wall_time'], reverse=True)
+        return {'python': platform.python_version(),
+                'argv': sys.argv,
+                'memory': self.memory,
+                'wall_time': time.time() - self.start_wall,
+                'cpu_time': _cpu_time() - self.start_cpu,
+                'max_rss': _max_rss(),
+                'slowest_phase': phases[0]['name'] if phases else None,
+                'phases': self.phases}
+
+    def write_report(self, path):
+
+        """
+        :param path: target JSON file
+        :type path: str
+        """
+
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def dump_stats(self, path):
+
+        """
+        Write cProfile stats for the slowest phase in the format pstats.Stats() reads
+
+        :param path: target file
+        :type path: str
+
+        :return: name of the phase that was written or None without cProfile stats
+        :rtype: str|None
+        """
+
+        if self.slowest is None:
+            return None
+        with open(path, 'wb') as f:
+            marshal.dump(self.slowest['stats'], f)
+
+        return self.slowest['name']
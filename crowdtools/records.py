@@ -0,0 +1,463 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Compact record types for tasks and task runs
+
+Most utilities only touch a handful of fields on each task or task run but
+json.load() builds a full tree of dicts for every record.  Task and TaskRun
+keep those fields in __slots__ and hold everything else as a compact JSON
+byte string that is only decoded when something outside the hot set is
+accessed.  Both types support the dict-style access used throughout the
+utilities, so code like tr['info']['selection'] keeps working.
+"""
+
+
+import json
+
+from crowdtools.stream import iter_json_array
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+def _pop_path(obj, path):
+
+    """
+    Remove a nested key, copying only the containers along the path
+
+    :param obj: object to remove the key from - never modified
+    :type obj: dict
+    :param path: keys leading to the value
+    :type path: tuple
+    :return: the object without the key, the value, and whether the key existed
+    :rtype: tuple
+    """
+
+    key = path[0]
+    if not isinstance(obj, dict) or key not in obj:
+        return obj, None, False
+
+    obj = dict(obj)
+    if len(path) == 1:
+        return obj, obj.pop(key), True
+
+    obj[key], value, found = _pop_path(obj[key], path[1:])
+    return obj, value, found
+
+
+def _set_path(obj, path, value):
+
+    """
+    Set a nested key, creating intermediate containers as needed
+
+    :param obj: object to modify in place
+    :type obj: dict
+    :param path: keys leading to the value
+    :type path: tuple
+    :param value: value to set
+    :type value: any
+    :rtype: None
+    """
+
+    for key in path[:-1]:
+        obj = obj.setdefault(key, {})
+    obj[path[-1]] = value
+
+
+# Every distinct record layout seen so far - records point at a shared instance instead of storing their own keys
+_SHAPES = {}
+
+# Shared instances of hot string values that repeat across records, like info.selection
+_STRINGS = {}
+
+
+def _flatten(obj, values):
+
+    """
+    Split a JSON object into its layout and its leaf values
+
+    Non-empty dicts are described by their keys and the layouts of their
+    values.  Everything else, including lists and empty dicts, is a leaf.
+
+    :param obj: JSON object
+    :type obj: any
+    :param values: leaf values are appended to this list in key order
+    :type values: list
+    :return: hashable layout - None for a leaf
+    :rtype: tuple|None
+    """
+
+    if isinstance(obj, dict) and obj:
+        keys = tuple(obj.keys())
+        return keys, tuple(_flatten(obj[key], values) for key in keys)
+
+    values.append(obj)
+    return None
+
+
+def _unflatten(shape, values):
+
+    """
+    Rebuild a JSON object from output produced by _flatten()
+
+    :param shape: layout from _flatten()
+    :type shape: tuple|None
+    :param values: iterator over the leaf values
+    :type values: iterator
+    :rtype: any
+    """
+
+    if shape is None:
+        return next(values)
+
+    keys, shapes = shape
+    return dict((key, _unflatten(sub_shape, values)) for key, sub_shape in zip(keys, shapes))
+
+
+class _Record(object):
+
+    """
+    Base class for Task and TaskRun
+
+    Subclasses list the top-level keys they keep as attributes in _fields and
+    the (attribute, path) pairs they pull out of the info block in
+    _info_fields.  Hot values that were missing from the source object are
+    stored as None and their names are listed in _missing so to_dict()
+    reproduces the source exactly.
+
+    Everything else is split into a layout, which is shared by every record
+    with the same keys, and a JSON-encoded byte string of leaf values.
+    """
+
+    __slots__ = ('_shape', '_raw', '_missing')
+
+    _fields = ()
+    _info_fields = ()
+    _interned = ()
+
+    def __init__(self, obj):
+
+        """
+        :param obj: task or task run from json.load() or iter_json_array()
+        :type obj: dict
+        """
+
+        self._pack(obj)
+
+    def _pack(self, obj):
+
+        """
+        Store hot fields in slots and encode everything else
+
+        :param obj: task or task run
+        :type obj: dict
+        :rtype: None
+        """
+
+        missing = []
+        rest = dict(obj)
+
+        for key in self._fields:
+            if key in rest:
+                setattr(self, key, rest.pop(key))
+            else:
+                setattr(self, key, None)
+                missing.append(key)
+
+        info = rest.get('info')
+        for attr, path in self._info_fields:
+            info, value, found = _pop_path(info, path)
+            if attr in self._interned and value is not None:
+                value = _STRINGS.setdefault(value, value)
+            setattr(self, attr, value)
+            if not found:
+                missing.append(attr)
+        if 'info' in rest:
+            rest['info'] = info
+
+        values = []
+        shape = _flatten(rest, values)
+        self._shape = _SHAPES.setdefault(shape, shape)
+        self._missing = tuple(missing)
+        self._raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+
+    def _rest(self):
+
+        """
+        :return: freshly decoded non-hot fields
+        :rtype: dict
+        """
+
+        rest = _unflatten(self._shape, iter(json.loads(self._raw.decode('utf-8'))))
+        return rest if isinstance(rest, dict) else {}
+
+    def to_dict(self):
+
+        """
+        :return: the full record as it appeared in the export
+        :rtype: dict
+        """
+
+        output = self._rest()
+        for key in self._fields:
+            if key not in self._missing:
+                output[key] = getattr(self, key)
+        for attr, path in self._info_fields:
+            if attr not in self._missing:
+                _set_path(output, ('info', ) + path, getattr(self, attr))
+
+        return output
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            if key in self._missing:
+                raise KeyError(key)
+            return getattr(self, key)
+        elif key == 'info':
+            if 'info' in self._missing_top_level():
+                raise KeyError(key)
+            return InfoView(self)
+        else:
+            return self._rest()[key]
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+            self._missing = tuple(m for m in self._missing if m != key)
+        else:
+            obj = self.to_dict()
+            obj[key] = value
+            self._pack(obj)
+
+    def __contains__(self, key):
+        if key in self._fields:
+            return key not in self._missing
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, _Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self._pack(state)
+
+    def _missing_top_level(self):
+
+        """
+        :return: top-level keys that don't exist, checking info only when no hot info field is present
+        :rtype: tuple
+        """
+
+        if any(attr not in self._missing for attr, path in self._info_fields):
+            return ()
+        return () if 'info' in self._rest() else ('info', )
+
+    def keys(self):
+
+        """
+        :rtype: list
+        """
+
+        return list(self.to_dict().keys())
+
+    def get(self, key, default=None):
+
+        """
+        :param key: top-level key
+        :type key: str
+        :param default: returned when the key doesn't exist
+        :type default: any
+        :rtype: any
+        """
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+
+        """
+        :rtype: list
+        """
+
+        return list(self.to_dict().items())
+
+    def values(self):
+
+        """
+        :rtype: list
+        """
+
+        return list(self.to_dict().values())
+
+
+class InfoView(Mapping):
+
+    """
+    Dict-like view of a record's info block
+
+    Hot fields that live directly under info are answered from the record's
+    slots.  Anything else decodes the record's raw bytes on first access.
+    Writing through the view updates the record.
+    """
+
+    __slots__ = ('_record', '_info')
+
+    def __init__(self, record):
+
+        """
+        :param record: record the view belongs to
+        :type record: Task|TaskRun
+        """
+
+        self._record = record
+        self._info = None
+
+    def _full(self):
+        if self._info is None:
+            self._info = self._record.to_dict().get('info', {})
+        return self._info
+
+    def __getitem__(self, key):
+        record = self._record
+        for attr, path in record._info_fields:
+            if path == (key, ):
+                if attr in record._missing:
+                    raise KeyError(key)
+                return getattr(record, attr)
+        return self._full()[key]
+
+    def __setitem__(self, key, value):
+        record = self._record
+        for attr, path in record._info_fields:
+            if path == (key, ):
+                setattr(record, attr, value)
+                record._missing = tuple(m for m in record._missing if m != attr)
+                self._info = None
+                return
+        obj = record.to_dict()
+        obj.setdefault('info', {})[key] = value
+        record._pack(obj)
+        self._info = None
+
+    def __iter__(self):
+        return iter(self._full())
+
+    def __len__(self):
+        return len(self._full())
+
+    def __repr__(self):
+        return 'InfoView(%r)' % self._full()
+
+
+class TaskRun(_Record):
+
+    """
+    A task run from task_run.json
+
+    id, task_id, user_id, info.selection (selection) and
+    info.timings.presentTask (present_task) are attributes.  Everything else
+    is decoded on access.
+    """
+
+    _fields = ('id', 'task_id', 'user_id')
+    _info_fields = (('selection', ('selection', )),
+                    ('present_task', ('timings', 'presentTask')))
+    _interned = ('selection', )
+    __slots__ = _fields + tuple(attr for attr, path in _info_fields)
+
+
+class Task(_Record):
+
+    """
+    A task from task.json
+
+    id, info.latitude, info.longitude and info.year are attributes.
+    Everything else is decoded on access.
+    """
+
+    _fields = ('id', )
+    _info_fields = (('latitude', ('latitude', )),
+                    ('longitude', ('longitude', )),
+                    ('year', ('year', )))
+    __slots__ = _fields + tuple(attr for attr, path in _info_fields)
+
+
+def load_task_runs(path):
+
+    """
+    Stream task_run.json into a list of TaskRun records
+
+    :param path: path to task_run.json
+    :type path: str
+    :rtype: list
+    """
+
+    return [TaskRun(tr) for tr in iter_json_array(path)]
+
+
+def load_tasks(path):
+
+    """
+    Stream task.json into a list of Task records
+
+    :param path: path to task.json
+    :type path: str
+    :rtype: list
+    """
+
+    return [Task(task) for task in iter_json_array(path)]
@@ -0,0 +1,307 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+
+
+
+"""
+Seeded, single-pass task sampling
+
+Taking the first N tasks of an export is biased toward whatever order PyBossa
+exported them in.  TaskSampler streams task.json once and keeps either a
+uniform random sample (reservoir sampling) or a sample stratified by task
+info fields like county and year, with each stratum represented in
+proportion to its size.  load_sample() then streams task_run.json and only
+keeps the runs belonging to sampled tasks, so neither file is ever fully
+loaded.
+
+Random draws only use random.Random.random(), which produces the same
+sequence for a given seed under Python 2 and 3, so a seed always selects the
+same tasks.
+"""
+
+
+import random
+import itertools
+
+from crowdtools.stream import iter_json_array
+
+
+# Supported TaskSampler modes
+SAMPLE_MODES = ('head', 'random', 'stratified')
+
+# TaskSampler strata when none are given
+DEFAULT_STRATA = ('county', 'year')
+
+
+def _randbelow(rng, n):
+    return int(rng.random() * n)
+
+
+def reservoir_sample(items, k, seed=None):
+
+    """
+    Draw a uniform random sample of k items in a single pass
+
+    :param items: anything iterable - only k items are held in memory
+    :type items: iterable
+    :param k: sample size
+    :type k: int
+    :param seed: random seed
+    :type seed: int|None
+
+    :return: sampled items in the order they were encountered
+    :rtype: list
+    """
+
+    rng = random.Random(seed)
+    reservoir = []
+    for i, item in enumerate(items):
+        if i < k:
+            reservoir.append((i, item))
+        else:
+            j = _randbelow(rng, i + 1)
+            if j < k:
+                reservoir[j] = (i, item)
+
+    return [item for i, item in sorted(reservoir, key=lambda pair: pair[0])]
+
+
+def allocate(counts, k):
+
+    """
+    Split a sample size across strata in proportion to their sizes
+
+    Uses the largest remainder method, so the allocations always add up to
+    min(k, total) and no stratum gets more than it has.
+
+    :param counts: stratum as keys and number of items as values
+    :type counts: dict
+    :param k: sample size
+    :type k: int
+
+    :return: stratum as keys and number of items to draw as values
+    :rtype: dict
+    """
+
+    total = sum(counts.values())
+    if total <= k:
+        return dict(counts)
+
+    allocation = {}
+    remainders = []
+    for stratum, count in counts.items():
+        allocation[stratum] = count * k // total
+        remainders.append((-(count * k % total), repr(stratum), stratum))
+    for r, name, stratum in sorted(remainders)[:k - sum(allocation.values())]:
+        allocation[stratum] += 1
+
+    return allocation
+
+
+def stratified_sample(items, k, key, seed=None):
+
+    """
+    Draw a sample of k items stratified by key() in a single pass
+
+    Each stratum keeps its own reservoir of up to k items while counting its
+    size, then the sample is split across strata with allocate() and drawn at
+    random from each reservoir.
+
+    :param items: anything iterable
+    :type items: iterable
+    :param k: sample size
+    :type k: int
+    :param key: computes an item's stratum
+    :type key: function
+    :param seed: random seed
+    :type seed: int|None
+
+    :return: sampled items in the order they were encountered
+    :rtype: list
+    """
+
+    rng = random.Random(seed)
+    reservoirs = {}
+    counts = {}
+    for i, item in enumerate(items):
+        stratum = key(item)
+        n = counts.get(stratum, 0)
+        counts[stratum] = n + 1
+        if n < k:
+            reservoirs.setdefault(stratum, []).append((i, item))
+        else:
+            j = _randbelow(rng, n + 1)
+            if j < k:
+                reservoirs[stratum][j] = (i, item)
+
+    # Partial Fisher-Yates shuffle of each reservoir to pick its share
+    sample = []
+    allocation = allocate(counts, k)
+    for stratum in sorted(reservoirs, key=repr):
+        reservoir = reservoirs[stratum]
+        for m in range(allocation[stratum]):
+            j = m + _randbelow(rng, len(reservoir) - m)
+            reservoir[m], reservoir[j] = reservoir[j], reservoir[m]
+        sample += reservoir[:allocation[stratum]]
+
+    return [item for i, item in sorted(sample, key=lambda pair: pair[0])]
+
+
+class TaskSampler(object):
+
+    """
+    Reproducible sample of tasks
+
+        sampler = TaskSampler(500, mode='stratified', seed=1)
+        tasks, task_runs = load_sample('task.json', 'task_run.json', sampler)
+    """
+
+    def __init__(self, size, mode='random', seed=0, strata=DEFAULT_STRATA):
+
+        """
+        :param size: number of tasks to sample
+        :type size: int
+        :param mode: 'head' for the first tasks in the export, 'random', or 'stratified'
+        :type mode: str
+        :param seed: random seed
+        :type seed: int
+        :param strata: task.json['info'] keys that define strata in 'stratified' mode
+        :type strata: list|tuple
+        """
+
+        if mode not in SAMPLE_MODES:
+            raise ValueError("Invalid sample mode: %s" % mode)
+        if size < 0:
+            raise ValueError("Sample size must be positive: %s" % size)
+
+        self.size = size
+        self.mode = mode
+        self.seed = seed
+        self.strata = tuple(strata)
+
+    def __repr__(self):
+        return "TaskSampler(%r, mode=%r, seed=%r, strata=%r)" % (self.size, self.mode, self.seed, self.strata)
+
+    def key(self):
+
+        """
+        Everything that determines which tasks are drawn from a given export
+
+        :rtype: tuple
+        """
+
+        return self.size, self.mode, self.seed, self.strata if self.mode == 'stratified' else None
+
+    def get_stratum(self, task):
+
+        """
+        :param task: task from task.json
+        :type task: dict
+        :rtype: tuple
+        """
+
+        info = task.get('info') or {}
+        return tuple(info.get(field) for field in self.strata)
+
+    def sample(self, tasks):
+
+        """
+        :param tasks: tasks from task.json - consumed in a single pass
+        :type tasks: iterable
+
+        :return: sampled tasks in export order
+        :rtype: list
+        """
+
+        if self.mode == 'head':
+            return list(itertools.islice(tasks, self.size))
+        elif self.mode == 'random':
+            return reservoir_sample(tasks, self.size, seed=self.seed)
+        return stratified_sample(tasks, self.size, self.get_stratum, seed=self.seed)
+
+    def sample_file(self, path):
+
+        """
+        :param path: path to task.json
+        :type path: str
+
+        :return: sampled tasks in export order
+        :rtype: list
+        """
+
+        return self.sample(iter_json_array(path))
+
+
+def iter_task_runs_for(path, task_ids, task_run_id_field='task_id'):
+
+    """
+    Stream task runs belonging to a set of tasks
+
+    :param path: path to task_run.json
+    :type path: str
+    :param task_ids: task.json['id'] values to keep
+    :type task_ids: set|frozenset
+    :param task_run_id_field: task run field referencing the task
+    :type task_run_id_field: str
+
+    :rtype: generator
+    """
+
+    for task_run in iter_json_array(path):
+        if task_run[task_run_id_field] in task_ids:
+            yield task_run
+
+
+def load_sample(tasks_file, task_runs_file, sampler):
+
+    """
+    Sample tasks and pull only their task runs, streaming each file once
+
+    :param tasks_file: path to task.json
+    :type tasks_file: str
+    :param task_runs_file: path to task_run.json
+    :type task_runs_file: str
+    :param sampler: which tasks to keep
+    :type sampler: TaskSampler
+
+    :return: sampled tasks and their task runs, both in export order
+    :rtype: tuple
+    """
+
+    tasks = sampler.sample_file(tasks_file)
+    task_runs = list(iter_task_runs_for(task_runs_file, frozenset(task['id'] for task in tasks)))
+
+    return tasks, task_runs
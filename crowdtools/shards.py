@@ -0,0 +1,357 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+
+
+"""
+Parallel sharded export to a single vector layer
+
+export_shards() splits the items behind an export into shards, either by
+grouping items that share a key like (county, year) or by hashing, and has
+one worker process per shard compute its features and write them to a
+temporary GeoPackage along with the index of the item each feature came from.
+
+The shards are merged without passing features back through Python: they are
+attached to the output database one at a time and copied into it with an
+INSERT ... SELECT ordered by item index, so the output is identical to a
+single process export.  Only GeoPackage and SQLite outputs can be written
+with SQL, so other formats are merged into a temporary GeoPackage first.
+Shapefiles are then appended to with gdal.VectorTranslate() and formats that
+can't be appended to get the merged features copied one at a time.
+
+Workers are forked so they inherit the parent's tasks and task runs without
+pickling them, which also lets producers be closures or lambdas.  jobs > 1
+therefore requires a platform with fork().
+"""
+
+
+import heapq
+import shutil
+import tempfile
+import multiprocessing
+import zlib
+from os.path import join
+
+from crowdtools.vector import (DEFAULT_BATCH_SIZE, LayerWriter, _execute_sql, create_indexes, gdal, get_driver_name,
+                               ogr, open_output, require_ogr)
+
+
+# How items are assigned to shards
+SHARD_MODES = ('group', 'hash')
+
+# Task info fields used to group tasks into shards when none are given
+DEFAULT_SHARD_KEYS = ('county', 'year')
+
+# Drivers whose outputs are SQLite databases the shards can be copied into with SQL.  Shards are
+# written with the output's driver so geometry blobs can be copied as is.
+SQL_DRIVERS = ('GPKG', 'SQLite')
+
+# Drivers that keep an empty layer's fields on disk, so gdal.VectorTranslate() can append the merged
+# shards to a layer created with the exact field definitions.  GeoJSON, for example, doesn't.
+APPEND_DRIVERS = ('ESRI Shapefile',)
+
+# Extra shard field holding the index of the item that produced each feature
+ITEM_FIELD = 'shard_item'
+
+try:
+    _context = multiprocessing.get_context('fork')
+except (AttributeError, ValueError):
+    _context = multiprocessing
+
+
+def _log(log, message):
+    if log is not None:
+        log(message)
+
+
+def partition(keys, n_shards, mode='group'):
+
+    """
+    Split items into shards
+
+    In 'group' mode items with the same key always land in the same shard and
+    groups are handed out largest first to the smallest shard.  In 'hash' mode
+    each item is placed by a CRC32 of repr(key), which is stable across
+    processes and Python versions unlike hash().
+
+    :param keys: one hashable key per item
+    :type keys: list|tuple
+    :param n_shards: number of shards
+    :type n_shards: int
+    :param mode: one of SHARD_MODES
+    :type mode: str
+
+    :return: n_shards lists of item indexes in ascending order - some may be empty
+    :rtype: list
+    """
+
+    if n_shards < 1:
+        raise ValueError("Invalid number of shards: %s" % n_shards)
+    if mode not in SHARD_MODES:
+        raise ValueError("Invalid shard mode: %s" % mode)
+
+    shards = [[] for i in range(n_shards)]
+
+    if mode == 'hash':
+        for i, key in enumerate(keys):
+            shards[(zlib.crc32(repr(key).encode('utf-8')) & 0xffffffff) % n_shards].append(i)
+        return shards
+
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+
+    # Ties are broken on the group's first item so the assignment is deterministic
+    sizes = [(0, s) for s in range(n_shards)]
+    for group in sorted(groups.values(), key=lambda g: (-len(g), g[0])):
+        size, s = heapq.heappop(sizes)
+        shards[s] += group
+        heapq.heappush(sizes, (size + len(group), s))
+
+    return [sorted(shard) for shard in shards]
+
+
+def _write_shard(produce, indexes, path, fields, geometry_type, epsg, driver, set_field, conn):
+
+    """
+    Worker process entry point - sends back the number of features written or an error message
+    """
+
+    try:
+        with LayerWriter(path, tuple(fields) + ((ITEM_FIELD, 10, 'int'),), geometry_type, epsg=epsg, driver=driver,
+                         layer_name='shard', set_field=set_field, spatial_index=False) as writer:
+            for index, attributes, geometry in produce(indexes):
+                attributes = dict(attributes)
+                attributes[ITEM_FIELD] = index
+                if geometry is None or isinstance(geometry, ogr.Geometry):
+                    writer.write(attributes, geometry)
+                else:
+                    writer.write_wkb(attributes, geometry)
+        conn.send(len(writer))
+    except Exception as e:
+        conn.send('%s: %s' % (e.__class__.__name__, e))
+    conn.close()
+
+
+def _insert_shards(data_source, layer, paths):
+
+    """
+    Copy shards into a layer in item order with SQL
+
+    Each shard is attached in turn and copied into a temporary table, which
+    is then inserted into the layer sorted by item index.  Features from the
+    same item keep the order they were written in.
+
+    :param data_source: GeoPackage or SQLite datasource opened for update
+    :type data_source: ogr.DataSource
+    :param layer: empty layer with the same fields as the shards, minus ITEM_FIELD
+    :type layer: ogr.Layer
+    :param paths: shards written by _write_shard() with the datasource's driver
+    :type paths: list
+
+    :return: SQL statements that were executed
+    :rtype: list
+    """
+
+    require_ogr()
+
+    # Make sure the table exists - OGR can defer creating it until the first feature is written
+    layer.SyncToDisk()
+
+    defn = layer.GetLayerDefn()
+    names = [layer.GetGeometryColumn()] + [defn.GetFieldDefn(i).GetName() for i in range(defn.GetFieldCount())]
+    columns = ', '.join('"%s"' % name for name in names)
+
+    statements = []
+    for s, path in enumerate(paths):
+        select = 'SELECT %s, "%s", rowid AS shard_fid FROM shard.shard' % (columns, ITEM_FIELD)
+        statements.append("ATTACH DATABASE '%s' AS shard" % path.replace("'", "''"))
+        if s == 0:
+            statements.append('CREATE TEMP TABLE shard_features AS ' + select)
+        else:
+            statements.append('INSERT INTO temp.shard_features ' + select)
+        statements.append('DETACH DATABASE shard')
+    statements.append('INSERT INTO "%s" (%s) SELECT %s FROM temp.shard_features ORDER BY "%s", shard_fid'
+                      % (layer.GetName(), columns, columns, ITEM_FIELD))
+    statements.append('DROP TABLE temp.shard_features')
+    if data_source.GetDriver().GetDescription() == 'GPKG':
+        statements.append('RECOMPUTE EXTENT ON %s' % layer.GetName())
+
+    for statement in statements:
+        _execute_sql(data_source, statement)
+
+    return statements
+
+
+def _create_layer(path, fields, geometry_type, epsg, driver, layer_name, overwrite):
+
+    """
+    Create an empty layer for the shards to be copied into and return its name
+    """
+
+    with LayerWriter(path, fields, geometry_type, epsg=epsg, driver=driver, layer_name=layer_name,
+                     overwrite=overwrite, spatial_index=False) as writer:
+        return writer.layer.GetName()
+
+
+def _merge_shards(paths, outfile, driver, layer_name, index_fields, spatial_index):
+
+    """
+    Copy shards into an existing GeoPackage or SQLite output and index it
+    """
+
+    data_source = open_output(outfile, driver)
+    layer = data_source.GetLayerByName(str(layer_name))
+    _insert_shards(data_source, layer, paths)
+    create_indexes(data_source, layer, index_fields, spatial_index=spatial_index)
+    layer = None
+    data_source = None
+
+
+def export_shards(keys, produce, outfile, fields, geometry_type, jobs, mode='group', epsg=4326, driver=None,
+                  layer_name=None, overwrite=False, batch_size=DEFAULT_BATCH_SIZE, set_field='SetField',
+                  index_fields=(), spatial_index=True, workdir=None, log=None):
+
+    """
+    Compute and write features in parallel and merge them into one output layer
+
+    :param keys: one shard key per item - see partition()
+    :type keys: list|tuple
+    :param produce: called in a worker with a shard's item indexes and returns
+                    (item index, attributes, geometry) for every feature in
+                    ascending item index order.  geometry can be an
+                    ogr.Geometry, WKB, or None.
+    :type produce: function
+    :param outfile: output datasource
+    :type outfile: str
+    :param fields: (name, width, type[, precision]) field definitions
+    :type fields: list|tuple
+    :param geometry_type: OGR geometry type like ogr.wkbPoint
+    :type geometry_type: int
+    :param jobs: number of worker processes, which is also the number of shards
+    :type jobs: int
+    :param mode: one of SHARD_MODES
+    :type mode: str
+    :param workdir: directory for the temporary shards - defaults to the system temp directory
+    :type workdir: str|None
+    :param log: called with progress messages
+    :type log: function|None
+
+    Remaining arguments are passed to the output LayerWriter.
+
+    :return: number of features written
+    :rtype: int
+    """
+
+    require_ogr()
+
+    driver_name = get_driver_name(outfile, driver)
+    shard_driver = driver_name if driver_name in SQL_DRIVERS else 'GPKG'
+    extension = '.sqlite' if shard_driver == 'SQLite' else '.gpkg'
+
+    shards = [shard for shard in partition(keys, jobs, mode=mode) if shard]
+    tempdir = tempfile.mkdtemp(prefix='crowdtools-shards-', dir=workdir)
+    try:
+
+        # Start every worker before collecting results so they run concurrently
+        _log(log, "Writing %s shards with %s jobs ..." % (len(shards), jobs))
+        workers = []
+        for s, indexes in enumerate(shards):
+            path = join(tempdir, 'shard-%s%s' % (s, extension))
+            parent, child = _context.Pipe(duplex=False)
+            proc = _context.Process(target=_write_shard, args=(produce, indexes, path, fields, geometry_type, epsg,
+                                                               shard_driver, set_field, child))
+            proc.start()
+            child.close()
+            workers.append((path, proc, parent))
+
+        n_features = 0
+        errors = []
+        for path, proc, parent in workers:
+            try:
+                result = parent.recv()
+            except EOFError:
+                result = 'Shard process died'
+            proc.join()
+            if isinstance(result, str):
+                errors.append(result)
+            elif proc.exitcode:
+                errors.append('Shard process exited with %s' % proc.exitcode)
+            else:
+                n_features += result
+        if errors:
+            raise RuntimeError("Could not write shards: %s" % '; '.join(errors))
+        paths = [path for path, proc, parent in workers]
+
+        _log(log, "Merging shards ...")
+        if driver_name in SQL_DRIVERS:
+            layer_name = _create_layer(outfile, fields, geometry_type, epsg, driver, layer_name, overwrite)
+            _merge_shards(paths, outfile, driver_name, layer_name, index_fields, spatial_index)
+            return n_features
+
+        # Other formats get the shards merged into a temporary GeoPackage first
+        merged = join(tempdir, 'merged.gpkg')
+        _create_layer(merged, fields, geometry_type, epsg, 'GPKG', 'merged', False)
+        _merge_shards(paths, merged, 'GPKG', 'merged', (), False)
+
+        if driver_name in APPEND_DRIVERS:
+            layer_name = _create_layer(outfile, fields, geometry_type, epsg, driver, layer_name, overwrite)
+            appended = gdal.VectorTranslate(outfile, merged, accessMode='append', layerName=layer_name)
+            if appended is None:
+                raise RuntimeError("Could not append shards to output: %s" % outfile)
+            appended = None
+            data_source = open_output(outfile, driver_name)
+            create_indexes(data_source, data_source.GetLayerByName(str(layer_name)), index_fields,
+                           spatial_index=spatial_index)
+            data_source = None
+            return n_features
+
+        data_source = ogr.Open(merged)
+        with LayerWriter(outfile, fields, geometry_type, epsg=epsg, driver=driver, layer_name=layer_name,
+                         overwrite=overwrite, batch_size=batch_size, set_field=set_field,
+                         index_fields=index_fields, spatial_index=spatial_index) as writer:
+            for feature in data_source.GetLayer(0):
+                attributes = {}
+                for name in writer.field_names:
+                    value = feature.GetField(name)
+                    if value is not None:
+                        attributes[name] = value
+                writer.write(attributes, feature.GetGeometryRef())
+        data_source = None
+
+        return len(writer)
+
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
@@ -0,0 +1,268 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Incrementally read and write the top-level JSON arrays PyBossa exports
+
+json.load() has to hold the entire file and the entire parsed object in memory
+before anything can be done with it.  The reader below only ever holds a
+single element plus one read buffer, so task_run.json files with millions of
+entries can be filtered, joined, and re-written element by element.
+"""
+
+
+import json
+
+
+# Characters json allows between values
+_WHITESPACE = ' \t\n\r'
+
+# Characters that can legally follow an element of an array
+_TERMINATORS = _WHITESPACE + ',]'
+
+# Default number of characters to read from disk at once
+CHUNK_SIZE = 65536
+
+
+def _open(path_or_file, mode):
+
+    """
+    Open a path or pass through an already open file object
+
+    :param path_or_file: file path or file-like object
+    :type path_or_file: str|file
+    :param mode: mode to open the path with
+    :type mode: str
+    :return: file object and whether or not the caller is responsible for closing it
+    :rtype: tuple
+    """
+
+    if hasattr(path_or_file, 'read') or hasattr(path_or_file, 'write'):
+        return path_or_file, False
+    else:
+        return open(path_or_file, mode), True
+
+
+def iter_json_array(path_or_file, chunk_size=CHUNK_SIZE):
+
+    """
+    Yield the elements of a top-level JSON array one at a time
+
+    Memory use is bounded by the size of the largest element plus chunk_size.
+
+    :param path_or_file: path to a file containing a JSON array or an open file object
+    :type path_or_file: str|file
+    :param chunk_size: number of characters to read at a time
+    :type chunk_size: int
+    :rtype: generator
+    """
+
+    decoder = json.JSONDecoder()
+    f, close = _open(path_or_file, 'r')
+
+    try:
+
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill(buf, pos):
+            chunk = f.read(chunk_size)
+            return buf[pos:] + chunk, 0, not chunk
+
+        # Find the opening bracket
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos, eof = fill(buf, pos)
+        if pos >= len(buf) or buf[pos] != '[':
+            raise ValueError("Input does not contain a top-level JSON array")
+        pos += 1
+
+        expect_value = True
+        first = True
+        while True:
+
+            # Skip whitespace, reading more data if the buffer runs out
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    raise ValueError("Unexpected end of input inside JSON array")
+                buf, pos, eof = fill(buf, pos)
+                continue
+
+            char = buf[pos]
+            if char == ']' and (first or not expect_value):
+                return
+            elif char == ',' and not expect_value:
+                expect_value = True
+                pos += 1
+                continue
+            elif not expect_value:
+                raise ValueError("Expected ',' or ']' at character %s of buffer" % pos)
+
+            # Decode the next element.  A number at the end of the buffer might be truncated ('2.5' of '2.5e3'),
+            # so only accept an element once the character that terminates it has been read or the file is exhausted.
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+                complete = eof or (end < len(buf) and buf[end] in _TERMINATORS)
+            except ValueError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                buf, pos, eof = fill(buf, pos)
+                continue
+
+            yield element
+            pos = end
+            first = False
+            expect_value = False
+
+            # Drop consumed characters so the buffer doesn't grow with the file
+            if pos > chunk_size:
+                buf = buf[pos:]
+                pos = 0
+
+    finally:
+        if close:
+            f.close()
+
+
+class JSONArrayWriter(object):
+
+    """
+    Write a top-level JSON array one element at a time
+
+    Output is identical to json.dump() called on a list containing the same
+    elements with the same keyword arguments.  Use as a context manager or call
+    close() to write the closing bracket.
+
+        with JSONArrayWriter('task_run.json') as writer:
+            for tr in iter_json_array('raw_task_run.json'):
+                writer.write(tr)
+    """
+
+    def __init__(self, path_or_file, item_separator=', ', **dump_kwargs):
+
+        """
+        :param path_or_file: output file path or an open file object
+        :type path_or_file: str|file
+        :param item_separator: placed between elements - matches json.dump()'s default
+        :type item_separator: str
+        :param dump_kwargs: additional keyword arguments for json.dumps() - used to encode each element
+        :type dump_kwargs: dict
+        """
+
+        self.item_separator = item_separator
+        self.dump_kwargs = dump_kwargs
+        self.count = 0
+        self.closed = False
+        self._f, self._close = _open(path_or_file, 'w')
+        self._f.write('[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, element):
+
+        """
+        Append an element to the array
+
+        :param element: any object json.dumps() can encode
+        :type element: any
+        :rtype: None
+        """
+
+        if self.closed:
+            raise ValueError("Can't write to a closed JSONArrayWriter")
+        if self.count:
+            self._f.write(self.item_separator)
+        self._f.write(json.dumps(element, **self.dump_kwargs))
+        self.count += 1
+
+    def write_all(self, elements):
+
+        """
+        Append every element from an iterable
+
+        :param elements: iterable of objects json.dumps() can encode
+        :type elements: iterable
+        :rtype: None
+        """
+
+        for element in elements:
+            self.write(element)
+
+    def close(self):
+
+        """
+        Write the closing bracket and close the file if this object opened it
+
+        :rtype: None
+        """
+
+        if not self.closed:
+            self._f.write(']')
+            self.closed = True
+            if self._close:
+                self._f.close()
+
+
+def dump_json_array(elements, path_or_file, **dump_kwargs):
+
+    """
+    Stream an iterable into a JSON array on disk
+
+    :param elements: iterable of objects json.dumps() can encode
+    :type elements: iterable
+    :param path_or_file: output file path or an open file object
+    :type path_or_file: str|file
+    :param dump_kwargs: additional keyword arguments for json.dumps()
+    :type dump_kwargs: dict
+    :return: number of elements written
+    :rtype: int
+    """
+
+    with JSONArrayWriter(path_or_file, **dump_kwargs) as writer:
+        writer.write_all(elements)
+
+    return writer.count
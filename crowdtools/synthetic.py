@@ -0,0 +1,357 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Synthetic PyBossa exports for benchmarking
+
+The exports in Data/FrackFinder top out at a few thousand tasks.  The
+generator below writes task.json and task_run.json files with the same layout
+as the Tadpole, DartFrog, MoorFrog, and Digitizer exports but at any scale,
+with control over redundancy, how often the crowd agrees, which answers are
+given, polygon shapes, and click positions.  Output is seeded so the same
+parameters always produce the same files.
+"""
+
+
+import math
+import uuid
+import random
+import datetime
+from os.path import join
+
+from crowdtools.stream import JSONArrayWriter
+
+
+# Rough Pennsylvania extent: min lng, min lat, max lng, max lat
+PA_BBOX = (-80.5, 39.7, -74.7, 42.0)
+
+# Meters per degree of latitude
+_METERS_PER_DEGREE = 111320.0
+
+# Modeled on the real exports - selection weights come from the answer mix in Data/FrackFinder
+PROFILES = {
+    'tadpole': {
+        'app_id': 45,
+        'answer': 'selection',
+        'selections': (('pad', 0.55), ('nopad', 0.38), ('unknown', 0.07)),
+        'n_answers': 3,
+        'years': (2013,),
+    },
+    'dartfrog': {
+        'app_id': 37,
+        'answer': 'selection',
+        'selections': (('other', 0.88), ('fracking', 0.08), ('unknown', 0.04)),
+        'n_answers': 3,
+        'years': (2005, 2008, 2010),
+    },
+    'moorfrog': {
+        'app_id': 79,
+        'answer': 'positions',
+        'selections': (),
+        'n_answers': 3,
+        'years': (2013,),
+    },
+    'digitizer': {
+        'app_id': 98,
+        'answer': 'shapes',
+        'selections': (('done', 0.80), ('notapond', 0.17), ('unknown', 0.03)),
+        'n_answers': 1,
+        'years': (2013,),
+    },
+}
+
+
+def _weighted_choice(rng, choices):
+
+    """
+    :param rng: random number generator
+    :type rng: random.Random
+    :param choices: (value, weight) pairs
+    :type choices: tuple
+    :rtype: object
+    """
+
+    total = sum(w for v, w in choices)
+    r = rng.random() * total
+    for value, weight in choices:
+        r -= weight
+        if r < 0:
+            return value
+    return choices[-1][0]
+
+
+def _offset(lat, lng, meters, angle):
+
+    """
+    Move a point a distance in a direction
+
+    :param lat: latitude in degrees
+    :type lat: float
+    :param lng: longitude in degrees
+    :type lng: float
+    :param meters: distance
+    :type meters: float
+    :param angle: direction in radians, counter-clockwise from east
+    :type angle: float
+    :return: new longitude and latitude
+    :rtype: tuple
+    """
+
+    dlat = meters * math.sin(angle) / _METERS_PER_DEGREE
+    dlng = meters * math.cos(angle) / (_METERS_PER_DEGREE * math.cos(math.radians(lat)))
+    return round(lng + dlng, 12), round(lat + dlat, 12)
+
+
+def random_polygon(rng, lat, lng, n_vertices=(4, 12), radius=(20, 120)):
+
+    """
+    An irregular pond-like GeoJSON Polygon around a point
+
+    :param rng: random number generator
+    :type rng: random.Random
+    :param lat: center latitude
+    :type lat: float
+    :param lng: center longitude
+    :type lng: float
+    :param n_vertices: min and max number of vertices, not counting the closing vertex
+    :type n_vertices: tuple
+    :param radius: min and max distance in meters from the center to a vertex
+    :type radius: tuple
+    :rtype: dict
+    """
+
+    n = rng.randint(*n_vertices)
+    size = rng.uniform(*radius)
+    ring = []
+    for i in range(n):
+        angle = 2 * math.pi * (i + rng.uniform(-0.3, 0.3)) / n
+        ring.append(list(_offset(lat, lng, size * rng.uniform(0.6, 1.0), angle)))
+    ring.append(list(ring[0]))
+
+    return {'type': 'Polygon', 'coordinates': [ring]}
+
+
+def iter_export(n_task_runs, profile='dartfrog', redundancy=None, selections=None, agreement=0.85,
+                incomplete=0.02, n_users=50, anonymous=0.0, bbox=PA_BBOX, clicks=(0, 3), shapes=(1, 2),
+                n_vertices=(4, 12), radius=(20, 120), seed=0, first_task_id=1, first_task_run_id=1):
+
+    """
+    Generate tasks and their task runs one task at a time
+
+    Each task gets a "true" answer drawn from the selection weights and each of
+    its task runs agrees with it with probability `agreement`, so consensus
+    and tie handling see a realistic mix.  Sites are revisited once per year
+    in the profile, like the DartFrog 2005/2008/2010 imagery.
+
+    :param n_task_runs: number of task runs to generate
+    :type n_task_runs: int
+    :param profile: key from PROFILES
+    :type profile: str
+    :param redundancy: task runs per task - defaults to the profile's n_answers
+    :type redundancy: int|None
+    :param selections: (selection, weight) pairs - defaults to the profile's
+    :type selections: tuple|None
+    :param agreement: probability a task run gives the task's true answer
+    :type agreement: float
+    :param incomplete: fraction of tasks with fewer than `redundancy` task runs
+    :type incomplete: float
+    :param n_users: number of distinct user_id's
+    :type n_users: int
+    :param anonymous: fraction of task runs with a user_ip instead of a user_id
+    :type anonymous: float
+    :param bbox: min lng, min lat, max lng, max lat for task locations
+    :type bbox: tuple
+    :param clicks: min and max clicks per MoorFrog task run
+    :type clicks: tuple
+    :param shapes: min and max polygons per Digitizer task run
+    :type shapes: tuple
+    :param n_vertices: see random_polygon()
+    :type n_vertices: tuple
+    :param radius: see random_polygon()
+    :type radius: tuple
+    :param seed: random seed
+    :type seed: int
+    :param first_task_id: id of the first task
+    :type first_task_id: int
+    :param first_task_run_id: id of the first task run
+    :type first_task_run_id: int
+    :return: yields (task, task_runs) tuples
+    :rtype: generator
+    """
+
+    rng = random.Random(seed)
+    settings = PROFILES[profile]
+    app_id = settings['app_id']
+    answer = settings['answer']
+    years = settings['years']
+    if redundancy is None:
+        redundancy = settings['n_answers']
+    if selections is None:
+        selections = settings['selections']
+    labels = [s for s, w in selections]
+
+    timestamp = datetime.datetime(2014, 3, 3, 16, 26, 37)
+    task_id = first_task_id
+    task_run_id = first_task_run_id
+    remaining = n_task_runs
+    site = None
+    i = 0
+
+    while remaining > 0:
+
+        # A new site every len(years) tasks
+        if i % len(years) == 0:
+            site = {
+                'latitude': round(rng.uniform(bbox[1], bbox[3]), 8),
+                'longitude': round(rng.uniform(bbox[0], bbox[2]), 8),
+                'county': 'County%i' % rng.randint(1, 67),
+                'SiteID': str(uuid.UUID(int=rng.getrandbits(128), version=5)),
+            }
+        year = years[i % len(years)]
+        i += 1
+
+        n_runs = redundancy
+        if n_runs > 1 and rng.random() < incomplete:
+            n_runs = rng.randint(1, n_runs - 1)
+        n_runs = min(n_runs, remaining)
+        remaining -= n_runs
+
+        lat = site['latitude']
+        lng = site['longitude']
+        info = {
+            'url': 'https://mapsengine.google.com/06136759344167181854-11153668168998282611-4/wms/?version=1.3.0',
+            'latitude': lat,
+            'longitude': lng,
+            'county': site['county'],
+            'state': 'PA',
+            'SiteID': site['SiteID'],
+            'year': year,
+            'options': {'layers': '06136759344167181854-%020i-4' % rng.getrandbits(64), 'version': '1.3.0'},
+        }
+        if answer == 'positions':
+            lo = _offset(lat, lng, 500, math.radians(225))
+            hi = _offset(lat, lng, 500, math.radians(45))
+            info['bbox'] = '%s,%s,%s,%s' % (lo[0], lo[1], hi[0], hi[1])
+        task = {
+            'info': info,
+            'n_answers': redundancy,
+            'quorum': 0,
+            'calibration': 0,
+            'created': timestamp.isoformat(),
+            'app_id': app_id,
+            'state': 'completed' if n_runs >= redundancy else 'ongoing',
+            'task_runs_nr': n_runs,
+            'id': task_id,
+            'priority_0': 0.0
+        }
+
+        truth = _weighted_choice(rng, selections) if selections else None
+        task_runs = []
+        for r in range(n_runs):
+
+            present_task = int(rng.lognormvariate(9.5, 0.8))
+            timestamp += datetime.timedelta(microseconds=rng.randint(1, 30000000))
+            run_info = {'done': {'tasks': 1}, 'timings': {'presentTask': present_task}}
+
+            if answer == 'positions':
+                positions = []
+                for c in range(rng.randint(*clicks)):
+                    px, py = _offset(lat, lng, rng.uniform(0, 400), rng.uniform(0, 2 * math.pi))
+                    positions.append({'lat': py, 'lon': px})
+                run_info['positions'] = positions
+                run_info['done']['positions'] = len(positions)
+            else:
+                if rng.random() < agreement or len(labels) < 2:
+                    selection = truth
+                else:
+                    selection = rng.choice([s for s in labels if s != truth])
+                run_info['selection'] = selection
+                if answer == 'shapes':
+                    run_info['timings']['reportAnswer'] = present_task + rng.randint(100, 1000)
+                    if selection == 'done':
+                        run_info['shapes'] = [
+                            random_polygon(rng, lat, lng, n_vertices=n_vertices, radius=radius)
+                            for s in range(rng.randint(*shapes))]
+                    else:
+                        run_info['shapes'] = []
+
+            if rng.random() < anonymous:
+                user_id = None
+                user_ip = '10.%i.%i.%i' % (rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254))
+            else:
+                user_id = rng.randint(1, n_users)
+                user_ip = None
+
+            task_runs.append({
+                'info': run_info,
+                'user_id': user_id,
+                'task_id': task_id,
+                'created': timestamp.isoformat(),
+                'finish_time': (timestamp + datetime.timedelta(microseconds=rng.randint(10, 50))).isoformat(),
+                'calibration': None,
+                'app_id': app_id,
+                'user_ip': user_ip,
+                'timeout': None,
+                'id': task_run_id
+            })
+            task_run_id += 1
+
+        task_id += 1
+        yield task, task_runs
+
+
+def write_export(outdir, n_task_runs, **kwargs):
+
+    """
+    Write a synthetic task.json and task_run.json
+
+    :param outdir: existing directory to write the files into
+    :type outdir: str
+    :param n_task_runs: number of task runs to generate
+    :type n_task_runs: int
+    :param kwargs: passed to iter_export()
+    :type kwargs: dict
+    :return: paths to task.json and task_run.json and the number of tasks and task runs written
+    :rtype: tuple
+    """
+
+    task_file = join(outdir, 'task.json')
+    task_run_file = join(outdir, 'task_run.json')
+    with JSONArrayWriter(task_file) as tasks, JSONArrayWriter(task_run_file) as task_runs:
+        for task, runs in iter_export(n_task_runs, **kwargs):
+            tasks.write(task)
+            task_runs.write_all(runs)
+
+    return task_file, task_run_file, tasks.count, task_runs.count
@@ -0,0 +1,460 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+"""
+Columnar representation of task_run.json backed by NumPy arrays
+
+A list of nested dicts costs several hundred bytes per task run and forces
+every aggregate through a Python loop.  TaskRunTable stores the fields the
+analysis code actually uses as typed arrays, so counts and statistics can be
+computed with vectorized NumPy operations.
+"""
+
+
+from array import array
+
+import numpy as np
+
+from crowdtools.stream import iter_json_array
+
+
+# Sentinel stored in integer columns when the export has no value (anonymous users, missing selections, etc.)
+MISSING = -1
+
+# Resolution used for the created and finish_time columns
+TIME_UNIT = 'datetime64[us]'
+
+# Python 2's array module has no 'q' typecode - fall back to the platform's long
+try:
+    _INT64 = array('q').typecode
+except ValueError:
+    _INT64 = 'l'
+
+
+class StringTable(object):
+
+    """
+    Intern strings as small integer codes
+
+    Code MISSING is reserved for None.
+    """
+
+    def __init__(self, strings=()):
+
+        """
+        :param strings: initial strings - codes are assigned in order
+        :type strings: list|tuple
+        """
+
+        self.strings = []
+        self._codes = {}
+        for s in strings:
+            self.intern(s)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, value):
+
+        """
+        :param value: string to look up or add
+        :type value: str|None
+        :return: the code for value
+        :rtype: int
+        """
+
+        if value is None:
+            return MISSING
+        try:
+            return self._codes[value]
+        except KeyError:
+            code = len(self.strings)
+            self._codes[value] = code
+            self.strings.append(value)
+            return code
+
+    def code(self, value):
+
+        """
+        :param value: string to look up
+        :type value: str|None
+        :return: the code for value or MISSING if the value has never been interned
+        :rtype: int
+        """
+
+        if value is None:
+            return MISSING
+        return self._codes.get(value, MISSING)
+
+    def decode(self, codes):
+
+        """
+        :param codes: array of codes produced by intern()
+        :type codes: numpy.ndarray
+        :return: object array of strings with None where the code is MISSING
+        :rtype: numpy.ndarray
+        """
+
+        lookup = np.array(self.strings + [None], dtype=object)
+        codes = np.asarray(codes)
+        return lookup[np.where(codes == MISSING, len(self.strings), codes)]
+
+
+class GroupBy(object):
+
+    """
+    A grouping of table rows by the values of one column
+
+    Rows are sorted once with a stable argsort, so rows belonging to
+    keys[i] are order[starts[i]:starts[i] + counts[i]] and keep the order they
+    had in the export.  inverse maps every row to the index of its group, which
+    is what np.bincount() and np.add.at() need to aggregate per group.
+    """
+
+    def __init__(self, values):
+
+        """
+        :param values: column to group on
+        :type values: numpy.ndarray
+        """
+
+        self.keys, self.inverse, self.counts = np.unique(values, return_inverse=True, return_counts=True)
+        self.inverse = self.inverse.ravel()
+        self.order = np.argsort(self.inverse, kind='mergesort')
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        for key, start, count in zip(self.keys, self.starts, self.counts):
+            yield key, self.order[start:start + count]
+
+    def indices(self, key):
+
+        """
+        :param key: group key
+        :type key: int
+        :return: row indices belonging to key - empty if the key doesn't exist
+        :rtype: numpy.ndarray
+        """
+
+        i = np.searchsorted(self.keys, key)
+        if i >= len(self.keys) or self.keys[i] != key:
+            return self.order[:0]
+        return self.order[self.starts[i]:self.starts[i] + self.counts[i]]
+
+    def sum(self, values):
+
+        """
+        :param values: a column with one value per row
+        :type values: numpy.ndarray
+        :return: sum of values for each group - NaN values are ignored
+        :rtype: numpy.ndarray
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        return np.bincount(self.inverse, weights=np.where(np.isnan(values), 0, values), minlength=len(self.keys))
+
+    def mean(self, values):
+
+        """
+        :param values: a column with one value per row
+        :type values: numpy.ndarray
+        :return: mean of values for each group - NaN values are ignored and groups without values are NaN
+        :rtype: numpy.ndarray
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        n = np.bincount(self.inverse, weights=(~np.isnan(values)).astype(np.float64), minlength=len(self.keys))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(values) / n
+
+    def count_codes(self, codes, n_codes):
+
+        """
+        Count how many times each code appears in each group
+
+        :param codes: interned string codes, one per row - MISSING rows are not counted
+        :type codes: numpy.ndarray
+        :param n_codes: number of possible codes
+        :type n_codes: int
+        :return: array with shape (len(keys), n_codes)
+        :rtype: numpy.ndarray
+        """
+
+        codes = np.asarray(codes)
+        valid = codes != MISSING
+        flat = self.inverse[valid].astype(np.int64) * n_codes + codes[valid]
+        counts = np.bincount(flat, minlength=len(self.keys) * n_codes)
+        return counts.reshape(len(self.keys), n_codes)
+
+
+class TaskRunTable(object):
+
+    """
+    Task runs from a PyBossa export stored as typed NumPy columns
+
+    Columns:
+        id, task_id, user_id, app_id -> int64, MISSING when null
+        user_ip                      -> int32 codes into self.user_ips
+        created, finish_time         -> datetime64[us], NaT when null
+        present_task                 -> float64 info.timings.presentTask in ms, NaN when missing
+        selection                    -> int32 codes into self.selections, MISSING when absent or null
+    """
+
+    COLUMNS = ('id', 'task_id', 'user_id', 'user_ip', 'app_id', 'created', 'finish_time', 'present_task',
+               'selection')
+
+    def __init__(self, columns, selections, user_ips):
+
+        """
+        Use from_task_runs() or from_file() instead of calling this directly
+
+        :param columns: maps every name in COLUMNS to an array
+        :type columns: dict
+        :param selections: string table for the selection column
+        :type selections: StringTable
+        :param user_ips: string table for the user_ip column
+        :type user_ips: StringTable
+        """
+
+        lengths = set(len(columns[name]) for name in self.COLUMNS)
+        if len(lengths) > 1:
+            raise ValueError("Columns have different lengths: %s" % sorted(lengths))
+
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+        self.selections = selections
+        self.user_ips = user_ips
+        self._groups = {}
+
+    def __len__(self):
+        return len(self.id)
+
+    @classmethod
+    def from_task_runs(cls, task_runs, selections=(), selection_key='selection'):
+
+        """
+        Build a table in a single pass over an iterable of task runs
+
+        :param task_runs: task_run.json from json.load(), load_json(), or iter_json_array()
+        :type task_runs: iterable
+        :param selections: pre-assign codes to these selections so they are stable across tables
+        :type selections: list|tuple
+        :param selection_key: info key holding the selection - Tadpole 2005-2010 uses 'type'
+        :type selection_key: str
+        :rtype: TaskRunTable
+        """
+
+        selection_table = StringTable(selections)
+        ip_table = StringTable()
+
+        ids = array(_INT64)
+        task_ids = array(_INT64)
+        user_ids = array(_INT64)
+        app_ids = array(_INT64)
+        user_ip_codes = array('i')
+        selection_codes = array('i')
+        present_task = array('d')
+        created = []
+        finish_time = []
+
+        nan = float('nan')
+        for tr in task_runs:
+            ids.append(_int_or_missing(tr.get('id')))
+            task_ids.append(_int_or_missing(tr.get('task_id')))
+            user_ids.append(_int_or_missing(tr.get('user_id')))
+            app_ids.append(_int_or_missing(tr.get('app_id')))
+            user_ip_codes.append(ip_table.intern(tr.get('user_ip')))
+            created.append(tr.get('created') or 'NaT')
+            finish_time.append(tr.get('finish_time') or 'NaT')
+
+            info = tr.get('info')
+            if not hasattr(info, 'get'):
+                info = {}
+            selection_codes.append(selection_table.intern(info.get(selection_key)))
+            try:
+                present_task.append(float(info['timings']['presentTask']))
+            except (KeyError, TypeError, ValueError):
+                present_task.append(nan)
+
+        columns = {'id': _int64_column(ids),
+                   'task_id': _int64_column(task_ids),
+                   'user_id': _int64_column(user_ids),
+                   'app_id': _int64_column(app_ids),
+                   'user_ip': np.frombuffer(user_ip_codes, dtype=np.int32).copy(),
+                   'created': np.array(created, dtype=TIME_UNIT),
+                   'finish_time': np.array(finish_time, dtype=TIME_UNIT),
+                   'present_task': np.frombuffer(present_task, dtype=np.float64).copy(),
+                   'selection': np.frombuffer(selection_codes, dtype=np.int32).copy()}
+
+        return cls(columns, selection_table, ip_table)
+
+    @classmethod
+    def from_file(cls, path, selections=(), selection_key='selection'):
+
+        """
+        Stream a task_run.json file into a table without loading the JSON into memory
+
+        :param path: path to task_run.json
+        :type path: str
+        :param selections: passed to from_task_runs()
+        :type selections: list|tuple
+        :param selection_key: passed to from_task_runs()
+        :type selection_key: str
+        :rtype: TaskRunTable
+        """
+
+        return cls.from_task_runs(iter_json_array(path), selections=selections, selection_key=selection_key)
+
+    def take(self, rows):
+
+        """
+        :param rows: row indices or a boolean mask
+        :type rows: numpy.ndarray
+        :return: a new table containing only the requested rows - string tables are shared
+        :rtype: TaskRunTable
+        """
+
+        columns = dict((name, getattr(self, name)[rows]) for name in self.COLUMNS)
+        return self.__class__(columns, self.selections, self.user_ips)
+
+    def group_by(self, column):
+
+        """
+        :param column: name of the column to group on
+        :type column: str
+        :return: cached grouping of rows by column
+        :rtype: GroupBy
+        """
+
+        try:
+            return self._groups[column]
+        except KeyError:
+            groups = self._groups[column] = GroupBy(getattr(self, column))
+            return groups
+
+    def group_by_task(self):
+
+        """
+        :rtype: GroupBy
+        """
+
+        return self.group_by('task_id')
+
+    def group_by_user(self):
+
+        """
+        :rtype: GroupBy
+        """
+
+        return self.group_by('user_id')
+
+    def task_run_counts(self):
+
+        """
+        :return: unique task ids and the number of task runs for each
+        :rtype: tuple
+        """
+
+        groups = self.group_by_task()
+        return groups.keys, groups.counts
+
+    def selection_counts(self):
+
+        """
+        :return: unique task ids and a (task x selection) matrix of counts - columns follow self.selections.strings
+        :rtype: tuple
+        """
+
+        groups = self.group_by_task()
+        return groups.keys, groups.count_codes(self.selection, len(self.selections))
+
+    def selection_column(self):
+
+        """
+        :return: decoded info.selection values as an object array
+        :rtype: numpy.ndarray
+        """
+
+        return self.selections.decode(self.selection)
+
+    def user_ip_column(self):
+
+        """
+        :return: decoded user_ip values as an object array
+        :rtype: numpy.ndarray
+        """
+
+        return self.user_ips.decode(self.user_ip)
+
+    def durations(self):
+
+        """
+        :return: finish_time - created in seconds, NaN when either is null
+        :rtype: numpy.ndarray
+        """
+
+        delta = (self.finish_time - self.created).astype('timedelta64[us]')
+        seconds = delta.astype(np.float64) / 1e6
+        seconds[np.isnat(delta)] = np.nan
+        return seconds
+
+
+def _int64_column(values):
+
+    """
+    :param values: integers collected with array(_INT64)
+    :type values: array.array
+    :return: values as an int64 array - a copy, so the array.array can be released
+    :rtype: numpy.ndarray
+    """
+
+    return np.frombuffer(values, dtype='i%d' % values.itemsize).astype(np.int64)
+
+
+def _int_or_missing(value):
+
+    """
+    :param value: integer-like value from a task run
+    :type value: int|str|None
+    :return: value as an int or MISSING when null
+    :rtype: int
+    """
+
+    if value is None:
+        return MISSING
+    return int(value)
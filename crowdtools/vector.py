@@ -0,0 +1,576 @@
+# ========================================================================== #
+#
+#    Copyright (c) 2014, SkyTruth
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#    * Neither the name of the {organization} nor the names of its
+#      contributors may be used to endorse or promote products derived from
+#      this software without specific prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ========================================================================== #
+
+
+
+
+
+
+
+"""
+Batched OGR layer writer shared by the export utilities
+
+Calling layer.CreateFeature() once per feature outside of a transaction
+makes every feature its own commit, which is painfully slow for SQLite based
+formats like GeoPackage.  LayerWriter creates the datasource and layer from a
+declarative field list, buffers features into transactions of batch_size
+features, and applies per-driver creation and configuration options so bulk
+exports are dominated by geometry work instead of commits.
+
+Field definitions use the same tuples the utilities have always used:
+(name, width, type) or (name, width, type, precision), where type is an OGR
+field type constant or one of the names in FIELD_TYPES.
+
+Indexes are built by create_indexes() when the writer is closed: a spatial
+index plus an attribute index for each declared key field, so lookups and
+joins on fields like task_id and site_id don't scan the whole layer.
+
+points_to_wkb() and lines_to_wkb() build WKB for every geometry in one pass
+with NumPy so exporters don't have to format and re-parse a WKT string per
+feature, which also truncated coordinates to the 6 decimals of %f.
+"""
+
+
+from os.path import basename, exists, splitext
+
+import numpy as np
+
+try:
+    from osgeo import gdal
+    from osgeo import ogr
+    from osgeo import osr
+except ImportError:
+    try:
+        import gdal
+        import ogr
+        import osr
+    except ImportError:
+        gdal = ogr = osr = None
+
+
+# Driver used when one isn't given and can't be inferred from the output file extension
+DEFAULT_DRIVER = 'GPKG'
+
+# Infer the driver from the output file extension
+DRIVER_EXTENSIONS = {'.gpkg': 'GPKG',
+                     '.shp': 'ESRI Shapefile',
+                     '.sqlite': 'SQLite',
+                     '.geojson': 'GeoJSON',
+                     '.json': 'GeoJSON',
+                     '.kml': 'KML',
+                     '.gml': 'GML',
+                     '.csv': 'CSV'}
+
+# Number of features written per transaction
+DEFAULT_BATCH_SIZE = 10000
+
+# Dataset and layer creation options applied for each driver unless overridden
+DATASET_OPTIONS = {}
+# The GeoPackage R-tree is built by create_indexes() after the features are written, which is
+# much faster than updating it on every insert
+LAYER_OPTIONS = {'GPKG': ('GEOMETRY_NAME=geom', 'FID=fid', 'SPATIAL_INDEX=NO'),
+                 'SQLite': ('GEOMETRY_NAME=geom',)}
+
+# GDAL configuration options set while a datasource is being written - the output is a new
+# file, so there's nothing to protect by waiting for SQLite to sync every commit to disk
+CONFIG_OPTIONS = {'GPKG': (('OGR_SQLITE_SYNCHRONOUS', 'OFF'), ('OGR_SQLITE_CACHE', '512')),
+                  'SQLite': (('OGR_SQLITE_SYNCHRONOUS', 'OFF'), ('OGR_SQLITE_CACHE', '512'))}
+
+# WKB geometry type codes and the little-endian byte order flag
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_NDR = 1
+
+# Field type names accepted in field definitions, and the field types OGR can build shapefile attribute indexes on
+if ogr is not None:
+    FIELD_TYPES = {'int': ogr.OFTInteger,
+                   'real': ogr.OFTReal,
+                   'str': ogr.OFTString,
+                   'date': ogr.OFTDate,
+                   'datetime': ogr.OFTDateTime}
+    SHAPEFILE_INDEX_TYPES = (ogr.OFTInteger, ogr.OFTReal, ogr.OFTString)
+else:
+    FIELD_TYPES = {}
+    SHAPEFILE_INDEX_TYPES = ()
+
+
+def require_ogr():
+    if ogr is None:
+        raise ImportError("Writing vector data requires GDAL/OGR")
+
+
+def get_driver_name(path, driver=None):
+
+    """
+    :param path: output datasource
+    :type path: str
+    :param driver: explicit OGR driver name, which always wins
+    :type driver: str|None
+
+    :return: driver for the file extension or DEFAULT_DRIVER
+    :rtype: str
+    """
+
+    if driver is not None:
+        return driver
+    return DRIVER_EXTENSIONS.get(splitext(path)[1].lower(), DEFAULT_DRIVER)
+
+
+def get_layer_name(path):
+
+    """
+    :param path: output datasource
+    :type path: str
+    :return: file name without its extension
+    :rtype: str
+    """
+
+    return splitext(basename(path))[0]
+
+
+def _split_wkb(packed):
+
+    """
+    :param packed: structured array with one WKB geometry per element
+    :type packed: numpy.ndarray
+
+    :return: one WKB string per geometry
+    :rtype: list
+    """
+
+    size = packed.dtype.itemsize
+    buf = packed.tobytes()
+    return [buf[i:i + size] for i in range(0, len(buf), size)]
+
+
+def points_to_wkb(x, y):
+
+    """
+    Build 2D point WKB for every coordinate pair at once
+
+    :param x: longitudes or eastings
+    :type x: list|tuple|numpy.ndarray
+    :param y: latitudes or northings
+    :type y: list|tuple|numpy.ndarray
+
+    :return: one WKB string per point
+    :rtype: list
+    """
+
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    if x.shape != y.shape:
+        raise ValueError("Got %s x and %s y coordinates" % (len(x), len(y)))
+
+    # Packed (unaligned) so every element is exactly one 21 byte geometry
+    packed = np.empty(len(x), dtype=[('byte_order', 'u1'), ('type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+    packed['byte_order'] = WKB_NDR
+    packed['type'] = WKB_POINT
+    packed['x'] = x
+    packed['y'] = y
+
+    return _split_wkb(packed)
+
+
+def lines_to_wkb(coordinates):
+
+    """
+    Build 2D linestring WKB for lines that all have the same number of vertices
+
+    :param coordinates: array-like with shape (n_lines, n_vertices, 2) containing x, y pairs
+    :type coordinates: list|tuple|numpy.ndarray
+
+    :return: one WKB string per line
+    :rtype: list
+    """
+
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    if coordinates.size == 0:
+        return []
+    if coordinates.ndim != 3 or coordinates.shape[2] != 2 or coordinates.shape[1] < 2:
+        raise ValueError("Line coordinates must have shape (n_lines, n_vertices >= 2, 2): %s"
+                         % str(coordinates.shape))
+
+    n_vertices = coordinates.shape[1]
+    packed = np.empty(len(coordinates), dtype=[('byte_order', 'u1'), ('type', '<u4'), ('n_points', '<u4'),
+                                               ('coordinates', '<f8', (n_vertices, 2))])
+    packed['byte_order'] = WKB_NDR
+    packed['type'] = WKB_LINESTRING
+    packed['n_points'] = n_vertices
+    packed['coordinates'] = coordinates
+
+    return _split_wkb(packed)
+
+
+def _execute_sql(data_source, statement, dialect=''):
+
+    """
+    :return: first column of the first row or None
+    """
+
+    result = data_source.ExecuteSQL(statement, dialect=dialect)
+    if result is None:
+        return None
+    try:
+        feature = result.GetNextFeature()
+        return None if feature is None else feature.GetField(0)
+    finally:
+        data_source.ReleaseResultSet(result)
+
+
+def create_indexes(data_source, layer, index_fields=(), spatial_index=True):
+
+    """
+    Build a spatial index and attribute indexes on a finished layer
+
+    Shapefiles get a .qix spatial index and .ind/.idm attribute indexes
+    through OGR SQL.  GeoPackages get their R-tree and one SQLite index per
+    field.  SQLite outputs only get attribute indexes since their spatial
+    index requires SpatiaLite.  Other drivers are left alone.
+
+    OGR can only index integer, real, and string shapefile fields, so other
+    fields are skipped.  Reopen shapefiles with open_output() so integer
+    fields 10 or more digits wide aren't read back as 64-bit integers.
+
+    :param data_source: datasource containing layer
+    :type data_source: ogr.DataSource
+    :param layer: layer to index
+    :type layer: ogr.Layer
+    :param index_fields: fields to build attribute indexes for - fields the layer doesn't have are skipped
+    :type index_fields: list|tuple
+    :param spatial_index: build a spatial index
+    :type spatial_index: bool
+
+    :return: SQL statements that were executed
+    :rtype: list
+    """
+
+    require_ogr()
+
+    driver_name = data_source.GetDriver().GetDescription()
+    layer_name = layer.GetName()
+    defn = layer.GetLayerDefn()
+    field_defns = [defn.GetFieldDefn(i) for i in range(defn.GetFieldCount())]
+    types = dict((field_defn.GetName(), field_defn.GetType()) for field_defn in field_defns)
+    fields = [str(field) for field in index_fields if field in types]
+
+    statements = []
+    if driver_name == 'ESRI Shapefile':
+        layer.SyncToDisk()
+        if spatial_index:
+            statements.append('CREATE SPATIAL INDEX ON "%s"' % layer_name)
+        for field in fields:
+            if types[field] in SHAPEFILE_INDEX_TYPES:
+                statements.append('CREATE INDEX ON "%s" USING "%s"' % (layer_name, field))
+    elif driver_name in ('GPKG', 'SQLite'):
+        if spatial_index and driver_name == 'GPKG':
+            geometry_column = layer.GetGeometryColumn()
+            if not _execute_sql(data_source, "SELECT HasSpatialIndex('%s', '%s')" % (layer_name, geometry_column)):
+                statements.append("SELECT CreateSpatialIndex('%s', '%s')" % (layer_name, geometry_column))
+        for field in fields:
+            statements.append('CREATE INDEX IF NOT EXISTS "idx_%s_%s" ON "%s" ("%s")'
+                              % (layer_name, field, layer_name, field))
+
+    for statement in statements:
+        _execute_sql(data_source, statement)
+
+    return statements
+
+
+def open_output(path, driver=None):
+
+    """
+    Reopen a finished output for update
+
+    OGR reads shapefile integer fields 10 or more digits wide back as 64-bit
+    integers, which can't be indexed, unless the whole .dbf is scanned with
+    the ADJUST_TYPE open option.
+
+    :param path: output datasource
+    :type path: str
+    :param driver: OGR driver name - defaults to get_driver_name(path)
+    :type driver: str|None
+    :rtype: ogr.DataSource|gdal.Dataset
+    """
+
+    require_ogr()
+
+    if get_driver_name(path, driver) == 'ESRI Shapefile':
+        data_source = gdal.OpenEx(path, gdal.OF_VECTOR | gdal.OF_UPDATE, open_options=['ADJUST_TYPE=YES'])
+    else:
+        data_source = ogr.Open(path, 1)
+    if data_source is None:
+        raise ValueError("Could not open datasource for update: %s" % path)
+
+    return data_source
+
+
+def create_fields(layer, fields):
+
+    """
+    Add fields to a layer from declarative definitions
+
+    :param layer: layer to modify
+    :type layer: ogr.Layer
+    :param fields: (name, width, type) or (name, width, type, precision) tuples
+    :type fields: list|tuple
+
+    :return: field names in layer order
+    :rtype: list
+    """
+
+    require_ogr()
+
+    names = []
+    for definition in fields:
+        name, width, field_type = definition[:3]
+        precision = definition[3] if len(definition) > 3 else None
+        field_object = ogr.FieldDefn(str(name), FIELD_TYPES.get(field_type, field_type))
+        field_object.SetWidth(width)
+        if precision is not None:
+            field_object.SetPrecision(precision)
+        layer.CreateField(field_object)
+        names.append(str(name))
+
+    return names
+
+
+class LayerWriter(object):
+
+    """
+    Write features to a new single-layer datasource in batched transactions
+
+    Use as a context manager or call close() - pending features are only
+    committed by flush() or close().  If the with block raises, abort()
+    rolls back the open batch and closes the datasource without indexing.
+    """
+
+    def __init__(self, path, fields, geometry_type, epsg=4326, driver=None, layer_name=None, overwrite=False,
+                 batch_size=DEFAULT_BATCH_SIZE, dataset_options=None, layer_options=None, set_field='SetField',
+                 index_fields=(), spatial_index=True):
+
+        """
+        :param path: output datasource
+        :type path: str
+        :param fields: (name, width, type[, precision]) field definitions
+        :type fields: list|tuple
+        :param geometry_type: OGR geometry type like ogr.wkbPoint
+        :type geometry_type: int
+        :param epsg: EPSG code for the geometries
+        :type epsg: int
+        :param driver: OGR driver name - defaults to get_driver_name(path)
+        :type driver: str|None
+        :param layer_name: defaults to the file name without its extension
+        :type layer_name: str|None
+        :param overwrite: delete path first if it exists
+        :type overwrite: bool
+        :param batch_size: number of features written per transaction
+        :type batch_size: int
+        :param dataset_options: dataset creation options - defaults to DATASET_OPTIONS for the driver
+        :type dataset_options: list|tuple|None
+        :param layer_options: layer creation options - defaults to LAYER_OPTIONS for the driver
+        :type layer_options: list|tuple|None
+        :param set_field: name of the ogr.Feature method used to populate fields
+        :type set_field: str
+        :param index_fields: key fields indexed by close() - see create_indexes()
+        :type index_fields: list|tuple
+        :param spatial_index: build a spatial index in close()
+        :type spatial_index: bool
+        """
+
+        require_ogr()
+
+        if batch_size < 1:
+            raise ValueError("Invalid batch size: %s" % batch_size)
+
+        self.path = path
+        self.driver_name = get_driver_name(path, driver)
+        self.batch_size = batch_size
+        self.set_field = set_field
+        self.index_fields = tuple(index_fields)
+        self.spatial_index = spatial_index
+        self.n_features = 0
+        self._pending = 0
+        self._in_transaction = False
+
+        driver_object = ogr.GetDriverByName(str(self.driver_name))
+        if driver_object is None:
+            raise ValueError("Invalid OGR driver: %s" % self.driver_name)
+        if overwrite and exists(path):
+            driver_object.DeleteDataSource(path)
+
+        # Remember the previous configuration so it can be restored on close()
+        self._config = []
+        for key, value in CONFIG_OPTIONS.get(self.driver_name, ()):
+            self._config.append((key, gdal.GetConfigOption(key)))
+            gdal.SetConfigOption(key, value)
+
+        if dataset_options is None:
+            dataset_options = DATASET_OPTIONS.get(self.driver_name, ())
+        if layer_options is None:
+            layer_options = LAYER_OPTIONS.get(self.driver_name, ())
+
+        self.data_source = driver_object.CreateDataSource(path, options=list(dataset_options))
+        if self.data_source is None:
+            self._restore_config()
+            raise ValueError("Could not create datasource: %s" % path)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        if layer_name is None:
+            layer_name = get_layer_name(path)
+        self.layer = self.data_source.CreateLayer(str(layer_name), srs, geometry_type, options=list(layer_options))
+        self.field_names = create_fields(self.layer, fields)
+        self._defn = self.layer.GetLayerDefn()
+        self._transactions = bool(self.layer.TestCapability(ogr.OLCTransactions))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __len__(self):
+        return self.n_features
+
+    def _write(self, attributes, geometry, owned):
+
+        if self._transactions and not self._in_transaction:
+            self.layer.StartTransaction()
+            self._in_transaction = True
+
+        feature = ogr.Feature(self._defn)
+        set_field = getattr(feature, self.set_field)
+        for name in self.field_names:
+            if name in attributes:
+                set_field(name, attributes[name])
+        if geometry is not None:
+            # Geometries built here can be handed over without a copy
+            if owned:
+                feature.SetGeometryDirectly(geometry)
+            else:
+                feature.SetGeometry(geometry)
+        self.layer.CreateFeature(feature)
+
+        self.n_features += 1
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def write(self, attributes, geometry=None):
+
+        """
+        :param attributes: maps field names to values - fields not in the dict are left unset
+        :type attributes: dict
+        :param geometry: the feature's geometry
+        :type geometry: ogr.Geometry|None
+        """
+
+        self._write(attributes, geometry, False)
+
+    def write_wkb(self, attributes, wkb):
+
+        """
+        :param attributes: maps field names to values - fields not in the dict are left unset
+        :type attributes: dict
+        :param wkb: the feature's geometry as WKB, like the output of points_to_wkb()
+        :type wkb: str|bytes
+        """
+
+        self._write(attributes, ogr.CreateGeometryFromWkb(wkb), True)
+
+    def write_many(self, features):
+
+        """
+        :param features: (attributes, geometry) pairs
+        :type features: iterable
+
+        :return: number of features written
+        :rtype: int
+        """
+
+        n_features = self.n_features
+        for attributes, geometry in features:
+            self.write(attributes, geometry)
+        return self.n_features - n_features
+
+    def flush(self):
+
+        """
+        Commit pending features
+        """
+
+        if self._in_transaction:
+            self.layer.CommitTransaction()
+            self._in_transaction = False
+        self._pending = 0
+
+    def _restore_config(self):
+        for key, value in self._config:
+            gdal.SetConfigOption(key, value)
+        self._config = []
+
+    def close(self):
+
+        """
+        Commit pending features, build indexes, and close the datasource
+        """
+
+        if self.data_source is not None:
+            self.flush()
+            create_indexes(self.data_source, self.layer, self.index_fields, spatial_index=self.spatial_index)
+            self._defn = None
+            self.layer = None
+            self.data_source = None
+        self._restore_config()
+
+    def abort(self):
+
+        """
+        Roll back pending features and close the datasource without building indexes
+        """
+
+        if self.data_source is not None:
+            if self._in_transaction:
+                self.layer.RollbackTransaction()
+                self._in_transaction = False
+                # The GeoPackage driver's cached feature count is wrong after a rollback - clear it so it's recounted
+                if self.driver_name == 'GPKG':
+                    _execute_sql(self.data_source, "UPDATE gpkg_ogr_contents SET feature_count = NULL "
+                                                   "WHERE table_name = '%s'" % self.layer.GetName())
+            self._pending = 0
+            self._defn = None
+            self.layer = None
+            self.data_source = None
+        self._restore_config()